@@ -10,6 +10,7 @@ from django.shortcuts import get_object_or_404
 from django.template.response import TemplateResponse
 from django.utils.translation import ugettext_lazy as _
 
+from fleetcore import jobs
 from fleetcore.forms import DeltaForm
 from fleetcore.models import (
     Bill,
@@ -17,6 +18,7 @@ from fleetcore.models import (
     DataPack,
     Fleet,
     FleetUser,
+    Job,
     Penalty,
     Phone,
     Plan,
@@ -31,10 +33,18 @@ class BillAdminForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super(BillAdminForm, self).__init__(*args, **kwargs)
+        self.parse_pending = (
+            self.instance.pk is not None and
+            self.instance.parsing_date is None and
+            jobs.is_parse_pending(self.instance))
         if self.instance.parsing_date is not None:
             self.fields['invoice'] = forms.CharField(
                 widget=forms.TextInput(attrs={'readonly': True, 'size': 70}),
                 initial=self.instance.invoice_filename)
+        elif self.parse_pending:
+            self.fields['invoice'] = forms.CharField(
+                widget=forms.TextInput(attrs={'readonly': True, 'size': 70}),
+                initial=_('Invoice queued for processing.'), required=False)
 
     class Meta:
         model = Bill
@@ -49,13 +59,26 @@ class PenaltyAdmin(admin.StackedInline):
     extra = 0
 
 
+class JobInline(admin.TabularInline):
+    model = Job
+    fields = readonly_fields = (
+        'kind', 'status', 'progress', 'created', 'started', 'finished',
+        'message')
+    ordering = ('-id',)
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 class BillAdmin(admin.ModelAdmin):
 
     form = BillAdminForm
     formfield_overrides = {
         models.TextField: {'widget': TextInput},
     }
-    inlines = (PenaltyAdmin,)
+    inlines = (PenaltyAdmin, JobInline)
     readonly_fields = (
         'taxes', 'consumptions_total', 'outcome_debt', 'outcome_total',
     )
@@ -99,34 +122,18 @@ class BillAdmin(admin.ModelAdmin):
 
     def save_model(self, request, obj, form, change):
         super(BillAdmin, self).save_model(request, obj, form, change)
-        if obj.parsing_date is not None:
+        if obj.parsing_date is not None or form.parse_pending:
             return
 
         invoice = form.cleaned_data['invoice']
-        error_msg = _('Invoice processed unsuccessfully. Error: ')
-        try:
-            obj.parse_invoice(invoice)
-        except Bill.ParseError as e:
-            messages.error(request, error_msg + str(e))
-        else:
-            self.recalculate(request, obj,
-                             msg=_('Invoice processed successfully.'))
-
-    def recalculate(self, request, obj=None, bill_id=None, msg=None):
-        if obj is None:
-            assert bill_id is not None, 'Bill id should not be None'
-            obj = get_object_or_404(self.get_queryset(request), pk=bill_id)
-
-        error_msg = _('Invoice processed unsuccessfully. Error: ')
-
-        try:
-            obj.calculate_penalties()
-        except Bill.AdjustmentError as e:
-            messages.error(request, error_msg + str(e))
-        else:
-            msg = msg or _('Penalties re-calculated successfully.')
-            messages.success(request, msg)
+        jobs.enqueue(obj, Job.PARSE, payload=invoice.read(),
+                     payload_name=invoice.name)
+        messages.info(request, _('Invoice queued for processing.'))
 
+    def recalculate(self, request, bill_id):
+        obj = get_object_or_404(self.get_queryset(request), pk=bill_id)
+        jobs.enqueue(obj, Job.RECALCULATE)
+        messages.info(request, _('Penalties recalculation queued.'))
         return HttpResponseRedirect('..')
 
     def notify_users(self, request, bill_id):
@@ -135,16 +142,8 @@ class BillAdmin(admin.ModelAdmin):
         sender = BillSummarySender(bill=obj)
 
         if request.POST:
-            try:
-                sender.send_reports(dry_run=False)
-            except Exception as e:
-                msg = _('Notification error.')
-                msg += ' Error: %s' % str(e)
-                messages.error(request, msg)
-            else:
-                msg = _('Notifications sent successfully.')
-                messages.success(request, msg)
-
+            jobs.enqueue_notify(obj)
+            messages.info(request, _('Notifications queued for sending.'))
             return HttpResponseRedirect('..')
 
         emails = sender.send_reports(dry_run=True)
@@ -201,6 +200,26 @@ class ConsumptionAdmin(admin.ModelAdmin):
         }),
     )
 
+    def delete_queryset(self, request, queryset):
+        bills = list(Bill.objects.filter(consumption__in=queryset).distinct())
+        super(ConsumptionAdmin, self).delete_queryset(request, queryset)
+        for bill in bills:
+            bill.refresh_totals()
+
+
+class JobAdmin(admin.ModelAdmin):
+    """Admin class for Job."""
+    list_display = (
+        'id', 'bill', 'kind', 'status', 'progress', 'created', 'seconds')
+    list_filter = ('status', 'kind')
+    exclude = ('payload',)
+    readonly_fields = (
+        'bill', 'kind', 'status', 'progress', 'payload_name', 'message',
+        'created', 'started', 'finished', 'seconds')
+
+    def has_add_permission(self, request):
+        return False
+
 
 class PhoneAdmin(admin.ModelAdmin):
     list_display = (
@@ -230,6 +249,7 @@ admin.site.register(Consumption, ConsumptionAdmin)
 admin.site.register(DataPack)
 admin.site.register(Fleet)
 admin.site.register(FleetUser)
+admin.site.register(Job, JobAdmin)
 admin.site.register(Phone, PhoneAdmin)
 admin.site.register(Plan)
 admin.site.register(SMSPack)
@@ -0,0 +1,11 @@
+# coding: utf-8
+
+from django.apps import AppConfig
+
+
+class FleetcoreConfig(AppConfig):
+    name = 'fleetcore'
+
+    def ready(self):
+        # connect the dashboard cache invalidation receivers
+        from fleetcore import viewcache  # noqa
@@ -0,0 +1,177 @@
+# coding: utf-8
+
+import random
+
+from datetime import datetime
+from decimal import Decimal
+
+from fleetcore.pdf2cell import CellularConverter
+
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+FONT_SIZE = 8
+LINE_HEIGHT = 10
+FILLER_LINES = 60
+NAMES = ('Skywalker, Luke', 'Organa, Leia', 'Solo, Han', 'Kenobi, Obi-Wan',
+         'Calrissian, Lando', 'Antilles, Wedge', 'Mothma, Mon')
+PLANS = ('PLAN1', 'PLAN2', 'PLAN3')
+
+
+def _escape(text):
+    return (text.replace('\\', '\\\\').replace('(', '\\(')
+            .replace(')', '\\)'))
+
+
+def _format_price(value):
+    return ('%.2f' % value).replace('.', ',')
+
+
+class InvoiceGenerator(object):
+    """Generate carrier-like invoices, laid out as CellularConverter expects.
+
+    The first page is a cover, the second one has the bill data, the third
+    one has the taxes and a table with one row per phone, and then as many
+    filler (calls detail) pages as requested follow.
+
+    Every text line is drawn followed by a horizontal rule, which is what
+    splits text runs in the parsed pages.
+
+    """
+
+    bill_date = datetime(2011, 10, 13)
+    bill_number = '0001-12345678'
+    bill_total = Decimal('1234.56')
+    bill_debt = Decimal('1358.02')
+    internal_tax = Decimal('4.1667')
+    internal_tax_price = Decimal('12.34')
+    percep_tax = Decimal('3')
+    percep_tax_price = Decimal('10.00')
+    other_tax = Decimal('1')
+    other_tax_price = Decimal('5.00')
+
+    def __init__(self, rows=10, filler_pages=0, seed=0):
+        self.rows = rows
+        self.filler_pages = filler_pages
+        self.random = random.Random(seed)
+        self.phone_data = [self.make_phone_row(i) for i in range(rows)]
+
+    def make_phone_row(self, i):
+        """Return the phone data row, as parsed by CellularConverter."""
+        values = [Decimal(self.random.randint(0, 50000)) / 100
+                  for _ in range(16)]
+        return (['351%07d' % i, self.random.choice(NAMES),
+                 self.random.choice(PLANS)] +
+                [v.quantize(Decimal('0.01')) for v in values])
+
+    def format_phone_row(self, row):
+        phone = '351-' + row[0][3:]
+        return '%s%s%s%s' % (
+            phone.ljust(CellularConverter.phone_length),
+            row[1].ljust(CellularConverter.notes_length),
+            row[2].ljust(CellularConverter.plan_length),
+            ' '.join(_format_price(v) for v in row[3:]))
+
+    @property
+    def expected(self):
+        """The result CellularConverter.gather_phone_info should return."""
+        return {
+            'bill_date': self.bill_date,
+            'bill_number': self.bill_number,
+            'bill_total': self.bill_total,
+            'bill_debt': self.bill_debt,
+            'internal_tax': self.internal_tax / 100,
+            'internal_tax_price': self.internal_tax_price,
+            'other_tax': (self.percep_tax + self.other_tax) / 100,
+            'other_tax_price': self.percep_tax_price + self.other_tax_price,
+            'phone_data': self.phone_data,
+        }
+
+    def pages(self):
+        """Return the text lines for every page of the invoice."""
+        front_page = [
+            'Fecha de Factura: %s' % self.bill_date.strftime('%d/%m/%Y'),
+            'Factura Nro.: %s' % self.bill_number,
+            'TOTAL FACTURA: $%s' % _format_price(self.bill_total).rjust(
+                CellularConverter.bill_total_length, '0'),
+            'TOTAL A PAGAR: $%s' % _format_price(self.bill_debt).rjust(
+                CellularConverter.bill_debt_length, '0'),
+        ]
+        taxes = [
+            'Impuesto Interno %s%% %s' % (
+                self.internal_tax, _format_price(self.internal_tax_price)),
+            'Iva Percepcion %s%% %s' % (
+                self.percep_tax, _format_price(self.percep_tax_price)),
+            'Cargo %s%% financ ENARD Ley 26.573/09 %s' % (
+                self.other_tax, _format_price(self.other_tax_price)),
+        ]
+        table = ['Linea Usuario Plan Abono Consumos Total']
+        table.extend(self.format_phone_row(row) for row in self.phone_data)
+        result = [['Factura de servicios'], front_page, taxes + table]
+        for i in range(self.filler_pages):
+            result.append([
+                'Detalle de llamadas %s: 351-%07d %02d:%02d %s' % (
+                    j, self.random.randint(0, self.rows), j % 24, j % 60,
+                    _format_price(Decimal(j) / 10))
+                for j in range(FILLER_LINES)])
+        return result
+
+    def content_stream(self, lines):
+        commands = []
+        y = PAGE_HEIGHT - 2 * LINE_HEIGHT
+        for line in lines:
+            commands.append('BT /F1 %s Tf 20 %s Td (%s) Tj ET' % (
+                FONT_SIZE, y, _escape(line)))
+            commands.append('20 %s m %s %s l S' % (
+                y - 2, PAGE_WIDTH - 20, y - 2))
+            y -= LINE_HEIGHT
+        return '\n'.join(commands).encode('latin-1')
+
+    def render(self):
+        """Return the invoice PDF content."""
+        pages = self.pages()
+        # objects 1 and 2 are the catalog and the pages tree, 3 is the font
+        # and every page takes two more objects: itself and its content
+        page_ids = [4 + 2 * i for i in range(len(pages))]
+        objects = [
+            b'<< /Type /Catalog /Pages 2 0 R >>',
+            ('<< /Type /Pages /Kids [%s] /Count %s >>' % (
+                ' '.join('%s 0 R' % i for i in page_ids),
+                len(pages))).encode('ascii'),
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+            b'/Encoding /WinAnsiEncoding >>',
+        ]
+        for page_id, lines in zip(page_ids, pages):
+            objects.append((
+                '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %s %s] '
+                '/Resources << /Font << /F1 3 0 R >> >> '
+                '/Contents %s 0 R >>' % (
+                    PAGE_WIDTH, PAGE_HEIGHT, page_id + 1)).encode('ascii'))
+            stream = self.content_stream(lines)
+            objects.append(
+                ('<< /Length %s >>\nstream\n' % len(stream)).encode('ascii') +
+                stream + b'\nendstream')
+
+        content = [b'%PDF-1.4\n']
+        offsets = []
+        size = len(content[0])
+        for i, obj in enumerate(objects, start=1):
+            offsets.append(size)
+            chunk = b'%d 0 obj\n' % i + obj + b'\nendobj\n'
+            content.append(chunk)
+            size += len(chunk)
+
+        xref = ['xref', '0 %s' % (len(objects) + 1), '0000000000 65535 f ']
+        xref.extend('%010d 00000 n ' % offset for offset in offsets)
+        content.append(('\n'.join(xref) + '\n').encode('ascii'))
+        content.append((
+            'trailer\n<< /Size %s /Root 1 0 R >>\nstartxref\n%s\n%%%%EOF\n' %
+            (len(objects) + 1, size)).encode('ascii'))
+        return b''.join(content)
+
+
+def make_invoice(rows=10, filler_pages=0, seed=0):
+    """Return (content, expected) for a generated invoice."""
+    generator = InvoiceGenerator(
+        rows=rows, filler_pages=filler_pages, seed=seed)
+    return generator.render(), generator.expected
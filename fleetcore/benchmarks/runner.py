@@ -0,0 +1,103 @@
+# coding: utf-8
+
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+
+from time import perf_counter
+
+from fleetcore import pdf2cell
+from fleetcore.benchmarks.invoicegen import make_invoice
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+SIZES = (10, 1000, 10000)
+FILLER_PAGES = 20
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X, and in kilobytes elsewhere
+    if sys.platform != 'darwin':
+        peak *= 1024
+    return peak / (1024 * 1024)
+
+
+def _parse(filename, repeat, kwargs):
+    """Parse the invoice repeat times, return the best time and peak RSS."""
+    times = []
+    for _ in range(repeat):
+        with open(filename, 'rb') as f:
+            start = perf_counter()
+            result = pdf2cell.parse_file(f, **kwargs)
+            times.append(perf_counter() - start)
+    return min(times), _peak_rss_mb(), len(result['phone_data'])
+
+
+def make_label(rows, filler_pages, **kwargs):
+    options = ''.join(' %s=%s' % i for i in sorted(kwargs.items()) if i[1])
+    return 'rows=%s filler_pages=%s%s' % (rows, filler_pages, options)
+
+
+def run(rows, filler_pages=FILLER_PAGES, repeat=3, **kwargs):
+    """Benchmark parsing a generated invoice, return the measures as a dict.
+
+    The invoice is parsed in a new process, so the peak RSS does not depend
+    on what this process (or a previous benchmark) allocated.
+
+    """
+    content, expected = make_invoice(rows=rows, filler_pages=filler_pages)
+    fd, filename = tempfile.mkstemp(suffix='.pdf')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            seconds, peak_rss_mb, parsed_rows = pool.apply(
+                _parse, (filename, repeat, kwargs))
+    finally:
+        os.remove(filename)
+
+    if parsed_rows != rows:
+        raise ValueError(
+            'Parsed %s rows out of %s generated.' % (parsed_rows, rows))
+    return dict(
+        rows=rows, filler_pages=filler_pages, seconds=round(seconds, 4),
+        peak_rss_mb=round(peak_rss_mb, 1),
+        rows_per_second=round(rows / seconds, 1))
+
+
+def load_baseline(filename=BASELINE):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(results, filename=BASELINE):
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+        f.write('\n')
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Return the regressions of results against baseline, as messages.
+
+    A measure regresses when it is worse than its baseline value by more
+    than tolerance (a fraction of the baseline value).
+
+    """
+    regressions = []
+    for label, result in sorted(results.items()):
+        expected = baseline.get(label)
+        if expected is None:
+            continue
+        for measure in ('seconds', 'peak_rss_mb'):
+            limit = expected[measure] * (1 + tolerance)
+            if result[measure] > limit:
+                regressions.append('%s: %s is %s, baseline is %s.' % (
+                    label, measure, result[measure], expected[measure]))
+    return regressions
@@ -1,26 +1,84 @@
 from functools import wraps
+from threading import Lock
+from time import monotonic
 
 from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.http import Http404
 from django.shortcuts import get_object_or_404
 
 
 User = get_user_model()
+# seconds a user is kept in the leadership cache
+LEADERSHIP_CACHE_TIMEOUT = 60
+
+
+class LeadershipCache(object):
+    """Per process cache of the users checked by leadership_required.
+
+    Only the field values are kept, so every request gets its own user
+    instance. Entries expire after timeout seconds, or once the user is
+    saved or deleted in this process.
+
+    """
+
+    def __init__(self, timeout=LEADERSHIP_CACHE_TIMEOUT):
+        self.timeout = timeout
+        self._entries = {}
+        self._lock = Lock()
+
+    def get(self, username):
+        """Return the user with username, fetching it if not cached."""
+        entry = self._entries.get(username)
+        if entry is not None and entry[0] > monotonic():
+            _, _, db, names, values = entry
+            return User.from_db(db, names, values)
+
+        user = get_object_or_404(User, username=username)
+        names = [f.attname for f in User._meta.concrete_fields]
+        values = [getattr(user, name) for name in names]
+        with self._lock:
+            self._entries[username] = (
+                monotonic() + self.timeout, user.pk, user._state.db, names,
+                values)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries = {
+                username: entry for username, entry in self._entries.items()
+                if entry[1] != user_id}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+leadership_cache = LeadershipCache()
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_leadership(sender, instance, **kwargs):
+    leadership_cache.invalidate(instance.pk)
 
 
 def leadership_required(view_func):
     """Decorator that checks logged in user has access to another user data.
 
-    It requires the decorated view to take 'username' as first argument.
+    It requires the decorated view to take 'username' as first argument,
+    and the view gets the user with that username instead.
     It would raise a 404 if user is not allowed to get the details.
 
     """
     @wraps(view_func)
     def _decorated_view(request, username, *args, **kwargs):
-        another_user = get_object_or_404(User, username=username)
+        another_user = leadership_cache.get(username)
 
-        if request.user.is_superuser or another_user.leader == request.user:
-            return view_func(request, username, *args, **kwargs)
+        if request.user.is_superuser or (
+                request.user.is_authenticated and
+                another_user.leader_id == request.user.pk):
+            return view_func(request, another_user, *args, **kwargs)
         else:
             raise Http404
     return _decorated_view
@@ -0,0 +1,197 @@
+# coding: utf-8
+
+import cProfile
+import logging
+import socket
+import threading
+
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from django.utils.module_loading import import_string
+
+
+DEFAULT_INSTRUMENTATION = {
+    'SINKS': [{'BACKEND': 'fleetcore.instrumentation.LoggingSink'}],
+    'PROFILE_DIR': None,
+}
+_local = threading.local()
+
+
+class LoggingSink(object):
+    """Log every record as a key=value line."""
+
+    def __init__(self, logger='fleetcore.instrumentation'):
+        self.logger = logging.getLogger(logger)
+
+    def emit(self, recorder):
+        items = ['name=%s' % recorder.name]
+        items.extend('%s=%s' % i for i in recorder.tags.items())
+        items.extend(
+            '%s_ms=%.1f' % (k, v * 1000) for k, v in recorder.timings.items())
+        items.extend('%s=%s' % i for i in recorder.counters.items())
+        self.logger.info(' '.join(items))
+
+
+class StatsdSink(object):
+    """Send every record to a statsd compatible daemon, over UDP.
+
+    Timings are sent as <prefix>.<name>.<phase>:<ms>|ms and counters as
+    <prefix>.<name>.<counter>:<amount>|c, tags are not sent.
+
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='fleetcore'):
+        self.address = (host, port)
+        self.prefix = prefix
+
+    def lines(self, recorder):
+        prefix = '%s.%s' % (self.prefix, recorder.name)
+        for phase, seconds in recorder.timings.items():
+            yield '%s.%s:%.3f|ms' % (prefix, phase, seconds * 1000)
+        for counter, amount in recorder.counters.items():
+            yield '%s.%s:%s|c' % (prefix, counter, amount)
+
+    def emit(self, recorder):
+        data = '\n'.join(self.lines(recorder)).encode('utf-8')
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.sendto(data, self.address)
+        except OSError as e:
+            logging.warning('Could not send stats to %s:%s (%s).',
+                            self.address[0], self.address[1], e)
+        finally:
+            sock.close()
+
+
+def get_config():
+    return getattr(settings, 'INSTRUMENTATION', DEFAULT_INSTRUMENTATION)
+
+
+def get_sinks():
+    """Return the sinks configured in settings.INSTRUMENTATION."""
+    sinks = []
+    for config in get_config().get('SINKS', []):
+        options = {k.lower(): v for k, v in config.items() if k != 'BACKEND'}
+        sinks.append(import_string(config['BACKEND'])(**options))
+    return sinks
+
+
+class Recorder(object):
+    """Timings (in seconds) and counters of a named run, like an upload."""
+
+    def __init__(self, name, sinks=(), **tags):
+        self.name = name
+        self.sinks = sinks
+        self.tags = OrderedDict(sorted(tags.items()))
+        self.timings = OrderedDict()
+        self.counters = OrderedDict()
+
+    def add_time(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0) + seconds
+
+    def incr(self, counter, amount=1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def emit(self):
+        for sink in self.sinks:
+            sink.emit(self)
+
+
+def current():
+    """Return the Recorder of the run in progress in this thread, if any."""
+    return getattr(_local, 'recorder', None)
+
+
+@contextmanager
+def record(name, sinks=None, profile_path=None, **tags):
+    """Record the timings and counters of the enclosed run.
+
+    Queries issued in this thread are counted, and the recorder is sent to
+    the sinks (the configured ones if None) once the run ends. If
+    profile_path is given, the run is profiled and its pstats dumped there.
+
+    """
+    if sinks is None:
+        sinks = get_sinks()
+    recorder = Recorder(name, sinks, **tags)
+    previous, _local.recorder = current(), recorder
+    profiler = cProfile.Profile() if profile_path else None
+    queries = QueryStats()
+    try:
+        with counting_queries(queries):
+            if profiler is not None:
+                profiler.enable()
+            try:
+                yield recorder
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+    finally:
+        _local.recorder = previous
+        if profiler is not None:
+            profiler.dump_stats(profile_path)
+        recorder.incr('queries', queries.queries)
+        recorder.emit()
+
+
+class QueryStats(object):
+    """Amount of queries run, and the seconds spent running them."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def execute(self, execute, sql, params, many, context):
+        """Database execute wrapper counting and timing the queries."""
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += perf_counter() - start
+            self.queries += 1
+
+
+@contextmanager
+def counting_queries(stats=None):
+    """Count and time the queries run by the enclosed block.
+
+    Queries on every DB connection are added to stats (a new QueryStats
+    if None), which is returned by the context manager.
+
+    """
+    if stats is None:
+        stats = QueryStats()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats.execute))
+        yield stats
+
+
+@contextmanager
+def timer(phase, timings=None):
+    """Time the enclosed block as phase of the run in progress.
+
+    The seconds are also stored in timings[phase], if timings is given.
+
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        seconds = perf_counter() - start
+        if timings is not None:
+            timings[phase] = seconds
+        recorder = current()
+        if recorder is not None:
+            recorder.add_time(phase, seconds)
+
+
+def incr(counter, amount=1):
+    """Increment counter in the run in progress, if any."""
+    recorder = current()
+    if recorder is not None:
+        recorder.incr(counter, amount)
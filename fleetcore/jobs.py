@@ -0,0 +1,170 @@
+# coding: utf-8
+
+import json
+import logging
+import os
+
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.utils.timezone import now
+
+from fleetcore import instrumentation
+from fleetcore.models import Bill, Job
+from fleetcore.sendbills import BillSummarySender
+
+
+DEFAULT_JOB_TIMEOUT = 60 * 60
+
+
+class JobError(Exception):
+    """The job could not be completed."""
+
+
+def enqueue(bill, kind, payload=None, payload_name=''):
+    """Create a pending job of the given kind for bill."""
+    return Job.objects.create(
+        bill=bill, kind=kind, payload=payload, payload_name=payload_name)
+
+
+def enqueue_notify(bill):
+    """Create a pending notify job for bill.
+
+    If the last notification of the bill failed, only the leaders it did
+    not reach are notified, so nobody gets the report twice.
+
+    """
+    last = Job.objects.filter(bill=bill, kind=Job.NOTIFY).order_by(
+        '-id').first()
+    payload = None
+    if last is not None and last.status == Job.FAILED:
+        payload = last.payload
+    return enqueue(bill, Job.NOTIFY, payload=payload)
+
+
+def is_parse_pending(bill):
+    """Return whether bill has a parse job waiting or running."""
+    return Job.objects.filter(
+        bill=bill, kind=Job.PARSE,
+        status__in=(Job.PENDING, Job.RUNNING)).exists()
+
+
+def fail_abandoned():
+    """Mark as failed the jobs running for longer than JOB_TIMEOUT.
+
+    Their worker most likely died, and they would be running forever.
+
+    """
+    timeout = getattr(settings, 'JOB_TIMEOUT', DEFAULT_JOB_TIMEOUT)
+    return Job.objects.filter(
+        status=Job.RUNNING,
+        started__lt=now() - timedelta(seconds=timeout)).update(
+            status=Job.FAILED, finished=now(),
+            message='Job abandoned after running for more than %s seconds.'
+            % timeout)
+
+
+def claim_next():
+    """Mark the oldest pending job as running and return it, if any.
+
+    A job is claimed with a conditional UPDATE, so several workers can
+    share the same queue without any locking support from the DB. Jobs
+    abandoned by a dead worker are marked as failed first.
+
+    """
+    fail_abandoned()
+    pending = Job.objects.filter(status=Job.PENDING).order_by('id')
+    for job_id in pending.values_list('id', flat=True)[:10]:
+        claimed = Job.objects.filter(id=job_id, status=Job.PENDING).update(
+            status=Job.RUNNING, started=now())
+        if claimed:
+            return Job.objects.select_related('bill').get(id=job_id)
+    return None
+
+
+def set_progress(job, progress):
+    job.progress = progress
+    Job.objects.filter(id=job.id).update(progress=progress)
+
+
+def profile_path(job):
+    """Return where to dump the job profile, if profiling is enabled."""
+    profile_dir = instrumentation.get_config().get('PROFILE_DIR')
+    if not profile_dir:
+        return None
+    os.makedirs(profile_dir, exist_ok=True)
+    return os.path.join(
+        profile_dir, 'bill-%s-job-%s.pstats' % (job.bill_id, job.id))
+
+
+def parse_invoice(job):
+    invoice = BytesIO(bytes(job.payload))
+    invoice.name = job.payload_name
+    path = profile_path(job)
+    with instrumentation.record(
+            'invoice', profile_path=path, bill=job.bill_id, job=job.id):
+        try:
+            job.bill.parse_invoice(invoice)
+        except Bill.ParseError as e:
+            raise JobError('Invoice processed unsuccessfully. Error: %s' % e)
+        set_progress(job, 60)
+        with instrumentation.timer('penalties'):
+            recalculate(job)
+    if path is not None:
+        return 'Invoice processed successfully (profile: %s).' % path
+    return 'Invoice processed successfully.'
+
+
+def recalculate(job):
+    try:
+        job.bill.calculate_penalties()
+    except Bill.AdjustmentError as e:
+        raise JobError('Invoice processed unsuccessfully. Error: %s' % e)
+    return 'Penalties re-calculated successfully.'
+
+
+def notify(job):
+    sender = BillSummarySender(job.bill)
+    messages = sender.build_messages()
+    if job.payload is not None:
+        # the email of the leaders a previous notification did not reach
+        emails = set(json.loads(bytes(job.payload).decode('utf-8')))
+        messages = [m for m in messages if m.to[0] in emails]
+    report = sender.deliver(messages)
+    failed = [r for r in report if not r['sent']]
+    if failed:
+        # kept by the failed job, to only retry these ones
+        job.payload = json.dumps(
+            [r['recipients'][0] for r in failed]).encode('utf-8')
+        raise JobError('Notification error. Error: %s' % '; '.join(
+            '%s (%s)' % (', '.join(r['recipients']), r['error'])
+            for r in failed))
+    return 'Notifications sent successfully (%s).' % len(report)
+
+
+RUNNERS = {
+    Job.PARSE: parse_invoice,
+    Job.RECALCULATE: recalculate,
+    Job.NOTIFY: notify,
+}
+
+
+def run(job):
+    """Run a claimed job, storing its result."""
+    try:
+        job.message = RUNNERS[job.kind](job)
+    except Exception as e:
+        if not isinstance(e, JobError):
+            logging.exception('Job %s failed.', job.id)
+        job.status = Job.FAILED
+        job.message = str(e) or e.__class__.__name__
+    else:
+        job.status = Job.DONE
+        job.progress = 100
+        # the input is not needed anymore
+        job.payload = None
+    job.finished = now()
+    job.save(update_fields=[
+        'status', 'progress', 'message', 'payload', 'finished'])
+    return job
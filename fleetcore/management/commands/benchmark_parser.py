@@ -0,0 +1,71 @@
+# coding: utf-8
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fleetcore.benchmarks import runner
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark parsing generated invoices of different sizes, and '
+        'compare parse time and peak memory against a baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-s', '--sizes', type=int, nargs='+', default=runner.SIZES,
+            help='Amount of phone rows of the generated invoices.')
+        parser.add_argument(
+            '-f', '--filler-pages', type=int, default=runner.FILLER_PAGES,
+            help='Amount of pages after the phone rows table.')
+        parser.add_argument(
+            '-r', '--repeat', type=int, default=3,
+            help='Parse every invoice this many times, keep the best time.')
+        parser.add_argument(
+            '-b', '--baseline', default=runner.BASELINE,
+            help='JSON file with the baseline results.')
+        parser.add_argument(
+            '-t', '--tolerance', type=float, default=0.2,
+            help='Allowed regression, as a fraction of the baseline value.')
+        parser.add_argument(
+            '--save', action='store_true',
+            help='Store the results as the new baseline.')
+        parser.add_argument(
+            '--text-only', action='store_true',
+            help='Parse with the text only backend.')
+        parser.add_argument(
+            '--full-scan', action='store_true',
+            help='Interpret every page of the invoices.')
+        parser.add_argument(
+            '-w', '--workers', type=int, default=None,
+            help='Interpret the pages in this many processes.')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1 or min(options['sizes']) < 1:
+            raise CommandError('Invalid amount of repetitions or sizes.')
+
+        kwargs = dict(
+            text_only=options['text_only'], full_scan=options['full_scan'],
+            workers=options['workers'])
+        baseline = runner.load_baseline(options['baseline'])
+        results = {}
+        for rows in options['sizes']:
+            label = runner.make_label(
+                rows, options['filler_pages'], **kwargs)
+            result = runner.run(
+                rows, options['filler_pages'], options['repeat'], **kwargs)
+            results[label] = result
+            self.stdout.write(
+                '%s: %.4f seconds, %.1f MB peak RSS, %.1f rows/second' % (
+                    label, result['seconds'], result['peak_rss_mb'],
+                    result['rows_per_second']))
+
+        if options['save']:
+            baseline.update(results)
+            runner.save_baseline(baseline, options['baseline'])
+            return
+
+        regressions = runner.compare(
+            results, baseline, options['tolerance'])
+        if regressions:
+            raise CommandError(
+                'Regressions found:\n%s' % '\n'.join(regressions))
@@ -0,0 +1,130 @@
+# coding: utf-8
+
+import glob
+import json
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fleetcore import pdf2cell
+
+
+def parse_invoice_file(filename, full_scan=False):
+    """Parse the invoice in filename, return a JSON serializable dict.
+
+    Errors are reported in the result instead of being raised, so a broken
+    invoice does not stop the rest from being parsed.
+
+    """
+    start = perf_counter()
+    result = error = None
+    try:
+        with open(filename, 'rb') as f:
+            result = pdf2cell.parse_file(f, full_scan=full_scan)
+    except Exception as e:
+        error = '%s: %s' % (e.__class__.__name__, e)
+    else:
+        result = pdf2cell.result_to_json(result)
+    return dict(
+        filename=filename, result=result, error=error,
+        seconds=round(perf_counter() - start, 3))
+
+
+def _parse_invoice_file(args):
+    return parse_invoice_file(*args)
+
+
+def load_results(fd):
+    """Yield (filename, result, error) for every line written by Command.
+
+    Results are converted back to what pdf2cell.parse_file returns, so they
+    can be loaded with Bill.load_invoice_data.
+
+    """
+    for line in fd:
+        if not line.strip():
+            continue
+        data = json.loads(line)
+        result = data['result']
+        if result is not None:
+            result = pdf2cell.result_from_json(result)
+        yield data['filename'], result, data['error']
+
+
+class Command(BaseCommand):
+    help = (
+        'Parse every invoice PDF found in the given directories or globs, '
+        'in parallel, writing one JSON line per invoice to the output.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='+', metavar='path',
+            help='Directory (all its *.pdf files are used) or glob.')
+        parser.add_argument(
+            '-o', '--output', default='-',
+            help='JSON lines file for the results (default: stdout).')
+        parser.add_argument(
+            '-w', '--workers', type=int, default=os.cpu_count(),
+            help='Amount of worker processes, 0 to parse in this process '
+                 '(default: amount of CPUs).')
+        parser.add_argument(
+            '-c', '--chunksize', type=int, default=1,
+            help='Amount of invoices sent to a worker at once (default: 1).')
+        parser.add_argument(
+            '--full-scan', action='store_true',
+            help='Interpret every page of the invoices.')
+
+    def find_invoices(self, paths):
+        result = []
+        for path in paths:
+            if os.path.isdir(path):
+                path = os.path.join(path, '*.pdf')
+            result.extend(sorted(glob.glob(path)))
+        return result
+
+    def handle(self, *args, **options):
+        filenames = self.find_invoices(options['paths'])
+        if not filenames:
+            raise CommandError('No invoices found in %s.' %
+                               ', '.join(options['paths']))
+        if options['workers'] < 0 or options['chunksize'] < 1:
+            raise CommandError('Invalid amount of workers or chunk size.')
+
+        tasks = [(f, options['full_scan']) for f in filenames]
+        if options['output'] == '-':
+            output = self.stdout
+        else:
+            output = open(options['output'], 'w')
+
+        start = perf_counter()
+        errors = 0
+        try:
+            if options['workers'] == 0:
+                results = map(_parse_invoice_file, tasks)
+                errors = self.write_results(results, output)
+            else:
+                with ProcessPoolExecutor(options['workers']) as executor:
+                    results = executor.map(
+                        _parse_invoice_file, tasks,
+                        chunksize=options['chunksize'])
+                    errors = self.write_results(results, output)
+        finally:
+            if output is not self.stdout:
+                output.close()
+        elapsed = perf_counter() - start
+
+        self.stderr.write(
+            'Parsed %s invoices (%s errors) in %.2f seconds, %.2f '
+            'invoices/second.' % (len(filenames), errors, elapsed,
+                                  len(filenames) / elapsed))
+
+    def write_results(self, results, output):
+        errors = 0
+        for result in results:
+            if result['error'] is not None:
+                errors += 1
+            output.write(json.dumps(result, sort_keys=True) + '\n')
+        return errors
@@ -0,0 +1,36 @@
+# coding: utf-8
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from fleetcore.models import Bill, BillTotal
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the bill totals summaries from the bills consumptions, '
+        'for every bill or only the given ones.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'bill_ids', nargs='*', type=int, metavar='bill_id',
+            help='Id of a bill to rebuild the totals for (default: all).')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        bills = Bill.objects.order_by('id')
+        if options['bill_ids']:
+            bills = bills.filter(id__in=options['bill_ids'])
+            missing = set(options['bill_ids']) - set(
+                bills.values_list('id', flat=True))
+            if missing:
+                raise CommandError('Bills %s do not exist.' % ', '.join(
+                    str(i) for i in sorted(missing)))
+        else:
+            BillTotal.objects.all().delete()
+
+        count = 0
+        for bill in bills:
+            bill.rebuild_totals()
+            count += 1
+        self.stdout.write('Rebuilt totals for %s bills.' % count)
@@ -0,0 +1,49 @@
+# coding: utf-8
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+
+from fleetcore import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run the pending background jobs, waiting for new ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once there are no pending jobs.')
+        parser.add_argument(
+            '-i', '--interval', type=float, default=2,
+            help='Seconds to wait between checks for new jobs.')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                # there is no request cycle to drop the broken or expired
+                # connections, like the ones to a restarted database
+                close_old_connections()
+                try:
+                    job = jobs.claim_next()
+                except DatabaseError as e:
+                    if options['once']:
+                        raise
+                    self.stderr.write('Could not claim a job: %s' % e)
+                    time.sleep(options['interval'])
+                    continue
+                if job is None:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+                    continue
+                self.run_job(job)
+        except KeyboardInterrupt:
+            pass
+
+    def run_job(self, job):
+        self.stdout.write('Running %s.' % job)
+        jobs.run(job)
+        self.stdout.write('%s: %s (%.2f seconds).' % (
+            job, job.message, job.seconds))
@@ -0,0 +1,108 @@
+# coding: utf-8
+
+import logging
+import threading
+
+from time import perf_counter
+
+from django.template.backends.django import DjangoTemplates
+
+from fleetcore import instrumentation
+
+
+logger = logging.getLogger('fleetcore.requests')
+_local = threading.local()
+
+
+class RequestStats(object):
+    """Queries, SQL time, template render time and wall time of a request.
+
+    Times are in seconds.
+
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.seconds = 0.0
+
+    def server_timing(self):
+        """Return the stats as a Server-Timing header value."""
+        return (
+            'db;desc="%s queries";dur=%.1f, tpl;desc="Templates";dur=%.1f, '
+            'total;desc="Total";dur=%.1f' % (
+                self.queries, self.sql_seconds * 1000,
+                self.template_seconds * 1000, self.seconds * 1000))
+
+
+def current_stats():
+    """Return the RequestStats of the request being handled, if any."""
+    return getattr(_local, 'stats', None)
+
+
+class TimedTemplate(object):
+    """Template wrapper adding its render time to the current request."""
+
+    def __init__(self, template):
+        self.template = template
+
+    @property
+    def origin(self):
+        return self.template.origin
+
+    def render(self, context=None, request=None):
+        stats = current_stats()
+        start = perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            if stats is not None:
+                stats.template_seconds += perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Django templates backend timing every template render."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(
+            super(TimedDjangoTemplates, self).from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(
+            super(TimedDjangoTemplates, self).get_template(template_name))
+
+
+class InstrumentationMiddleware(object):
+    """Record the RequestStats of every request.
+
+    They are sent in the Server-Timing header, logged to the
+    'fleetcore.requests' logger, and set as the response request_stats.
+
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = _local.stats = RequestStats()
+        start = perf_counter()
+        try:
+            with instrumentation.counting_queries() as queries:
+                response = self.get_response(request)
+        finally:
+            _local.stats = None
+        stats.seconds = perf_counter() - start
+        stats.queries = queries.queries
+        stats.sql_seconds = queries.seconds
+
+        response['Server-Timing'] = stats.server_timing()
+        response.request_stats = stats
+        match = request.resolver_match
+        logger.info(
+            'method=%s path=%s view=%s status=%s queries=%s sql_ms=%.1f '
+            'template_ms=%.1f total_ms=%.1f', request.method, request.path,
+            match.view_name if match else '-', response.status_code,
+            stats.queries, stats.sql_seconds * 1000,
+            stats.template_seconds * 1000, stats.seconds * 1000)
+        return response
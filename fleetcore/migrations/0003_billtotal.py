@@ -0,0 +1,32 @@
+# Generated by Django 2.1.2 on 2026-10-17 02:32
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import fleetcore.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fleetcore', '0002_auto_20180219_1740'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', fleetcore.fields.MoneyField(decimal_places=3, default=Decimal('0'), max_digits=10)),
+                ('lines', models.PositiveIntegerField(default=0)),
+                ('mins', fleetcore.fields.MinuteField(decimal_places=2, default=Decimal('0'), max_digits=10)),
+                ('sms', fleetcore.fields.SMSField(default=0)),
+                ('bill', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='fleetcore.Bill')),
+                ('leader', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('bill', 'leader')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.1.2 on 2026-10-17 03:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fleetcore', '0003_billtotal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('parse', 'Parse invoice'), ('recalculate', 'Recalculate penalties'), ('notify', 'Notify users')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='pending', max_length=20)),
+                ('progress', models.PositiveSmallIntegerField(default=0, verbose_name='Progress (%)')),
+                ('payload', models.BinaryField(blank=True, null=True)),
+                ('payload_name', models.CharField(blank=True, max_length=512)),
+                ('message', models.TextField(blank=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('bill', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='fleetcore.Bill')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.2 on 2026-10-17 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fleetcore', '0004_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bill',
+            name='last_modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
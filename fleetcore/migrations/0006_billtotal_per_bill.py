@@ -0,0 +1,33 @@
+# Generated by Django 2.1.2 on 2026-10-17 12:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def delete_leader_totals(apps, schema_editor):
+    BillTotal = apps.get_model('fleetcore', 'BillTotal')
+    BillTotal.objects.filter(leader__isnull=False).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fleetcore', '0005_bill_last_modified_datetime'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_leader_totals, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='billtotal',
+            unique_together=set(),
+        ),
+        migrations.RemoveField(
+            model_name='billtotal',
+            name='leader',
+        ),
+        migrations.AlterField(
+            model_name='billtotal',
+            name='bill',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='fleetcore.Bill'),
+        ),
+    ]
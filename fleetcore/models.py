@@ -2,14 +2,24 @@
 
 import logging
 
+from bisect import bisect_right
 from collections import defaultdict, OrderedDict
 from decimal import Decimal
-from itertools import tee
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models, transaction
-from django.db.models import F, Sum
+from django.db import connections, models, router, transaction
+from django.db.models import (
+    Case,
+    Count,
+    ExpressionWrapper,
+    F,
+    Func,
+    Sum,
+    Value,
+    When,
+)
+from django.utils.functional import cached_property
 from django.utils.timezone import now
 
 from fleetcore.fields import (
@@ -18,7 +28,7 @@ from fleetcore.fields import (
     SMSField,
     TaxField,
 )
-from fleetcore import pdf2cell
+from fleetcore import instrumentation, parsecache, pdf2cell
 from fleetcore.pdf2cell import (
     EXCEEDED_MIN,
     EXCEEDED_MIN_PRICE,
@@ -40,13 +50,124 @@ from fleetcore.pdf2cell import (
     TOTAL_PRICE,
     USER,
 )
-
-
-def pairwise(iterable):
-    "s -> (s0,s1), (s1,s2), (s2, s3), ..."
-    a, b = tee(iterable)
-    next(b, None)
-    return zip(a, b)
+from fleetcore.signals import consumptions_changed
+
+
+# the CASE expressions grow with the batch, and the DB cost of each UPDATE
+# grows faster than its size, so batches are kept small (some backends,
+# like PostgreSQL, would otherwise update every object at once)
+BULK_UPDATE_BATCH_SIZE = 500
+
+
+def bulk_update(objs, fields):
+    """Store the given fields of every object in objs, in a few UPDATEs.
+
+    Objects are updated in batches, one UPDATE per batch, setting every
+    field with a CASE WHEN over the objects' primary keys.
+
+    """
+    objs = list(objs)
+    if not objs:
+        return
+    model = objs[0]._meta.model
+    db = router.db_for_write(model)
+    fields = [model._meta.get_field(name) for name in fields]
+    # every object takes a primary key and a value per field, plus its pk
+    # in the WHERE clause
+    batch_size = max(min(connections[db].ops.bulk_batch_size(
+        [None] * (2 * len(fields) + 1), objs), BULK_UPDATE_BATCH_SIZE), 1)
+    with transaction.atomic(using=db, savepoint=False):
+        for i in range(0, len(objs), batch_size):
+            batch = objs[i:i + batch_size]
+            values = {
+                field.attname: Case(*[
+                    When(pk=obj.pk, then=Value(
+                        getattr(obj, field.attname), output_field=field))
+                    for obj in batch], output_field=field)
+                for field in fields}
+            model._default_manager.using(db).filter(
+                pk__in=[obj.pk for obj in batch]).update(**values)
+
+
+class RoundHalfEven(Func):
+    """Round to an integer, with ties going to the even neighbour.
+
+    This is how Python's round works for Decimals, while SQL's ROUND
+    rounds ties away from zero.
+
+    """
+
+    template = (
+        'CASE WHEN ABS(ROUND(%(expressions)s) - %(expressions)s) = 0.5 '
+        'THEN 2 * ROUND(%(expressions)s / 2) '
+        'ELSE ROUND(%(expressions)s) END')
+    arity = 1
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = super(RoundHalfEven, self).as_sql(
+            compiler, connection, **extra_context)
+        # the expression is used four times in the template
+        return sql, params * 4
+
+
+def calculate_totals(consumption, plan, penalty, taxes):
+    """Return the calculated fields for consumption, as a dict.
+
+    plan is the consumption's plan, penalty the one for that plan in the
+    consumption's bill (or None if there is no penalty), and taxes are the
+    bill's taxes. Nothing is read from the DB.
+
+    """
+    c = consumption
+    mins = Decimal(c.included_min) + Decimal(c.exceeded_min)
+
+    total = c.reported_total
+    if plan.with_min_clearing:
+        total -= c.monthly_price
+        # we now need the exceeded_min to be included since those seem to
+        # be used against Claro lines
+        # other_diff = abs(c.other_price - c.exceeded_min_price)
+        total += (
+            (Decimal(mins) + Decimal(c.penalty_min)) *
+            Decimal(plan.price_min))
+
+        if plan.with_sms_clearing:
+            # calculate real amount of sms to be charged for
+            total += (c.sms + c.penalty_sms) * plan.price_sms
+            # XXX: potential issue: is there are not SMS penalties,
+            # (i.e. all SMS were consumed), we need to substract the
+            # exceeding SMS being charged in the sms_price column
+            if penalty is None or penalty.sms == 0:
+                total -= c.sms_price
+
+    # add any needed extra
+    total_before_round = total * (Decimal('1') + taxes) + c.extra
+    return dict(
+        mins=mins, total_before_taxes=total, taxes=taxes,
+        total_before_round=total_before_round,
+        total=round(total_before_round))
+
+
+class TotalsContext(object):
+    """The plans, penalties and taxes to calculate a bill's totals with.
+
+    plans is a dict of plans by id and penalties a dict of the bill's
+    penalties by plan id. Consumptions whose plan is not in plans use their
+    own plan instead.
+
+    """
+
+    def __init__(self, taxes, plans=None, penalties=None):
+        self.taxes = taxes
+        self.plans = plans or {}
+        self.penalties = penalties or {}
+
+    def update_totals(self, consumption):
+        plan = self.plans.get(consumption.plan_id)
+        if plan is None:
+            plan = consumption.plan
+        consumption.update_totals(
+            plan, self.penalties.get(consumption.plan_id), self.taxes)
 
 
 class FleetUser(AbstractUser):
@@ -54,6 +175,19 @@ class FleetUser(AbstractUser):
         settings.AUTH_USER_MODEL, related_name='leadering', null=True,
         on_delete=models.CASCADE)
 
+    # the leader stored in the DB, to tell the previous one on save
+    stored_leader_id = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super(FleetUser, cls).from_db(db, field_names, values)
+        user.stored_leader_id = user.__dict__.get('leader_id')
+        return user
+
+    def save(self, *args, **kwargs):
+        super(FleetUser, self).save(*args, **kwargs)
+        self.stored_leader_id = self.leader_id
+
     def __str__(self):
         leader = self.leader
         if self.leader is not None:
@@ -102,7 +236,7 @@ class Bill(models.Model):
     other_tax = TaxField(default=Decimal('0.04'))
     notes = models.TextField(blank=True)
     created = models.DateField(auto_now_add=True)
-    last_modified = models.DateField(auto_now=True)
+    last_modified = models.DateTimeField(auto_now=True)
 
     class ParseError(Exception):
         """The invoice could not be parsed."""
@@ -117,8 +251,17 @@ class Bill(models.Model):
     def taxes(self):
         return self.internal_tax + self.iva_tax + self.other_tax
 
+    @cached_property
+    def summary(self):
+        """This bill's BillTotal, None if its totals were never refreshed."""
+        return BillTotal.objects.filter(bill=self).first()
+
     @property
     def consumptions_total(self):
+        summary = self.summary
+        if summary is not None:
+            return summary.total
+        # totals were never refreshed for this bill
         result = self.consumption_set.aggregate(total=Sum('total'))['total']
         if not result:
             result = Decimal(0)
@@ -132,121 +275,330 @@ class Bill(models.Model):
     def outcome_total(self):
         return self.consumptions_total - self.billing_total
 
-    @property
-    def details(self, user=None):
-        if user is None:
-            user = FleetUser.objects.get(is_superuser=True)
+    @cached_property
+    def details(self):
+        """The consumptions (and their total) of every superuser's leader.
+
+        Each leader gets their own consumptions and the ones of the users
+        they lead. Totals are added up from those consumptions, so they
+        follow any leadership change. The result is computed once per Bill
+        instance.
+
+        """
+        leaders = self._leaders()
 
         # group consumptions per leader
+        grouped = defaultdict(list)
+        consumptions = self.consumption_set.select_related(
+            'phone__user__leader', 'plan').order_by('phone__number')
+        for c in consumptions:
+            phone_user = c.phone.user
+            for leader_id in (phone_user.id, phone_user.leader_id):
+                if leader_id in leaders:
+                    grouped[leader_id].append(c)
+
         data = OrderedDict()
-        leaders = FleetUser.objects.filter(leader=user)
-        for leader in leaders.order_by('first_name'):
-            users = list(FleetUser.objects.filter(leader=leader)) + [leader]
-            consumptions = self.consumption_set.filter(phone__user__in=users)
+        for leader_id, leader in leaders.items():
+            consumptions = grouped.get(leader_id)
             if consumptions:
-                total = consumptions.aggregate(total=Sum('total'))['total']
                 data[leader] = {
-                    'consumptions': consumptions.order_by('phone__number'),
-                    'total': total,
-                }
+                    'consumptions': consumptions,
+                    'total': sum(c.total for c in consumptions)}
 
         return data
 
+    def _leaders(self):
+        """Return the superuser's leaders by id, ordered by first name."""
+        user = FleetUser.objects.get(is_superuser=True)
+        leaders = FleetUser.objects.filter(leader=user).order_by('first_name')
+        return OrderedDict((leader.id, leader) for leader in leaders)
+
+    @transaction.atomic(savepoint=False)
+    def rebuild_totals(self):
+        """Recalculate the BillTotal for this bill from its consumptions."""
+        totals = self.consumption_set.aggregate(
+            total=Sum('total'), lines=Count('id'), mins=Sum('mins'),
+            sms=Sum('sms'))
+        # sums are None when there are no consumptions
+        bill_total = BillTotal(bill=self, **{
+            k: v for k, v in totals.items() if v is not None})
+
+        BillTotal.objects.filter(bill=self).delete()
+        bill_total.save(force_insert=True)
+        self.__dict__.pop('summary', None)
+
+    @transaction.atomic(savepoint=False)
+    def refresh_totals(self):
+        """Rebuild the totals once this bill's consumptions changed.
+
+        The bill is also flagged as modified, and consumptions_changed is
+        sent.
+
+        """
+        self.rebuild_totals()
+        # consumptions changed without saving the bill, flag it as modified
+        self.last_modified = now()
+        Bill.objects.filter(pk=self.pk).update(
+            last_modified=self.last_modified)
+        self._forget_cached()
+        consumptions_changed.send(sender=self.__class__, bill=self)
+
+    def _forget_cached(self):
+        """Drop the memoized details and summary."""
+        self.__dict__.pop('details', None)
+        self.__dict__.pop('summary', None)
+
     def __str__(self):
         return 'Bill "%s" (date: %s)' % (self.fleet, self.billing_date)
 
-    def _apply_partial_penalty(self, data, penalty, attr_name, attr_total):
-        # sort ascending
-        totals = pairwise(sorted(data.keys()))
-        for total1, total2 in totals:
-            # distribute penalty within the same category
-            cons = data[total1]
-            len_cons = Decimal(len(cons))
-
-            diff = total2 - total1
-            assert diff > 0  # because the key are ascendingly sorted
-
-            to_apply = min(diff * len_cons, penalty)
-            if to_apply == 0:
-                logging.warning('Can not apply a 0 value as penalty.')
-                msg = 'Penalty should be 0 by now, got %s instead'
-                assert penalty == 0, msg % penalty
-                break
-
-            penalty -= to_apply
-
-            to_apply = Decimal(to_apply / len_cons)
-            assert to_apply > 0
-            for c in cons:
-                assert c is not None
-                current = getattr(c, attr_name)
-                setattr(c, attr_name, current + to_apply)
-                assert penalty == 0 or getattr(c, attr_total) == total2
-
-            if penalty > 0:
-                # update data
-                data.pop(total1)
-                data[total2].extend(cons)
-            else:
-                break
+    def _apply_partial_penalty(self, usages, target, penalty, attr_name,
+                               attr_total):
+        """Distribute penalty between the consumptions in usages.
 
-        # penalty was fully applied, save all consumptions
-        for consumptions in data.values():
-            for c in consumptions:
-                if c is not None:
-                    c.save()
+        usages is a list of (used amount, consumption) for the consumptions
+        under target. The least used consumptions are leveled up first, so
+        they all end up with the same total (the fill level), without going
+        over target.
+
+        """
+        if not usages:
+            return
+        if penalty == 0:
+            logging.warning('Can not apply a 0 value as penalty.')
+            return
+
+        usages = sorted(usages, key=lambda i: i[0])
+        used = [u for u, _ in usages]
+        levels = sorted(set(used))
+        levels.append(target)
+
+        # needed[j] is the penalty needed to level everyone up to levels[j],
+        # and counts[j] how many consumptions are at or below levels[j]
+        needed = [Decimal(0)]
+        counts = []
+        for level, next_level in zip(levels, levels[1:]):
+            counts.append(bisect_right(used, level))
+            needed.append(needed[-1] + (next_level - level) * counts[-1])
+
+        # the highest level that can be completely filled with penalty
+        j = bisect_right(needed, penalty) - 1
+        level = levels[j]
+        remaining = penalty - needed[j]
+        if j == len(counts):
+            # every consumption gets to the target, any excess is dropped
+            count = len(usages)
+            to_apply = 0
+        else:
+            count = counts[j]
+            to_apply = Decimal(remaining / Decimal(count))
+            assert remaining == 0 or to_apply > 0
+
+        for usage, c in usages[:count]:
+            current = getattr(c, attr_name)
+            setattr(c, attr_name, current + (level - usage))
+            assert (usage == level or remaining == 0 or
+                    getattr(c, attr_total) == level)
+            if to_apply:
+                setattr(c, attr_name, getattr(c, attr_name) + to_apply)
+
+    def _distribute_penalty(self, consumptions, penalty):
+        """Set penalty_min and penalty_sms, without saving consumptions."""
+        plan = penalty.plan
+        usages_min = []
+        usages_sms = []
+        for c in consumptions:
+            if c.mins < plan.included_min:
+                usages_min.append((c.mins, c))
+
+            if c.sms < plan.included_sms:
+                usages_sms.append((c.sms, c))
+
+        self._apply_partial_penalty(
+            usages_min, Decimal(plan.included_min), penalty.minutes,
+            'penalty_min', 'total_min')
+        self._apply_partial_penalty(
+            usages_sms, Decimal(plan.included_sms), penalty.sms,
+            'penalty_sms', 'total_sms')
+
+    def _save_totals(self, consumptions, context):
+        """Recalculate and store the totals for the given consumptions."""
+        for c in consumptions:
+            context.update_totals(c)
+        bulk_update(consumptions, Consumption.calculated_fields)
+        instrumentation.incr('consumptions_saved', len(consumptions))
+        self.refresh_totals()
+
+    def totals_context(self):
+        """Return a TotalsContext with this bill's plans and penalties."""
+        plans = Plan.objects.filter(consumption__bill=self).distinct()
+        penalties = Penalty.objects.filter(bill=self)
+        return TotalsContext(
+            self.taxes, plans={p.id: p for p in plans},
+            penalties={p.plan_id: p for p in penalties})
 
     def apply_penalty(self, consumptions, penalty):
         assert ((penalty.minutes > 0 and penalty.plan.included_min > 0) or
                 (penalty.sms > 0 and penalty.plan.included_sms > 0))
 
-        if consumptions.count() == 0:
+        consumptions = list(consumptions)
+        if not consumptions:
             logging.warning('There is no consumption to apply the %s to.',
                             penalty)
             return
 
-        # prioritize readable code over efficient code
-        data_min = defaultdict(list)
-        data_sms = defaultdict(list)
-        for c in consumptions:
-            if c.mins < c.plan.included_min:
-                data_min[c.mins].append(c)  # group by used minutes
+        self._distribute_penalty(consumptions, penalty)
+        context = TotalsContext(
+            self.taxes, plans={penalty.plan_id: penalty.plan},
+            penalties={penalty.plan_id: penalty})
+        self._save_totals(consumptions, context)
 
-            if c.sms < c.plan.included_sms:
-                data_sms[c.sms].append(c)  # group by used sms
+    def _get_plan(self, phone, plan_name, plans=None):
+        """Return the Plan for phone, named plan_name in the invoice.
 
-        # need to add an extra key for the plan total, so when building
-        # the pairwise generator, the last total has an entry of its own
-        # Example: if we have consumptions to apply penalty to of
-        # 30, 50, 80 and the plan target is 100, we need the following pairs:
-        # [(30, 50), (50, 80), (80, 100)]
-        data_min[Decimal(penalty.plan.included_min)].append(None)
-        data_sms[Decimal(penalty.plan.included_sms)].append(None)
+        If plans is given, it should be a dict of plans by name, and it will
+        be used instead of querying the DB.
 
-        self._apply_partial_penalty(
-            data_min, penalty.minutes, 'penalty_min', 'total_min')
-        self._apply_partial_penalty(
-            data_sms, penalty.sms, 'penalty_sms', 'total_sms')
+        """
+        if not plan_name:
+            # this phone is disappearing, so there should be a previous
+            # consumption with the plan info that serves for this item
+            logging.warning(
+                'Plan info for %r is not available from parsed data.', phone)
+            plan = Consumption.objects.filter(phone=phone)
+            if plan.count() == 0:
+                raise Bill.ParseError('Plan info for %r is not '
+                                      'available.' % phone)
+            return plan.latest().plan
+
+        try:
+            if plans is None:
+                plan = Plan.objects.get(name=plan_name)
+            else:
+                plan = plans[plan_name]
+        except (KeyError, Plan.DoesNotExist):
+            raise Bill.ParseError('Plan %s does not exist in DB.' % plan_name)
+        return plan
+
+    def _consumption_kwargs(self, d):
+        return dict(
+            reported_user=d[USER],
+            reported_plan=d[PLAN],
+            monthly_price=d[MONTHLY_PRICE],
+            services=d[SERVICES],
+            refunds=d[REFUNDS],
+            included_min=d[INCLUDED_MIN],
+            exceeded_min=d[EXCEEDED_MIN] + d[EXCEEDED_STABLISHING_MIN],
+            exceeded_min_price=(
+                d[EXCEEDED_MIN_PRICE] + d[EXCEEDED_STABLISHING_MIN_PRICE]),
+            ndl_min=d[NDL_MIN],
+            ndl_min_price=d[NDL_PRICE],
+            idl_min=d[IDL_MIN],
+            idl_min_price=d[IDL_PRICE],
+            sms=d[SMS],
+            sms_price=d[SMS_PRICE],
+            other_price=d[OTHER_PRICE],
+            reported_total=d[TOTAL_PRICE],
+        )
+
+    def _create_consumptions(self, phone_data, timings):
+        with instrumentation.timer('write', timings):
+            context = self.totals_context()
+            for d in phone_data:
+                try:
+                    phone = Phone.objects.get(number=d[PHONE_NUMBER])
+                except Phone.DoesNotExist:
+                    raise Bill.ParseError('Phone %s does not exist.' %
+                                          d[PHONE_NUMBER])
+                plan = self._get_plan(phone, d[PLAN])
+                c = Consumption(phone=phone, bill=self, plan=plan,
+                                **self._consumption_kwargs(d))
+                c.save(force_insert=True, totals_context=context)
+                instrumentation.incr('consumptions_saved')
+
+    def _bulk_create_consumptions(self, phone_data, timings):
+        with instrumentation.timer('lookup', timings):
+            numbers = set(d[PHONE_NUMBER] for d in phone_data)
+            phones = {}
+            for phone in Phone.objects.filter(number__in=numbers):
+                if phone.number in phones:
+                    raise Bill.ParseError('Phone %s is not unique.' %
+                                          phone.number)
+                phones[phone.number] = phone
+            plan_names = set(d[PLAN] for d in phone_data if d[PLAN])
+            plans = {
+                p.name: p for p in Plan.objects.filter(name__in=plan_names)}
+            penalties = {
+                p.plan_id: p for p in Penalty.objects.filter(bill=self)}
+            context = TotalsContext(
+                self.taxes, plans={p.id: p for p in plans.values()},
+                penalties=penalties)
+
+        with instrumentation.timer('build', timings):
+            consumptions = []
+            for d in phone_data:
+                phone = phones.get(d[PHONE_NUMBER])
+                if phone is None:
+                    raise Bill.ParseError('Phone %s does not exist.' %
+                                          d[PHONE_NUMBER])
+                plan = self._get_plan(phone, d[PLAN], plans=plans)
+                c = Consumption(phone=phone, bill=self, plan=plan,
+                                **self._consumption_kwargs(d))
+                context.update_totals(c)
+                consumptions.append(c)
+
+        with instrumentation.timer('write', timings):
+            Consumption.objects.bulk_create(consumptions)
+        instrumentation.incr('consumptions_saved', len(consumptions))
 
     @transaction.atomic()
-    def parse_invoice(self, invoice_file_object):
+    def parse_invoice(self, invoice_file_object, bulk=True, use_cache=True):
         """Parse this bill's invoice.
 
-        Return whether the parse was successful
+        If bulk is True, every phone and plan referenced by the invoice is
+        fetched upfront and all the consumptions are inserted at once,
+        otherwise consumptions are looked up and created one by one.
+
+        If use_cache is True, a previous parse of the same invoice content
+        is used if available (see settings.PARSE_CACHE).
+
+        Return an OrderedDict with the seconds spent in each parse phase.
 
         """
         if self.parsing_date is not None:
             raise Bill.ParseError('Invoice already parsed on %s.' %
                                   self.parsing_date)
+        timings = OrderedDict()
         self.invoice_filename = getattr(
             invoice_file_object, 'name', 'No name in file descriptor')
         try:
-            data = pdf2cell.parse_file(invoice_file_object)
+            with instrumentation.timer('parse', timings):
+                if use_cache:
+                    data = parsecache.parse_file(
+                        invoice_file_object, counter=instrumentation.incr)
+                else:
+                    data = pdf2cell.parse_file(
+                        invoice_file_object, counter=instrumentation.incr)
         except pdf2cell.CellularDataParseError as e:
             raise Bill.ParseError(str(e))
 
+        return self.load_invoice_data(data, bulk=bulk, timings=timings)
+
+    @transaction.atomic()
+    def load_invoice_data(self, data, bulk=True, timings=None):
+        """Load this bill's invoice data, as returned by pdf2cell.parse_file.
+
+        Return an OrderedDict with the seconds spent in each load phase,
+        after the ones already in timings (if given).
+
+        """
+        if self.parsing_date is not None:
+            raise Bill.ParseError('Invoice already parsed on %s.' %
+                                  self.parsing_date)
+        if timings is None:
+            timings = OrderedDict()
+
         if not data:
-            return
+            return timings
 
         bill_date = data.get('bill_date')
         if bill_date:
@@ -257,104 +609,101 @@ class Bill(models.Model):
         self.internal_tax = data.get('internal_tax', self.internal_tax)
         self.other_tax = data.get('other_tax', self.other_tax)
 
-        for d in data.get('phone_data', []):
-            try:
-                phone = Phone.objects.get(number=d[PHONE_NUMBER])
-            except Phone.DoesNotExist:
-                raise Bill.ParseError('Phone %s does not exist.' %
-                                      d[PHONE_NUMBER])
-
-            plan = None
-            if not plan:
-                if not d[PLAN]:
-                    # this phone is disappearing, so there should be a previous
-                    # consumption with the plan info that serves for this item
-                    logging.warning(
-                        'Plan info for %r is not available from parsed data.',
-                        phone)
-                    plan = Consumption.objects.filter(phone=phone)
-                    if plan.count() == 0:
-                        raise Bill.ParseError('Plan info for %r is not '
-                                              'available.' % phone)
-                    plan = plan.latest().plan
-                else:
-                    try:
-                        plan = Plan.objects.get(name=d[PLAN])
-                    except Plan.DoesNotExist:
-                        raise Bill.ParseError('Plan %s does not exist in DB.' %
-                                              d[PLAN])
-
-            kwargs = dict(
-                reported_user=d[USER],
-                reported_plan=d[PLAN],
-                monthly_price=d[MONTHLY_PRICE],
-                services=d[SERVICES],
-                refunds=d[REFUNDS],
-                included_min=d[INCLUDED_MIN],
-                exceeded_min=d[EXCEEDED_MIN] + d[EXCEEDED_STABLISHING_MIN],
-                exceeded_min_price=(
-                    d[EXCEEDED_MIN_PRICE] + d[EXCEEDED_STABLISHING_MIN_PRICE]),
-                ndl_min=d[NDL_MIN],
-                ndl_min_price=d[NDL_PRICE],
-                idl_min=d[IDL_MIN],
-                idl_min_price=d[IDL_PRICE],
-                sms=d[SMS],
-                sms_price=d[SMS_PRICE],
-                other_price=d[OTHER_PRICE],
-                reported_total=d[TOTAL_PRICE],
-            )
-            Consumption.objects.create(phone=phone, bill=self, plan=plan,
-                                       **kwargs)
+        phone_data = data.get('phone_data', [])
+        if bulk:
+            self._bulk_create_consumptions(phone_data, timings)
+        else:
+            self._create_consumptions(phone_data, timings)
+        self.refresh_totals()
 
         self.parsing_date = now()
         self.save()
+        return timings
 
+    @transaction.atomic
     def calculate_penalties(self):
         """Calculate penalties per plan with clearing."""
         if self.parsing_date is None:
             raise Bill.AdjustmentError('Bill must be parsed before making '
                                        'adjustments.')
 
-        plans = Plan.objects.filter(consumption__bill=self).distinct()
-        for plan in plans:
-            if Penalty.objects.filter(bill=self, plan=plan).count() > 0:
-                logging.warning('Penalty for "%s" and "%s" already exists, '
-                                'deleting.', self, plan)
-                Penalty.objects.filter(bill=self, plan=plan).delete()
+        consumptions = list(self.consumption_set.select_related('plan'))
+        if not consumptions:
+            return
 
-            consumptions = self.consumption_set.filter(plan=plan)
-            if not consumptions:
-                logging.info('There is no consumptions for "%s" and "%s".',
-                             self, plan)
-                continue
+        # remove existing penalties if any, we may be recalculating
+        plans = {c.plan_id: c.plan for c in consumptions}
+        existing = Penalty.objects.filter(bill=self, plan__in=plans)
+        for plan_id in sorted(existing.values_list('plan', flat=True)):
+            logging.warning('Penalty for "%s" and "%s" already exists, '
+                            'deleting.', self, plans[plan_id])
+        existing.delete()
 
-            # remove existing penalties if any, we may be recalculating
-            consumptions.update(penalty_min=0, penalty_sms=0)
+        by_plan = defaultdict(list)
+        for c in consumptions:
+            c.penalty_min = c.penalty_sms = 0
+            by_plan[c.plan_id].append(c)
+
+        penalties = {}
+        usage = self.consumption_set.values('plan').annotate(
+            count=Count('id'), mins=Sum('mins'), sms=Sum('sms'))
+        for row in usage:
+            plan = plans[row['plan']]
 
             diff_min = 0
             if plan.with_min_clearing:
                 # decide if penalty for mins is needed
-                target = plan.included_min * consumptions.count()
-                real = consumptions.aggregate(mins=Sum('mins'))['mins']
-                diff_min = max(target - real, 0)
+                target = plan.included_min * row['count']
+                diff_min = max(target - row['mins'], 0)
 
             diff_sms = 0
             if plan.with_sms_clearing:
                 # decide if penalty for sms is needed
-                target = plan.included_sms * consumptions.count()
-                real = consumptions.aggregate(sms=Sum('sms'))['sms']
-                diff_sms = max(target - real, 0)
+                target = plan.included_sms * row['count']
+                diff_sms = max(target - row['sms'], 0)
 
             # apply newly calculated penalties
             if diff_min > 0 or diff_sms > 0:
-                penalty = Penalty.objects.create(
+                penalty = Penalty(
                     bill=self, plan=plan, minutes=diff_min, sms=diff_sms)
-                self.apply_penalty(consumptions, penalty)
+                self._distribute_penalty(by_plan[plan.id], penalty)
+                penalties[plan.id] = penalty
+
+        Penalty.objects.bulk_create(penalties.values())
+        self._save_totals(
+            consumptions, TotalsContext(self.taxes, plans, penalties))
 
+    @transaction.atomic
     def apply_delta(self, delta):
-        self.consumption_set.update(extra=F('extra') + delta)
-        for c in self.consumption_set.all():
-            c.save()
+        """Add delta to every consumption's extra, updating their totals.
+
+        Only the totals depending on extra are updated. On PostgreSQL this
+        is a single UPDATE, other backends (like SQLite) evaluate it with
+        floats and miss the rounding ties, so the totals are calculated
+        here and stored with bulk_update instead.
+
+        """
+        db = router.db_for_write(Consumption)
+        if connections[db].vendor == 'postgresql':
+            # every expression in an UPDATE sees the values prior to it
+            extra = F('extra') + Value(delta)
+            total_before_round = ExpressionWrapper(
+                F('total_before_taxes') * (Value(1) + F('taxes')) + extra,
+                output_field=MoneyField())
+            self.consumption_set.update(
+                extra=extra, total_before_round=total_before_round,
+                total=RoundHalfEven(total_before_round))
+        else:
+            consumptions = list(Consumption.objects.filter(bill=self).only(
+                'extra', 'total_before_taxes', 'taxes'))
+            for c in consumptions:
+                c.extra += delta
+                c.total_before_round = (
+                    c.total_before_taxes * (Decimal('1') + c.taxes) + c.extra)
+                c.total = round(c.total_before_round)
+            bulk_update(
+                consumptions, ('extra', 'total_before_round', 'total'))
+        self.refresh_totals()
 
 
 class Plan(models.Model):
@@ -406,9 +755,22 @@ class Phone(models.Model):
     active_since = models.DateTimeField(default=now)
     active_to = models.DateTimeField(null=True, blank=True)
 
+    # the user stored in the DB, to tell the previous one on save
+    stored_user_id = None
+
     class Meta:
         get_latest_by = 'active_since'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        phone = super(Phone, cls).from_db(db, field_names, values)
+        phone.stored_user_id = phone.__dict__.get('user_id')
+        return phone
+
+    def save(self, *args, **kwargs):
+        super(Phone, self).save(*args, **kwargs)
+        self.stored_user_id = self.user_id
+
     def __str__(self):
         result = str(self.number)
         if self.user.get_full_name():
@@ -461,6 +823,11 @@ class Consumption(models.Model):
     # added by hand if needed
     extra = MoneyField('Extra (por equipo/s, o IVA de equipo, etc.)')
 
+    # the fields that change when penalties and totals are (re)calculated
+    calculated_fields = (
+        'penalty_min', 'penalty_sms', 'mins', 'total_before_taxes', 'taxes',
+        'total_before_round', 'total')
+
     def __str__(self):
         return '%s - Bill from %s - Phone %s' % (self.bill.fleet.provider,
                                                  self.bill.billing_date,
@@ -476,37 +843,44 @@ class Consumption(models.Model):
         """Suma de mensajes consumidos y multas."""
         return self.sms + self.penalty_sms
 
-    def save(self, *args, **kwargs):
-        self.mins = Decimal(self.included_min) + Decimal(self.exceeded_min)
+    def update_totals(self, plan, penalty, taxes):
+        """Calculate the stored totals for this consumption.
 
-        total = self.reported_total
-        plan = self.plan
-        if plan.with_min_clearing:
-            total -= self.monthly_price
-            # we now need the exceeded_min to be included since those seem to
-            # be used against Claro lines
-            # other_diff = abs(self.other_price - self.exceeded_min_price)
-            total += (
-                (Decimal(self.mins) + Decimal(self.penalty_min)) *
-                Decimal(plan.price_min))
+        See calculate_totals for the meaning of the arguments.
 
-            if plan.with_sms_clearing:
-                # calculate real amount of sms to be charged for
-                total += (self.sms + self.penalty_sms) * plan.price_sms
-                # XXX: potential issue: is there are not SMS penalties,
-                # (i.e. all SMS were consumed), we need to substract the
-                # exceeding SMS being charged in the sms_price column
-                p = Penalty.objects.filter(bill=self.bill, plan=self.plan)
-                if p.count() == 0 or p.get().sms == 0:
-                    total -= self.sms_price
-
-        self.total_before_taxes = total
-        self.taxes = self.bill.taxes
-        self.total_before_round = (
-            self.total_before_taxes * (Decimal('1') + self.taxes) +
-            self.extra)  # add any needed extra
-        self.total = round(self.total_before_round)
-        super(Consumption, self).save(*args, **kwargs)
+        """
+        for name, value in calculate_totals(
+                self, plan, penalty, taxes).items():
+            setattr(self, name, value)
+
+    def save(self, *args, totals_context=None, **kwargs):
+        """Calculate the totals and save.
+
+        If totals_context is given, the plan, penalty and taxes are taken
+        from it instead of being read from the DB, and the bill's totals are
+        not refreshed: the bill does it once it saved all its consumptions.
+
+        """
+        if totals_context is not None:
+            totals_context.update_totals(self)
+            super(Consumption, self).save(*args, **kwargs)
+            return
+
+        plan = self.plan
+        penalty = None
+        if plan.with_min_clearing and plan.with_sms_clearing:
+            penalty = Penalty.objects.filter(
+                bill=self.bill, plan=plan).first()
+        self.update_totals(plan, penalty, self.bill.taxes)
+        with transaction.atomic(savepoint=False):
+            super(Consumption, self).save(*args, **kwargs)
+            self.bill.refresh_totals()
+
+    @transaction.atomic(savepoint=False)
+    def delete(self, *args, **kwargs):
+        result = super(Consumption, self).delete(*args, **kwargs)
+        self.bill.refresh_totals()
+        return result
 
     @property
     def used_min(self):
@@ -531,3 +905,68 @@ class Penalty(models.Model):
     def __str__(self):
         return 'Penalty of %s minutes for %s (%s)' % (self.minutes, self.bill,
                                                       self.plan)
+
+
+class BillTotal(models.Model):
+    """Consumptions summary for a bill.
+
+    It is kept up to date by Bill.refresh_totals. Leaders totals are not
+    stored, since they change along with the users leaders.
+
+    """
+    bill = models.OneToOneField(Bill, on_delete=models.CASCADE)
+    total = MoneyField()
+    lines = models.PositiveIntegerField(default=0)
+    mins = MinuteField()
+    sms = SMSField()
+
+    def __str__(self):
+        return 'Total of %s for %s' % (self.total, self.bill)
+
+
+class Job(models.Model):
+    """A task on a bill, run in the background by the runjobs command."""
+
+    PARSE = 'parse'
+    RECALCULATE = 'recalculate'
+    NOTIFY = 'notify'
+    KIND_CHOICES = (
+        (PARSE, 'Parse invoice'),
+        (RECALCULATE, 'Recalculate penalties'),
+        (NOTIFY, 'Notify users'),
+    )
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    bill = models.ForeignKey(Bill, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=PENDING,
+        db_index=True)
+    progress = models.PositiveSmallIntegerField('Progress (%)', default=0)
+    # the job input, like the invoice content
+    payload = models.BinaryField(null=True, blank=True)
+    payload_name = models.CharField(max_length=512, blank=True)
+    message = models.TextField(blank=True)
+    created = models.DateTimeField(default=now)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return 'Job %s: %s for %s (%s)' % (
+            self.id, self.get_kind_display(), self.bill, self.status)
+
+    @property
+    def seconds(self):
+        """Seconds the job took to run, once finished."""
+        if self.started is None or self.finished is None:
+            return None
+        return (self.finished - self.started).total_seconds()
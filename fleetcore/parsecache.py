@@ -0,0 +1,156 @@
+# coding: utf-8
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from fleetcore import pdf2cell
+
+
+DEFAULT_PARSE_CACHE = {
+    'BACKEND': 'fleetcore.parsecache.FileSystemParseCache',
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'fleetthis-parsecache'),
+    'MAX_SIZE': 100 * 1024 * 1024,
+}
+CHUNK_SIZE = 64 * 1024
+
+
+class FileSystemParseCache(object):
+    """Store parse results as files in a local directory.
+
+    Once the stored files are bigger than max_size bytes, the least recently
+    used ones are removed.
+
+    """
+
+    suffix = '.parse'
+
+    def __init__(self, location, max_size=DEFAULT_PARSE_CACHE['MAX_SIZE']):
+        self.location = location
+        self.max_size = max_size
+
+    def _path(self, key):
+        return os.path.join(self.location, key + self.suffix)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (EOFError, pickle.UnpicklingError):
+            logging.warning('Removing corrupted parse cache entry %r.', path)
+            os.remove(path)
+            return None
+
+        # mark the entry as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # evicted by another process
+        return result
+
+    def set(self, key, value):
+        os.makedirs(self.location, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.location)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.location):
+            if entry.name.endswith(self.suffix):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # removed by another process
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.location):
+            for entry in os.scandir(self.location):
+                if entry.name.endswith(self.suffix):
+                    os.remove(entry.path)
+
+
+class DjangoParseCache(object):
+    """Store parse results using one of the Django's configured caches.
+
+    There is no clear(), since the cache may be shared with other data, like
+    the dashboard pages, and its keys can not be listed.
+
+    """
+
+    prefix = 'fleetcore-parse-'
+
+    def __init__(self, location='default', timeout=None):
+        self.cache = caches[location]
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.cache.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.cache.set(self.prefix + key, value, timeout=self.timeout)
+
+
+def get_parse_cache():
+    """Return the cache configured in settings.PARSE_CACHE, if any."""
+    config = getattr(settings, 'PARSE_CACHE', DEFAULT_PARSE_CACHE)
+    if not config:
+        return None
+    options = {k.lower(): v for k, v in config.items() if k != 'BACKEND'}
+    return import_string(config['BACKEND'])(**options)
+
+
+def make_key(invoice_file_object, **kwargs):
+    """Return the cache key for the invoice content and the parse options.
+
+    The file object is read from its current position until its end, and
+    then it is rewound to that same position.
+
+    """
+    position = invoice_file_object.tell()
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: invoice_file_object.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    invoice_file_object.seek(position)
+
+    options = ''.join('-%s=%s' % i for i in sorted(kwargs.items()))
+    return '%s-v%s%s' % (digest.hexdigest(), pdf2cell.PARSER_VERSION, options)
+
+
+def parse_file(invoice_file_object, counter=None, **kwargs):
+    """Parse the invoice like pdf2cell.parse_file, if not cached already.
+
+    counter is given to the parser, it does not change the parse result.
+
+    """
+    cache = get_parse_cache()
+    if cache is None:
+        return pdf2cell.parse_file(
+            invoice_file_object, counter=counter, **kwargs)
+
+    key = make_key(invoice_file_object, **kwargs)
+    result = cache.get(key)
+    if result is None:
+        result = pdf2cell.parse_file(
+            invoice_file_object, counter=counter, **kwargs)
+        cache.set(key, result)
+    return result
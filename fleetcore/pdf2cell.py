@@ -1,17 +1,26 @@
 # coding: utf-8
 
+import os
 import re
 import sys
 
-from collections import defaultdict
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from decimal import Decimal
+from functools import lru_cache
+from io import BytesIO
+from itertools import accumulate
 
 # from pdfminer.layout import *
 from pdfminer.pdfparser import (
     PDFSyntaxError,
 )
 from pdfminer.converter import PDFPageAggregator
+from pdfminer.pdfdevice import PDFTextDevice
+from pdfminer.pdffont import PDFUnicodeNotDefined
 from pdfminer.psparser import PSEOF
 from pdfminer.pdfparser import PDFDocument, PDFNoValidXRef, PDFParser
 from pdfminer.pdfinterp import (
@@ -24,17 +33,171 @@ from pdfminer.pdfinterp import (
  NDL_MIN, NDL_PRICE, IDL_MIN, IDL_PRICE,
  SMS, SMS_PRICE, OTHER_PRICE, TOTAL_PRICE) = range(19)
 
+# bump whenever parse results change, so cached results are not used
+PARSER_VERSION = 5
+
+PhoneRow = namedtuple('PhoneRow', (
+    'phone_number', 'user', 'plan', 'monthly_price', 'services', 'refunds',
+    'included_min', 'exceeded_stablishing_min',
+    'exceeded_stablishing_min_price', 'exceeded_min', 'exceeded_min_price',
+    'ndl_min', 'ndl_price', 'idl_min', 'idl_price',
+    'sms', 'sms_price', 'other_price', 'total_price'))
+
+
+class PhoneTableRow(object):
+    """A row of a PhoneTable, indexed like the phone data lists.
+
+    Amounts are converted to Decimal only when they are accessed.
+
+    """
+
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __len__(self):
+        table, i = self._table, self._index
+        return 3 + table._offsets[i + 1] - table._offsets[i]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+        size = len(self)
+        if key < 0:
+            key += size
+        if not 0 <= key < size:
+            raise IndexError('phone row index out of range')
+        table, i = self._table, self._index
+        if key == PHONE_NUMBER:
+            return table._phones[i]
+        if key == USER:
+            return table._users[i]
+        if key == PLAN:
+            return table._plans[i]
+        cents = table._cents[table._offsets[i] + key - MONTHLY_PRICE]
+        return Decimal(cents).scaleb(-2)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class PhoneTable(object):
+    """Compact storage for the phone data rows of an invoice.
+
+    Rows are indexed like lists of [phone number, user, plan] followed by
+    their amounts (see PHONE_NUMBER to TOTAL_PRICE). Strings are interned,
+    and amounts are kept as cents in a single array, with every row
+    amounts starting at its offset (so rows with an unexpected amount of
+    values are kept as they are).
+
+    """
+
+    def __init__(self, rows=()):
+        self._phones = []
+        self._users = []
+        self._plans = []
+        self._cents = array('q')
+        self._offsets = array('q', [0])
+        self.extend(rows)
+
+    def __len__(self):
+        return len(self._phones)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('phone table index out of range')
+        return PhoneTableRow(self, key)
+
+    def __iter__(self):
+        return (PhoneTableRow(self, i) for i in range(len(self)))
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return 'PhoneTable(%r)' % list(self)
+
+    def _append(self, phone, user, plan, cents):
+        self._phones.append(sys.intern(phone))
+        self._users.append(sys.intern(user))
+        self._plans.append(sys.intern(plan))
+        self._cents.extend(cents)
+        self._offsets.append(len(self._cents))
+
+    def append_text(self, phone, user, plan, amounts):
+        """Add a row with its amounts as in the invoice (like '35,00')."""
+        self._append(phone, user, plan,
+                     (int(a.replace(',', '')) for a in amounts))
+
+    def append(self, row):
+        """Add a row, given as a phone data list or a PhoneTableRow."""
+        if isinstance(row, PhoneTableRow):
+            table, i = row._table, row._index
+            cents = table._cents[table._offsets[i]:table._offsets[i + 1]]
+        else:
+            cents = []
+            for amount in row[MONTHLY_PRICE:]:
+                value = Decimal(amount).scaleb(2)
+                if value != value.to_integral_value():
+                    raise ValueError(
+                        'Amount %s has more than 2 decimal places.' % amount)
+                cents.append(int(value))
+        self._append(row[PHONE_NUMBER], row[USER], row[PLAN], cents)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def column(self, index):
+        """Return the values of the index column, amounts as cents."""
+        if index == PHONE_NUMBER:
+            return list(self._phones)
+        if index == USER:
+            return list(self._users)
+        if index == PLAN:
+            return list(self._plans)
+        offsets, cents = self._offsets, self._cents
+        return [cents[offsets[i] + index - MONTHLY_PRICE]
+                for i in range(len(self))]
+
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
 PHONE_ROW_RE = re.compile(r'\s*(\d+,\d{2})\s*')
 PHONE_TOKEN = '-'
 PERCENT_RE = '(\d+(?:\.\d+){0,1})%'
 PRICE_RE = '((?:\d+\.){0,1}\d+,\d+)'
-TAX_FINANC_RE = re.compile(
-    r'Cargo (\d+(?:\.\d+){0,1})% financ ENARD Ley 26\.573/09\s+(\d+,\d+)',
-    re.IGNORECASE)
-TAX_INTERNAL_RE = re.compile(
-    r'Impuesto Interno\s*(\d+(?:\.\d+){0,1})%\s+(\d+,\d+)', re.IGNORECASE)
-TAX_PERCEP_RE = re.compile(
-    r'Iva Percepcion (\d+(?:\.\d+){0,1})%\s+(\d+,\d+)', re.IGNORECASE)
+# the taxes in the invoice, named after their percentage field, each one
+# with named groups for its percentage and price fields
+TAXES_RE = (
+    r'(?P<internal_tax_line>(?i:Impuesto Interno\s*'
+    r'(?P<internal_tax>\d+(?:\.\d+){0,1})%\s+'
+    r'(?P<internal_tax_price>\d+,\d+)))|'
+    r'(?P<percep_tax_line>(?i:Iva Percepcion '
+    r'(?P<percep_tax>\d+(?:\.\d+){0,1})%\s+'
+    r'(?P<percep_tax_price>\d+,\d+)))|'
+    r'(?P<other_tax_line>(?i:Cargo '
+    r'(?P<other_tax>\d+(?:\.\d+){0,1})% financ ENARD Ley 26\.573/09\s+'
+    r'(?P<other_tax_price>\d+,\d+)))'
+)
 BILL_TOTAL_RE = re.compile(
     r'Total Factura Cta. 2/\d+\s*\$\s*((?:\d+\.){0,1}\d+,\d+)', re.IGNORECASE)
 
@@ -43,6 +206,74 @@ class CellularDataParseError(Exception):
     """The phone data could not be parsed."""
 
 
+class TextRunsDevice(PDFTextDevice):
+    """Device that gathers the text runs of a page, without laying it out.
+
+    Runs are split exactly as CellularConverter._extract_runs splits the
+    items of a laid out page, but text is decoded a whole string at a time
+    instead of building an LTChar (and its bounding box) per char.
+
+    """
+
+    def __init__(self, rsrcmgr):
+        super(TextRunsDevice, self).__init__(rsrcmgr)
+        self.runs = None
+        self._text = []
+        self._figures = 0
+
+    def _end_run(self):
+        self.runs.append(''.join(self._text))
+        self._text = []
+
+    def _decode(self, font, string):
+        cids = font.decode(string)
+        try:
+            return ''.join([font.to_unichr(cid) for cid in cids])
+        except PDFUnicodeNotDefined:
+            pass
+        chars = []
+        for cid in cids:
+            try:
+                chars.append(font.to_unichr(cid))
+            except PDFUnicodeNotDefined:
+                # same text PDFLayoutAnalyzer.handle_undefined_char returns
+                chars.append('(cid:%d)' % cid)
+        return ''.join(chars)
+
+    def begin_page(self, page, ctm):
+        self.runs = []
+        self._text = []
+        self._figures = 0
+
+    def end_page(self, page):
+        self._end_run()
+
+    def begin_figure(self, name, bbox, matrix):
+        self._figures += 1
+
+    def end_figure(self, name):
+        # the text in a figure is not part of the page runs, and the figure
+        # itself splits them once it is finished
+        self._figures -= 1
+        if not self._figures:
+            self._end_run()
+
+    def paint_path(self, graphicstate, stroke, fill, evenodd, path):
+        if not self._figures:
+            self._end_run()
+
+    def render_string(self, textstate, seq):
+        if self._figures:
+            return
+        font = textstate.font
+        for obj in seq:
+            if not isinstance(obj, (int, float)):
+                self._text.append(self._decode(font, obj))
+
+    def get_result(self):
+        return self.runs
+
+
 class CellularConverter(PDFPageAggregator):
     """CellularConverter."""
 
@@ -56,10 +287,13 @@ class CellularConverter(PDFPageAggregator):
     front_pages = (2, 3, 4)
     table_pages = (3, 4, 5)
     taxes_pages = (3, 4)
-    taxes_fields = ('internal_tax', 'internal_tax_price',
-                    'percep_tax', 'percep_tax_price',
-                    'other_tax', 'other_tax_price')
-    taxes_list = (TAX_INTERNAL_RE, TAX_PERCEP_RE, TAX_FINANC_RE)
+    # front page fields, as (format token key, attribute, value length)
+    front_fields = (
+        ('date_token', '_bill_date', 'date_length'),
+        ('bill_number_token', '_bill_number', 'bill_number_length'),
+        ('bill_total_token', '_bill_total', 'bill_total_length'),
+        ('bill_debt_token', '_bill_debt', 'bill_debt_length'),
+    )
 
     bill_number_length = 13
     bill_total_length = bill_debt_length = 8
@@ -68,13 +302,33 @@ class CellularConverter(PDFPageAggregator):
     plan_length = 6
     phone_length = 11
 
-    def __init__(self, input_fd, *args, **kwargs):
+    def __init__(self, input_fd, full_scan=False, workers=None,
+                 text_only=False, counter=None, *args, **kwargs):
+        # if full_scan is False, only the pages listed in front_pages,
+        # table_pages and taxes_pages are interpreted
+        self.full_scan = full_scan
+        # if text_only is True, text runs are gathered by a TextRunsDevice
+        # instead of being extracted from each page layout
+        self.text_only = text_only
+        # if workers is greater than 1, pages are interpreted in that many
+        # processes, each one opening its own copy of the document
+        self.workers = workers or 1
+        # if counter is given, it is called as counter(name, amount) with
+        # the pages interpreted and the rows parsed, so the caller can
+        # instrument the parse
+        self.counter = counter
+        self._content = None
+        if self.workers > 1:
+            position = input_fd.tell()
+            self._content = input_fd.read()
+            input_fd.seek(position)
         self._bill_date = None
         self._bill_number = None
         self._bill_total = None
         self._bill_debt = None
         self._bill_taxes = defaultdict(int)
-        self._phone_data = []
+        self._page_rows = PhoneTable()
+        self._phone_rows = 0
 
         # Create a PDF parser object associated with the file object.
         parser = PDFParser(input_fd)
@@ -109,135 +363,283 @@ class CellularConverter(PDFPageAggregator):
         j = self.phone_length + self.notes_length
         phone = row[:i].replace(PHONE_TOKEN, '') if PHONE_TOKEN in row else ''
         if phone.isdigit():
-            phone = int(phone)
             notes = row[i:j].strip()
             plan = row[j:j + self.plan_length].strip()
             rest = row[j + self.plan_length:]
-            rest = PHONE_ROW_RE.findall(rest)
-            self._phone_data.append(
-                [str(phone), notes, plan] +
-                [Decimal(n.strip().replace(',', '.')) for n in rest]
-            )
-
-    def _extract_all_text(self, page):
-        lines = []
-        for item in page:
-            if getattr(item, 'get_text', None) is not None:
-                t = item.get_text()
-                lines.append(t)
+            self._page_rows.append_text(
+                str(int(phone)), notes, plan, PHONE_ROW_RE.findall(rest))
+
+    def _extract_runs(self, page):
+        """Return the text runs in page, split by its non-text items.
 
-        return ''.join(lines)
+        The last run is the text after the last non-text item, so it is
+        not terminated.
 
-    def _extract_text(self, page, fn):
+        """
+        runs = []
         last_text = []
         for item in page:
             if getattr(item, 'get_text', None) is not None:
                 last_text.append(item.get_text())
             else:
-                line = ''.join(last_text)
+                runs.append(''.join(last_text))
                 last_text = []
-                if line:
-                    fn(line)
-
-    def _process_bill_token(self, line, token, token_length):
-        idx = line.find(token)
-        data = None
-        if idx != -1:
-            idx += len(token)
-            data = line[idx:idx + token_length]
-        return data
-
-    def _process_front_page(self, line):
-        bill_date_str = self._process_bill_token(
-            line, self.format['date_token'], self.date_length
-        )
-        if bill_date_str and not self._bill_date:
-            self._bill_date = datetime.strptime(bill_date_str, "%d/%m/%Y")
-
-        bill_number = self._process_bill_token(
-            line, self.format['bill_number_token'],
-            self.bill_number_length,
-        )
-        if bill_number and not self._bill_number:
-            self._bill_number = bill_number
-
-        bill_total = self._process_bill_token(
-            line, self.format['bill_total_token'],
-            self.bill_total_length,
-        )
-        if bill_total and not self._bill_total:
-            self._bill_total = Decimal(
-                bill_total.replace('.', '').replace(',', '.'))
-
-        bill_debt = self._process_bill_token(
-            line, self.format['bill_debt_token'],
-            self.bill_debt_length,
-        )
-        if bill_debt and not self._bill_debt:
-            self._bill_debt = Decimal(
-                bill_debt.replace('.', '').replace(',', '.'))
-
-    def process_front_page(self, layout):
-        self._extract_text(layout, self._process_front_page)
-
-    def process_phone_data(self, layout):
-        if self._phone_data:
+        runs.append(''.join(last_text))
+        return runs
+
+    def _extract_text(self, runs, fn):
+        for line in runs[:-1]:
+            if line:
+                fn(line)
+
+    @property
+    def header_re(self):
+        """The regex matching every front page token and tax in a page."""
+        return compile_header_re(
+            tuple((k, self.format[k]) for k, _, _ in self.front_fields))
+
+    def _front_value(self, text, match, run_ends, length):
+        """Return the value after the front page token matched in text.
+
+        Like the rest of the front page data, the token has to be in a
+        single run, and not in the last one (since it is not terminated).
+        The value is cut at the end of the run.
+
+        """
+        i = bisect_right(run_ends, match.start())
+        if i == len(run_ends) or match.end() > run_ends[i]:
+            return None
+        return text[match.end():min(match.end() + length, run_ends[i])]
+
+    def _set_front_value(self, attr, value):
+        if attr == '_bill_date':
+            value = datetime.strptime(value, "%d/%m/%Y")
+        elif attr in ('_bill_total', '_bill_debt'):
+            value = Decimal(value.replace('.', '').replace(',', '.'))
+        setattr(self, attr, value)
+
+    def _set_taxes(self, matches):
+        for match in matches:
+            for field, value in match.groupdict().items():
+                if value is None or field.endswith('_line'):
+                    continue
+                if ',' in value:
+                    value = value.replace('.', '').replace(',', '.')
+                value = Decimal(value)
+                if field.endswith('_tax'):
+                    value /= 100
+                self._bill_taxes[field] = value
+
+    def process_phone_data(self, runs):
+        if self._phone_rows:
             return
-        self._extract_text(layout, self._process_phone_row)
-
-    def process_taxes(self, layout):
-        all_text = self._extract_all_text(layout)
-        results = []
-        for regex in self.taxes_list:
-            match = regex.search(all_text)
-            if not match:
-                continue
-            results.extend(match.groups())
-
-        groups = zip(self.taxes_fields, results)
-        for k, v in groups:
-            if ',' in v:
-                v = v.replace('.', '').replace(',', '.')
-            value = Decimal(v)
-            if k.endswith('_tax'):
-                value /= 100
-            self._bill_taxes[k] = value
+        self._extract_text(runs, self._process_phone_row)
+        self._phone_rows += len(self._page_rows)
+
+    def process_header(self, runs, front=True, taxes=True):
+        """Gather the front page fields and taxes in runs, in a single scan.
+
+        The runs are scanned as one text, so taxes can span several runs.
+        Only the first match of every front page field and tax is used.
+
+        """
+        text = ''.join(runs)
+        run_ends = list(accumulate(len(run) for run in runs[:-1]))
+        front_fields = {
+            key: (attr, getattr(self, length))
+            for key, attr, length in self.front_fields
+            if front and not getattr(self, attr)}
+        found_taxes = OrderedDict()
+        for match in self.header_re.finditer(text):
+            kind = match.lastgroup
+            if kind in front_fields:
+                attr, length = front_fields[kind]
+                value = self._front_value(text, match, run_ends, length)
+                if value:
+                    self._set_front_value(attr, value)
+                    del front_fields[kind]
+            elif taxes and kind.endswith('_tax_line'):
+                found_taxes.setdefault(kind, match)
+        self._set_taxes(found_taxes.values())
+
+    @property
+    def wanted_pages(self):
+        return set(self.front_pages + self.table_pages + self.taxes_pages)
+
+    def is_complete(self):
+        """Return whether every section was gathered from the invoice."""
+        front = (self._bill_date, self._bill_number,
+                 self._bill_total, self._bill_debt)
+        return all(front) and bool(self._phone_rows and self._bill_taxes)
+
+    def iter_pages(self):
+        """Yield (pageno, page) for every page that needs to be processed.
+
+        Unless full_scan is set, pages outside of the front, table and taxes
+        pages are skipped, and no more pages are yielded once every section
+        was gathered.
+
+        """
+        wanted = self.wanted_pages
+        last_page = max(wanted)
+        for pageno, page in enumerate(self.doc.get_pages(), start=1):
+            if not self.full_scan:
+                if pageno > last_page or self.is_complete():
+                    break
+                if pageno not in wanted:
+                    continue
+            yield pageno, page
+
+    def process_page_text(self, pageno, runs):
+        """Process the text runs of the page numbered pageno.
+
+        Return the phone data rows found in the page.
+
+        """
+        self._count('pages_interpreted')
+        self._page_rows = PhoneTable()
+        front = pageno in self.front_pages
+        if pageno in self.table_pages:
+            self.process_phone_data(runs)
+        taxes = not self._bill_taxes and (
+            self.full_scan or pageno in self.taxes_pages)
+        if front or taxes:
+            self.process_header(runs, front=front, taxes=taxes)
+        self._count('rows_parsed', len(self._page_rows))
+        return self._page_rows
+
+    def _count(self, name, amount=1):
+        if self.counter is not None:
+            self.counter(name, amount)
+
+    @property
+    def header(self):
+        """The bill data gathered so far, except for the phone data."""
+        taxes = defaultdict(int, self._bill_taxes)
+        taxes['other_tax'] += taxes.pop('percep_tax', 0)
+        taxes['other_tax_price'] += taxes.pop('percep_tax_price', 0)
 
-    def gather_phone_info(self):
-        interpreter = PDFPageInterpreter(self.rsrcmgr, self)
-        for page in self.doc.get_pages():
+        result = {
+            'bill_date': self._bill_date, 'bill_number': self._bill_number,
+            'bill_total': self._bill_total, 'bill_debt': self._bill_debt,
+        }
+        result.update(taxes)
+        return result
+
+    def interpret_pages(self, pages):
+        """Yield (pageno, runs) with the text runs for every (pageno, page).
+
+        Each page is laid out only when the next item is requested.
+
+        """
+        if self.text_only:
+            device = TextRunsDevice(self.rsrcmgr)
+        else:
+            device = self
+        interpreter = PDFPageInterpreter(self.rsrcmgr, device)
+        for pageno, page in pages:
+            # make the LTPage id match the page number even if some pages
+            # were skipped
+            self.pageno = pageno
             interpreter.process_page(page)
-            # receive the LTPage object for the page.
-            layout = self.get_result()
-            if layout.pageid in self.front_pages:
-                self.process_front_page(layout)
-            if layout.pageid in self.table_pages:
-                self.process_phone_data(layout)
-            if not self._bill_taxes:
-                self.process_taxes(layout)
-
-        if not self._phone_data:
+            if self.text_only:
+                runs = device.get_result()
+            else:
+                # receive the LTPage object for the page.
+                layout = self.get_result()
+                runs = self._extract_runs(layout)
+                # do not hold the page layout while runs are being processed
+                self.result = layout = None
+            yield pageno, runs
+
+    def interpret_pages_in_parallel(self):
+        """Yield (pageno, runs) like interpret_pages, using self.workers.
+
+        Pages to be interpreted are split between the worker processes, and
+        their text runs are yielded in page order once all are finished.
+
+        """
+        npages = sum(1 for page in self.doc.get_pages())
+        pagenos = list(range(1, npages + 1))
+        if not self.full_scan:
+            pagenos = [i for i in pagenos if i in self.wanted_pages]
+        chunks = [pagenos[i::self.workers] for i in range(self.workers)]
+        chunks = [c for c in chunks if c]
+
+        runs = {}
+        with ProcessPoolExecutor(max(len(chunks), 1)) as executor:
+            futures = [
+                executor.submit(interpret_pages, self._content, chunk,
+                                text_only=self.text_only)
+                for chunk in chunks]
+            for future in futures:
+                runs.update(future.result())
+
+        for pageno in sorted(runs):
+            if not self.full_scan and self.is_complete():
+                break
+            yield pageno, runs[pageno]
+
+    def iter_phone_data(self):
+        """Yield the phone data rows, as soon as each page is laid out."""
+        if self.workers > 1:
+            pages = self.interpret_pages_in_parallel()
+        else:
+            pages = self.interpret_pages(self.iter_pages())
+        for pageno, runs in pages:
+            rows = self.process_page_text(pageno, runs)
+            for row in rows:
+                yield row
+
+        if not self._phone_rows:
             raise CellularDataParseError(
                 'Could not parse file, got empty phone data (front_pages are '
                 '%r, table_pages are %r)' %
                 (self.front_pages, self.table_pages))
 
-        self._bill_taxes['other_tax'] += self._bill_taxes.pop('percep_tax', 0)
-        self._bill_taxes['other_tax_price'] += self._bill_taxes.pop(
-            'percep_tax_price', 0)
+    def iter_phone_rows(self):
+        """Yield a PhoneRow for every phone, as soon as its page is read."""
+        for row in self.iter_phone_data():
+            if len(row) != len(PhoneRow._fields):
+                raise CellularDataParseError(
+                    'Could not parse phone data %r, got %s values instead '
+                    'of %s' % (row, len(row), len(PhoneRow._fields)))
+            yield PhoneRow._make(row)
 
-        result = {
-            'bill_date': self._bill_date, 'bill_number': self._bill_number,
-            'bill_total': self._bill_total, 'bill_debt': self._bill_debt,
-            'phone_data': self._phone_data,
-        }
-        result.update(self._bill_taxes)
+    def gather_phone_info(self):
+        phone_data = PhoneTable(self.iter_phone_data())
+        result = self.header
+        result['phone_data'] = phone_data
         return result
 
 
-def parse_file(invoice_file_object):
+@lru_cache()
+def compile_header_re(front_tokens):
+    """Compile a single regex for the front page tokens and the taxes.
+
+    front_tokens are (name, token) pairs, every token is matched in a
+    group with its name.
+
+    """
+    front = '|'.join(
+        '(?P<%s>%s)' % (name, re.escape(token))
+        for name, token in front_tokens)
+    return re.compile(front + '|' + TAXES_RE)
+
+
+def interpret_pages(content, pagenos, **kwargs):
+    """Return (pageno, runs) for the pagenos pages of the PDF content."""
+    device = CellularConverter(BytesIO(content), **kwargs)
+    pagenos = set(pagenos)
+    pages = ((pageno, page)
+             for pageno, page in enumerate(device.doc.get_pages(), start=1)
+             if pageno in pagenos)
+    return list(device.interpret_pages(pages))
+
+
+def parse_file(invoice_file_object, **kwargs):
     try:
-        device = CellularConverter(invoice_file_object)
+        device = CellularConverter(invoice_file_object, **kwargs)
         result = device.gather_phone_info()
     except (PDFSyntaxError, PDFNoValidXRef, PSEOF):
         result = {}
@@ -245,10 +647,64 @@ def parse_file(invoice_file_object):
     return result
 
 
+def iter_phone_rows(invoice_file_object, header=None, **kwargs):
+    """Yield a PhoneRow for every phone in the invoice.
+
+    Rows are yielded as soon as each page is laid out, so the whole phone
+    data is never held in memory. If header is a dict, it is updated with
+    the rest of the bill data once all the rows were yielded.
+
+    """
+    try:
+        device = CellularConverter(invoice_file_object, **kwargs)
+        for row in device.iter_phone_rows():
+            yield row
+    except (PDFSyntaxError, PDFNoValidXRef, PSEOF):
+        return
+
+    if header is not None:
+        header.update(device.header)
+
+
+def result_to_json(result):
+    """Return a JSON serializable copy of a parse_file result."""
+    data = {}
+    for k, v in result.items():
+        if k == 'phone_data':
+            v = [[str(i) for i in row] for row in v]
+        elif isinstance(v, datetime):
+            v = v.strftime(DATETIME_FORMAT)
+        elif isinstance(v, Decimal):
+            v = str(v)
+        data[k] = v
+    return data
+
+
+def result_from_json(data):
+    """Return a parse_file result from its result_to_json copy."""
+    result = {}
+    for k, v in data.items():
+        if v is None or k == 'bill_number':
+            pass
+        elif k == 'bill_date':
+            v = datetime.strptime(v, DATETIME_FORMAT)
+        elif k == 'phone_data':
+            v = PhoneTable(
+                row[:3] + [Decimal(i) for i in row[3:]] for row in v)
+        else:
+            v = Decimal(str(v))
+        result[k] = v
+    return result
+
+
 if __name__ == '__main__':
     fname = sys.argv[1]  # fail if no filename is given
+    full_scan = '--full-scan' in sys.argv[2:]
+    workers = os.cpu_count() if '--parallel' in sys.argv[2:] else None
+    text_only = '--text-only' in sys.argv[2:]
     with open(fname, 'rb') as f:
-        data = parse_file(f)
+        data = parse_file(f, full_scan=full_scan, workers=workers,
+                          text_only=text_only)
     phone_data = data.pop('phone_data')
     print('-----------------------------')
     for k, v in data.items():
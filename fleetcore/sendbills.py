@@ -1,36 +1,173 @@
 # coding: utf-8
 
+import hashlib
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.template import Context, Template
 
 
 SUBJECT = 'Total del celu (consumo de %s)'
+# messages sent over the same connection
+BATCH_SIZE = 20
+# extra attempts for every message that could not be sent
+RETRIES = 2
+# seconds to wait before retrying, multiplied by the attempt number
+RETRY_DELAY = 1
+# amount of compiled report templates kept
+TEMPLATE_CACHE_SIZE = 32
+
+
+class TemplateCache(object):
+    """Keep the most recently used compiled report templates.
+
+    Templates are cached by fleet and a hash of their text, so a changed
+    template is never served from the cache, even if it was edited in
+    another process.
+
+    """
+
+    def __init__(self, max_size=TEMPLATE_CACHE_SIZE):
+        self.max_size = max_size
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._templates)
+
+    def get(self, fleet):
+        """Return the compiled report template for fleet."""
+        text = fleet.report_consumption_template
+        key = (fleet.pk, hashlib.sha1(text.encode('utf-8')).hexdigest())
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                return template
+
+        template = Template(text)
+        with self._lock:
+            self._templates[key] = template
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+        return template
+
+    def invalidate(self, fleet_id):
+        """Forget the templates compiled for the fleet with fleet_id."""
+        with self._lock:
+            for key in [k for k in self._templates if k[0] == fleet_id]:
+                del self._templates[key]
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+
+template_cache = TemplateCache()
+
+
+@receiver([post_save, post_delete], sender='fleetcore.Fleet')
+def invalidate_report_template(sender, instance, **kwargs):
+    template_cache.invalidate(instance.pk)
 
 
 class BillSummarySender(object):
-    """Send emails with consumption summary to leaders."""
+    """Send emails with consumption summary to leaders.
 
-    def __init__(self, bill):
+    Messages are sent in batches of batch_size, each batch over its own
+    connection, and batches are sent by up to workers threads at once.
+
+    """
+
+    def __init__(self, bill, batch_size=BATCH_SIZE, retries=RETRIES,
+                 workers=1, retry_delay=RETRY_DELAY):
         self.bill = bill
+        self.batch_size = batch_size
+        self.retries = retries
+        self.workers = workers
+        self.retry_delay = retry_delay
 
-    def send_reports(self, dry_run=True):
+    def build_messages(self):
+        """Return an EmailMessage with the report for every leader."""
         result = []
-        template = Template(self.bill.fleet.report_consumption_template)
+        template = template_cache.get(self.bill.fleet)
+        subject = SUBJECT % self.bill.billing_date.strftime('%B')
+        from_email = settings.EMAIL_HOST_USER
         for leader, data in self.bill.details.items():
             body = template.render(Context({'bill': self.bill, 'data': data,
                                             'leader': leader}))
-            subject = SUBJECT % self.bill.billing_date.strftime('%B')
-            from_email = settings.EMAIL_HOST_USER
-            to_list = [leader.email, from_email]
-
-            kwargs = dict(
-                subject=subject, message=body, from_email=from_email,
-                recipient_list=to_list, fail_silently=False,
-            )
-            if dry_run:
-                result.append(kwargs)
-            else:
-                send_mail(**kwargs)
-
+            result.append(EmailMessage(
+                subject=subject, body=body, from_email=from_email,
+                to=[leader.email, from_email]))
         return result
+
+    def send_reports(self, dry_run=True):
+        """Send the reports, return a report of the delivery.
+
+        If dry_run is set, nothing is sent, and a list with the arguments
+        send_mail would be called with for every message is returned.
+
+        """
+        messages = self.build_messages()
+        if dry_run:
+            return [
+                dict(subject=m.subject, message=m.body,
+                     from_email=m.from_email, recipient_list=m.to,
+                     fail_silently=False)
+                for m in messages]
+        return self.deliver(messages)
+
+    def deliver(self, messages):
+        """Send messages, return a dict with the result for each of them.
+
+        Every result has the message recipients, whether it was sent, the
+        amount of attempts made and the last error (if any).
+
+        """
+        batches = [messages[i:i + self.batch_size]
+                   for i in range(0, len(messages), self.batch_size)]
+        if self.workers > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(self.workers) as executor:
+                reports = list(executor.map(self.send_batch, batches))
+        else:
+            reports = [self.send_batch(batch) for batch in batches]
+        return [result for report in reports for result in report]
+
+    def send_batch(self, messages):
+        """Send messages over a single connection, retrying failures."""
+        report = []
+        connection = get_connection(fail_silently=False)
+        try:
+            for message in messages:
+                report.append(self._send(connection, message))
+        finally:
+            connection.close()
+        return report
+
+    def _send(self, connection, message):
+        error = None
+        for attempt in range(1, self.retries + 2):
+            if attempt > 1:
+                time.sleep(self.retry_delay * (attempt - 1))
+            try:
+                connection.open()
+                connection.send_messages([message])
+            except Exception as e:
+                error = '%s: %s' % (e.__class__.__name__, e)
+                logging.warning('Could not send report to %s (attempt %s): '
+                                '%s', ', '.join(message.to), attempt, error)
+                # the connection may be broken, open a new one next time
+                connection.close()
+            else:
+                return dict(recipients=message.to, sent=True,
+                            attempts=attempt, error=None)
+        return dict(recipients=message.to, sent=False, attempts=attempt,
+                    error=error)
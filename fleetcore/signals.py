@@ -0,0 +1,7 @@
+# coding: utf-8
+
+from django.dispatch import Signal
+
+
+# sent by a Bill once the totals of its consumptions were (re)calculated
+consumptions_changed = Signal(providing_args=['bill'])
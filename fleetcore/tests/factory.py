@@ -7,6 +7,7 @@ from django.contrib.auth import get_user_model
 
 from fleetcore.models import (
     Bill,
+    BillTotal,
     Consumption,
     DataPack,
     Fleet,
@@ -34,7 +35,7 @@ class Factory(object):
         return int(random.random() * (10 ** digits))
 
     def make_fleetuser(self, **kwargs):
-        _kwargs = dict(username='username-%s' % self.make_random_number())
+        _kwargs = dict(username='username-%s' % self.make_random_string())
         _kwargs.update(kwargs)
         result = User.objects.create_user(**_kwargs)
         return result
@@ -91,3 +92,7 @@ class Factory(object):
     def make_penalty(self, **kwargs):
         default = dict(bill=self.make_bill(), plan=self.make_plan())
         return self.make_something(Penalty, default, **kwargs)
+
+    def make_billtotal(self, **kwargs):
+        default = dict(bill=self.make_bill())
+        return self.make_something(BillTotal, default, **kwargs)
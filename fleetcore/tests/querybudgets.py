@@ -0,0 +1,23 @@
+# coding: utf-8
+
+
+class QueryBudgetMixin(object):
+    """Test case mixin checking the amount of queries a view takes.
+
+    query_budgets maps view names (as in the URLconf, with their namespace)
+    to the most queries a request to them may take. Responses are checked
+    with the request_stats set by the InstrumentationMiddleware.
+
+    """
+
+    query_budgets = {}
+
+    def assertWithinBudget(self, response):
+        view_name = response.resolver_match.view_name
+        budget = self.query_budgets.get(view_name)
+        if budget is None:
+            self.fail('No query budget for the %r view.' % view_name)
+        queries = response.request_stats.queries
+        self.assertLessEqual(
+            queries, budget, 'The %r view took %s queries, its budget is %s.' %
+            (view_name, queries, budget))
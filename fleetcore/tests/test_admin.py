@@ -2,9 +2,14 @@
 
 from unittest.mock import patch
 
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from fleetcore import jobs
+from fleetcore.models import BillTotal, Consumption, Job
 from fleetcore.tests.factory import Factory
 
 
@@ -33,7 +38,119 @@ class BillAdminTestCase(TestCase):
         return reverse('admin:recalculate', kwargs=dict(bill_id=self.bill.id))
 
     def test_recalculate(self):
-        self.client.get(self.recalculate_url)
-        # bill is parsed
-        # bill is adjusted
-        # response is a redirect to details
+        response = self.client.get(self.recalculate_url)
+
+        # the recalculation is queued, and the response is a redirect to
+        # the bill details
+        self.assertEqual(response.status_code, 302)
+        job = Job.objects.get()
+        self.assertEqual(job.bill, self.bill)
+        self.assertEqual(job.kind, Job.RECALCULATE)
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertFalse(self.calculate_penalties_mock.called)
+
+    def test_notify_users(self):
+        url = reverse('admin:notify-users', kwargs=dict(bill_id=self.bill.id))
+
+        response = self.client.post(url, {'send_emails': 'Send emails'})
+
+        self.assertEqual(response.status_code, 302)
+        job = Job.objects.get()
+        self.assertEqual(job.bill, self.bill)
+        self.assertEqual(job.kind, Job.NOTIFY)
+
+    def test_add_invoice(self):
+        url = reverse('admin:fleetcore_bill_add')
+        invoice = SimpleUploadedFile('invoice.pdf', b'%PDF')
+
+        response = self.client.post(url, {
+            'fleet': self.bill.fleet.id, 'invoice': invoice,
+            'upload_date_0': '2018-10-01', 'upload_date_1': '10:00',
+            'billing_total': '0', 'billing_debt': '0',
+            'internal_tax': '0.0417', 'iva_tax': '0.27',
+            'other_tax': '0.04',
+            'penalty_set-TOTAL_FORMS': '0',
+            'penalty_set-INITIAL_FORMS': '0',
+            'job_set-TOTAL_FORMS': '0', 'job_set-INITIAL_FORMS': '0',
+        })
+
+        self.assertEqual(response.status_code, 302)
+        job = Job.objects.get()
+        self.assertEqual(job.kind, Job.PARSE)
+        self.assertEqual(bytes(job.payload), b'%PDF')
+        self.assertEqual(job.payload_name, 'invoice.pdf')
+        self.assertIsNone(job.bill.parsing_date)
+
+    def test_change_with_parse_pending(self):
+        jobs.enqueue(self.bill, Job.PARSE, payload=b'%PDF',
+                     payload_name='invoice.pdf')
+        url = reverse('admin:fleetcore_bill_change', args=[self.bill.id])
+
+        # the invoice is not required again while it is being processed
+        response = self.client.post(url, {
+            'fleet': self.bill.fleet.id,
+            'upload_date_0': '2018-10-01', 'upload_date_1': '10:00',
+            'billing_total': '0', 'billing_debt': '0',
+            'internal_tax': '0.0417', 'iva_tax': '0.27',
+            'other_tax': '0.04',
+            'penalty_set-TOTAL_FORMS': '0',
+            'penalty_set-INITIAL_FORMS': '0',
+            'job_set-TOTAL_FORMS': '1', 'job_set-INITIAL_FORMS': '1',
+            'job_set-0-id': Job.objects.get().id,
+            'job_set-0-bill': self.bill.id,
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def add_consumptions(self, amount):
+        plan = self.factory.make_plan()
+        leader = self.factory.make_fleetuser(
+            username='leader-%s' % amount, leader=self.admin_user)
+        for i in range(amount):
+            user = self.factory.make_fleetuser(
+                username='user-%s-%s' % (amount, i), leader=leader)
+            phone = self.factory.make_phone(user=user)
+            Consumption.objects.create(phone=phone, bill=self.bill, plan=plan)
+
+    def count_change_queries(self):
+        url = reverse('admin:fleetcore_bill_change', args=[self.bill.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_change_queries_do_not_depend_on_consumptions(self):
+        self.add_consumptions(1)
+        self.count_change_queries()  # warm up the content types cache
+        expected = self.count_change_queries()
+
+        self.add_consumptions(5)
+        self.assertEqual(self.count_change_queries(), expected)
+
+
+class ConsumptionAdminTestCase(TestCase):
+    """The test suite for the ConsumptionAdmin."""
+
+    def setUp(self):
+        super(ConsumptionAdminTestCase, self).setUp()
+        self.factory = Factory()
+        self.bill = self.factory.make_bill()
+        admin_user = self.factory.make_admin_user(password='admin')
+        self.client.login(username=admin_user.username, password='admin')
+
+    def test_delete_selected_refreshes_bill_totals(self):
+        plan = self.factory.make_plan()
+        consumptions = [
+            self.factory.make_consumption(
+                bill=self.bill, plan=plan, reported_total=total)
+            for total in (10, 5)]
+        url = reverse('admin:fleetcore_consumption_changelist')
+
+        response = self.client.post(url, {
+            'action': 'delete_selected', 'post': 'yes',
+            '_selected_action': [consumptions[0].pk]})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(BillTotal.objects.get(bill=self.bill).total,
+                         consumptions[1].total)
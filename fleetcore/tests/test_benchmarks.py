@@ -0,0 +1,145 @@
+# coding: utf-8
+
+import json
+import os
+import shutil
+import tempfile
+
+from io import BytesIO, StringIO
+from unittest import TestCase
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from fleetcore import pdf2cell
+from fleetcore.benchmarks import runner
+from fleetcore.benchmarks.invoicegen import make_invoice
+
+
+RESULT = dict(rows=10, filler_pages=0, seconds=0.5, peak_rss_mb=50.0,
+              rows_per_second=20.0)
+
+
+class InvoiceGeneratorTestCase(TestCase):
+    """Generated invoices are parsed back into the generated data."""
+
+    def assert_parsed(self, rows=5, filler_pages=2, **kwargs):
+        content, expected = make_invoice(
+            rows=rows, filler_pages=filler_pages)
+        result = pdf2cell.parse_file(BytesIO(content), **kwargs)
+        self.assertEqual(result, expected)
+
+    def test_layout(self):
+        self.assert_parsed()
+
+    def test_text_only(self):
+        self.assert_parsed(text_only=True)
+
+    def test_full_scan(self):
+        self.assert_parsed(full_scan=True)
+
+    def test_parallel(self):
+        self.assert_parsed(filler_pages=4, workers=2)
+
+    def test_same_seed_same_invoice(self):
+        self.assertEqual(make_invoice(rows=3, seed=7),
+                         make_invoice(rows=3, seed=7))
+        self.assertNotEqual(make_invoice(rows=3, seed=7)[1],
+                            make_invoice(rows=3, seed=8)[1])
+
+
+class RunnerTestCase(TestCase):
+    """The test suite for the benchmark runner."""
+
+    def test_run(self):
+        result = runner.run(10, filler_pages=1, repeat=1)
+
+        self.assertEqual(result['rows'], 10)
+        self.assertEqual(result['filler_pages'], 1)
+        self.assertGreater(result['seconds'], 0)
+        self.assertGreater(result['peak_rss_mb'], 0)
+        self.assertGreater(result['rows_per_second'], 0)
+
+    def test_make_label(self):
+        self.assertEqual(runner.make_label(10, 2), 'rows=10 filler_pages=2')
+        self.assertEqual(
+            runner.make_label(10, 2, workers=None, text_only=True),
+            'rows=10 filler_pages=2 text_only=True')
+
+    def test_compare(self):
+        baseline = {'a': RESULT, 'b': RESULT}
+        results = {
+            'a': dict(RESULT, seconds=0.6, peak_rss_mb=60.0),
+            'b': dict(RESULT, seconds=0.61, peak_rss_mb=40.0),
+            'c': dict(RESULT, seconds=100),
+        }
+
+        self.assertEqual(runner.compare(results, baseline, tolerance=0.2), [
+            'b: seconds is 0.61, baseline is 0.5.'])
+
+    def test_save_and_load_baseline(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = os.path.join(directory, 'baseline.json')
+
+        self.assertEqual(runner.load_baseline(filename), {})
+        runner.save_baseline({'a': RESULT}, filename)
+        self.assertEqual(runner.load_baseline(filename), {'a': RESULT})
+
+    def test_baseline_file(self):
+        baseline = runner.load_baseline()
+
+        for size in runner.SIZES:
+            label = runner.make_label(size, runner.FILLER_PAGES)
+            self.assertEqual(baseline[label]['rows'], size)
+
+
+@patch('fleetcore.benchmarks.runner.run')
+class BenchmarkParserTestCase(TestCase):
+    """The test suite for the benchmark_parser command."""
+
+    def setUp(self):
+        super(BenchmarkParserTestCase, self).setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.baseline = os.path.join(directory, 'baseline.json')
+        self.stdout = StringIO()
+
+    def call(self, *args):
+        call_command('benchmark_parser', '--baseline', self.baseline,
+                     '--sizes', '10', *args, stdout=self.stdout)
+
+    def test_save(self, mock_run):
+        mock_run.return_value = RESULT
+
+        self.call('--save', '--text-only', '-f', '0')
+
+        mock_run.assert_called_once_with(
+            10, 0, 3, text_only=True, full_scan=False, workers=None)
+        with open(self.baseline) as f:
+            self.assertEqual(json.load(f), {
+                'rows=10 filler_pages=0 text_only=True': RESULT})
+        self.assertIn('0.5000 seconds, 50.0 MB peak RSS, 20.0 rows/second',
+                      self.stdout.getvalue())
+
+    def test_no_regression(self, mock_run):
+        mock_run.return_value = RESULT
+        self.call('--save')
+
+        mock_run.return_value = dict(RESULT, seconds=0.55)
+        self.call()
+
+    def test_regression(self, mock_run):
+        mock_run.return_value = RESULT
+        self.call('--save')
+
+        mock_run.return_value = dict(RESULT, peak_rss_mb=100.0)
+        with self.assertRaises(CommandError) as cm:
+            self.call()
+        self.assertIn('peak_rss_mb is 100.0, baseline is 50.0.',
+                      str(cm.exception))
+
+    def test_invalid_options(self, mock_run):
+        self.assertRaises(CommandError, self.call, '--repeat', '0')
+        self.assertFalse(mock_run.called)
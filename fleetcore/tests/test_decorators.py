@@ -1,3 +1,6 @@
+from time import monotonic
+from unittest.mock import patch
+
 from django.conf.urls import url
 from django.contrib.auth import get_user_model
 from django.contrib.auth.views import LogoutView
@@ -6,7 +9,11 @@ from django.test import TestCase
 from django.test.utils import override_settings
 from django.urls import reverse
 
-from fleetcore.decorators import leadership_required
+from fleetcore.decorators import (
+    LEADERSHIP_CACHE_TIMEOUT,
+    leadership_cache,
+    leadership_required,
+)
 
 User = get_user_model()
 
@@ -16,8 +23,8 @@ def home(request):
 
 
 @leadership_required
-def test_view(request, username):
-    return HttpResponse('OK')
+def test_view(request, user):
+    return HttpResponse('OK %s' % user.username)
 
 
 urlpatterns = [
@@ -32,6 +39,7 @@ urlpatterns = [
 class LeadershipRequiredTestCase(TestCase):
 
     def setUp(self):
+        leadership_cache.clear()
         self.url = reverse('test-leadership', args=['user'])
         self.admin = User.objects.create_user(username='admin',
                                               password='admin')
@@ -46,13 +54,13 @@ class LeadershipRequiredTestCase(TestCase):
         self.client.login(username='admin', password='admin')
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.content, b'OK')
+        self.assertEqual(response.content, b'OK user')
 
     def test_leader_pass(self):
         self.client.login(username='leader', password='leader')
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.content, b'OK')
+        self.assertEqual(response.content, b'OK user')
 
     def test_anonymous_404(self):
         response = self.client.get(self.url)
@@ -62,3 +70,39 @@ class LeadershipRequiredTestCase(TestCase):
         self.client.login(username='user', password='user')
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 404)
+
+    def test_unknown_user_404(self):
+        self.client.login(username='leader', password='leader')
+        url = reverse('test-leadership', args=['unknown'])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_user_cached(self):
+        self.client.login(username='leader', password='leader')
+        self.client.get(self.url)
+
+        # only the session and the logged in user are loaded
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.content, b'OK user')
+
+    def test_cache_invalidated_on_save(self):
+        self.client.login(username='leader', password='leader')
+        self.client.get(self.url)
+
+        self.user.leader = self.admin
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_cache_expires(self):
+        self.client.login(username='leader', password='leader')
+        self.client.get(self.url)
+
+        # not saved, so the cache is not invalidated
+        User.objects.filter(pk=self.user.pk).update(leader=self.admin)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        later = monotonic() + LEADERSHIP_CACHE_TIMEOUT + 1
+        with patch('fleetcore.decorators.monotonic', return_value=later):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,133 @@
+# coding: utf-8
+
+import os
+import pstats
+import shutil
+import socket
+import tempfile
+
+from collections import OrderedDict
+from io import BytesIO
+
+from django.test import TestCase, override_settings
+
+from fleetcore import instrumentation, pdf2cell
+from fleetcore.benchmarks.invoicegen import make_invoice
+from fleetcore.models import Plan
+
+
+class ListSink(object):
+    """Keep every emitted recorder."""
+
+    def __init__(self):
+        self.recorders = []
+
+    def emit(self, recorder):
+        self.recorders.append(recorder)
+
+
+class InstrumentationTestCase(TestCase):
+    """The test suite for the instrumentation helpers."""
+
+    def setUp(self):
+        super(InstrumentationTestCase, self).setUp()
+        self.sink = ListSink()
+
+    def test_timer_without_run(self):
+        timings = OrderedDict()
+        with instrumentation.timer('parse', timings):
+            pass
+        self.assertEqual(list(timings), ['parse'])
+        self.assertGreaterEqual(timings['parse'], 0)
+        self.assertIsNone(instrumentation.current())
+
+    def test_incr_without_run(self):
+        instrumentation.incr('rows_parsed')  # does nothing
+        self.assertIsNone(instrumentation.current())
+
+    def test_record(self):
+        with instrumentation.record(
+                'invoice', sinks=[self.sink], bill=3) as recorder:
+            self.assertIs(instrumentation.current(), recorder)
+            with instrumentation.timer('parse'):
+                list(Plan.objects.all())
+            with instrumentation.timer('parse'):
+                Plan.objects.create(name='foo')
+            instrumentation.incr('rows_parsed', 5)
+            instrumentation.incr('rows_parsed')
+
+        self.assertIsNone(instrumentation.current())
+        self.assertEqual(self.sink.recorders, [recorder])
+        self.assertEqual(recorder.name, 'invoice')
+        self.assertEqual(recorder.tags, {'bill': 3})
+        self.assertEqual(list(recorder.timings), ['parse'])
+        self.assertEqual(
+            recorder.counters, {'queries': 2, 'rows_parsed': 6})
+
+    def test_record_emits_on_error(self):
+        with self.assertRaises(ValueError):
+            with instrumentation.record('invoice', sinks=[self.sink]):
+                raise ValueError()
+        self.assertEqual(len(self.sink.recorders), 1)
+        self.assertIsNone(instrumentation.current())
+
+    def test_record_profile(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'run.pstats')
+
+        with instrumentation.record(
+                'invoice', sinks=[], profile_path=path):
+            list(Plan.objects.all())
+
+        stats = pstats.Stats(path)
+        self.assertGreater(stats.total_calls, 0)
+
+    @override_settings(INSTRUMENTATION={'SINKS': [
+        {'BACKEND': 'fleetcore.instrumentation.StatsdSink',
+         'PREFIX': 'test'}]})
+    def test_configured_sinks(self):
+        sinks = instrumentation.get_sinks()
+        self.assertEqual(len(sinks), 1)
+        self.assertIsInstance(sinks[0], instrumentation.StatsdSink)
+        self.assertEqual(sinks[0].prefix, 'test')
+
+    def test_parse_counters(self):
+        content, _ = make_invoice(rows=10, filler_pages=2)
+        with instrumentation.record('invoice', sinks=[]) as recorder:
+            pdf2cell.parse_file(
+                BytesIO(content), counter=instrumentation.incr)
+        self.assertEqual(recorder.counters['rows_parsed'], 10)
+        self.assertEqual(recorder.counters['pages_interpreted'], 2)
+
+
+class SinksTestCase(TestCase):
+    """The test suite for the instrumentation sinks."""
+
+    def setUp(self):
+        super(SinksTestCase, self).setUp()
+        self.recorder = instrumentation.Recorder('invoice', job=7, bill=3)
+        self.recorder.add_time('parse', 0.25)
+        self.recorder.incr('rows_parsed', 10)
+
+    def test_logging_sink(self):
+        with self.assertLogs('fleetcore.instrumentation', 'INFO') as logs:
+            instrumentation.LoggingSink().emit(self.recorder)
+        self.assertEqual(logs.output, [
+            'INFO:fleetcore.instrumentation:name=invoice bill=3 job=7 '
+            'parse_ms=250.0 rows_parsed=10'])
+
+    def test_statsd_sink(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+
+        sink = instrumentation.StatsdSink(
+            host='127.0.0.1', port=server.getsockname()[1])
+        sink.emit(self.recorder)
+
+        data = server.recv(1024)
+        self.assertEqual(
+            data, b'fleetcore.invoice.parse:250.000|ms\n'
+                  b'fleetcore.invoice.rows_parsed:10|c')
@@ -0,0 +1,241 @@
+# coding: utf-8
+
+import os
+import pstats
+import shutil
+import tempfile
+
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+
+from fleetcore import jobs
+from fleetcore.models import Bill, Job
+from fleetcore.tests.factory import Factory
+
+
+class JobsTestCase(TestCase):
+    """The test suite for the background jobs."""
+
+    def setUp(self):
+        super(JobsTestCase, self).setUp()
+        self.factory = Factory()
+        self.bill = self.factory.make_bill()
+
+        patcher = patch('fleetcore.jobs.logging')
+        self.mock_logging = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_claim_next(self):
+        job1 = jobs.enqueue(self.bill, Job.RECALCULATE)
+        job2 = jobs.enqueue(self.bill, Job.NOTIFY)
+
+        claimed = jobs.claim_next()
+        self.assertEqual(claimed, job1)
+        self.assertEqual(claimed.status, Job.RUNNING)
+        self.assertIsNotNone(claimed.started)
+        self.assertEqual(jobs.claim_next(), job2)
+        self.assertIsNone(jobs.claim_next())
+
+    def test_claim_next_already_claimed(self):
+        jobs.enqueue(self.bill, Job.RECALCULATE)
+
+        # another worker claims the job between the select and the update
+        with patch('django.db.models.query.QuerySet.update', return_value=0):
+            self.assertIsNone(jobs.claim_next())
+
+    @override_settings(JOB_TIMEOUT=60)
+    def test_claim_next_fails_abandoned(self):
+        abandoned = jobs.enqueue(self.bill, Job.PARSE)
+        running = jobs.enqueue(self.bill, Job.NOTIFY)
+        Job.objects.filter(id=abandoned.id).update(
+            status=Job.RUNNING, started=now() - timedelta(seconds=61))
+        Job.objects.filter(id=running.id).update(
+            status=Job.RUNNING, started=now() - timedelta(seconds=30))
+
+        self.assertIsNone(jobs.claim_next())
+
+        abandoned = Job.objects.get(id=abandoned.id)
+        self.assertEqual(abandoned.status, Job.FAILED)
+        self.assertIsNotNone(abandoned.finished)
+        self.assertEqual(
+            abandoned.message,
+            'Job abandoned after running for more than 60 seconds.')
+        self.assertEqual(Job.objects.get(id=running.id).status, Job.RUNNING)
+        self.assertFalse(jobs.is_parse_pending(self.bill))
+
+    @patch('fleetcore.models.Bill.calculate_penalties')
+    @patch('fleetcore.models.Bill.parse_invoice')
+    def test_parse(self, mock_parse, mock_calculate):
+        def check_invoice(invoice):
+            self.assertEqual(invoice.read(), b'%PDF')
+            self.assertEqual(invoice.name, 'invoice.pdf')
+        mock_parse.side_effect = check_invoice
+        jobs.enqueue(self.bill, Job.PARSE, payload=b'%PDF',
+                     payload_name='invoice.pdf')
+
+        job = jobs.run(jobs.claim_next())
+
+        self.assertEqual(mock_parse.call_count, 1)
+        mock_calculate.assert_called_once_with()
+        job = Job.objects.get(id=job.id)
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.progress, 100)
+        self.assertEqual(job.message, 'Invoice processed successfully.')
+        self.assertIsNone(job.payload)
+        self.assertGreaterEqual(job.seconds, 0)
+
+    @patch('fleetcore.models.Bill.calculate_penalties')
+    @patch('fleetcore.models.Bill.parse_invoice')
+    def test_parse_profiled(self, mock_parse, mock_calculate):
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        jobs.enqueue(self.bill, Job.PARSE, payload=b'%PDF')
+
+        config = dict(SINKS=[], PROFILE_DIR=profile_dir)
+        with override_settings(INSTRUMENTATION=config):
+            job = jobs.run(jobs.claim_next())
+
+        path = os.path.join(
+            profile_dir, 'bill-%s-job-%s.pstats' % (self.bill.id, job.id))
+        self.assertEqual(
+            job.message, 'Invoice processed successfully (profile: %s).' %
+            path)
+        stats = pstats.Stats(path)
+        self.assertGreater(stats.total_calls, 0)
+
+    @patch('fleetcore.models.Bill.parse_invoice')
+    def test_parse_error(self, mock_parse):
+        mock_parse.side_effect = Bill.ParseError('Plan FOO does not exist.')
+        jobs.enqueue(self.bill, Job.PARSE, payload=b'%PDF')
+
+        job = jobs.run(jobs.claim_next())
+
+        job = Job.objects.get(id=job.id)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(
+            job.message,
+            'Invoice processed unsuccessfully. Error: Plan FOO does not '
+            'exist.')
+        self.assertEqual(bytes(job.payload), b'%PDF')
+        self.assertFalse(self.mock_logging.exception.called)
+
+    def test_recalculate_not_parsed(self):
+        jobs.enqueue(self.bill, Job.RECALCULATE)
+
+        job = jobs.run(jobs.claim_next())
+
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(
+            job.message, 'Invoice processed unsuccessfully. Error: Bill must '
+            'be parsed before making adjustments.')
+
+    def mock_sender(self, mock_sender, failed=()):
+        messages = [EmailMessage(to=[email, 'fleet@example.com'])
+                    for email in ('a@example.com', 'b@example.com')]
+        mock_sender.return_value.build_messages.return_value = messages
+
+        def deliver(messages):
+            return [
+                dict(recipients=m.to, sent=m.to[0] not in failed, attempts=1,
+                     error='SMTPException: boom' if m.to[0] in failed
+                     else None)
+                for m in messages]
+        mock_sender.return_value.deliver.side_effect = deliver
+        return mock_sender.return_value
+
+    @patch('fleetcore.jobs.BillSummarySender')
+    def test_notify(self, mock_sender):
+        sender = self.mock_sender(mock_sender)
+        jobs.enqueue_notify(self.bill)
+
+        job = jobs.run(jobs.claim_next())
+
+        mock_sender.assert_called_once_with(self.bill)
+        self.assertEqual(len(sender.deliver.call_args[0][0]), 2)
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(
+            job.message, 'Notifications sent successfully (2).')
+
+    @patch('fleetcore.jobs.BillSummarySender')
+    def test_notify_error(self, mock_sender):
+        self.mock_sender(mock_sender, failed=['b@example.com'])
+        jobs.enqueue_notify(self.bill)
+
+        job = jobs.run(jobs.claim_next())
+
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(
+            job.message, 'Notification error. Error: b@example.com, '
+            'fleet@example.com (SMTPException: boom)')
+
+    @patch('fleetcore.jobs.BillSummarySender')
+    def test_notify_retries_failed_only(self, mock_sender):
+        sender = self.mock_sender(mock_sender, failed=['b@example.com'])
+        jobs.enqueue_notify(self.bill)
+        jobs.run(jobs.claim_next())
+        sender = self.mock_sender(mock_sender)
+
+        jobs.enqueue_notify(self.bill)
+        job = jobs.run(jobs.claim_next())
+
+        [message] = sender.deliver.call_args[0][0]
+        self.assertEqual(message.to[0], 'b@example.com')
+        self.assertEqual(job.status, Job.DONE)
+
+        # once everybody was notified, everybody is notified again
+        jobs.enqueue_notify(self.bill)
+        jobs.run(jobs.claim_next())
+        self.assertEqual(len(sender.deliver.call_args[0][0]), 2)
+
+    @patch('fleetcore.jobs.BillSummarySender')
+    def test_unexpected_error(self, mock_sender):
+        mock_sender.side_effect = ValueError('boom')
+        jobs.enqueue(self.bill, Job.NOTIFY)
+
+        job = jobs.run(jobs.claim_next())
+
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.message, 'boom')
+        self.mock_logging.exception.assert_called_once_with(
+            'Job %s failed.', job.id)
+
+    @patch('fleetcore.management.commands.runjobs.time.sleep')
+    @patch('fleetcore.management.commands.runjobs.close_old_connections')
+    @patch('fleetcore.jobs.claim_next')
+    def test_runjobs_database_error(self, mock_claim, mock_close, mock_sleep):
+        # the database goes away, and the worker stops once it is back
+        mock_claim.side_effect = [DatabaseError('gone'), KeyboardInterrupt]
+        stderr = StringIO()
+
+        call_command('runjobs', stderr=stderr)
+
+        self.assertEqual(mock_close.call_count, 2)
+        self.assertEqual(mock_sleep.call_count, 1)
+        self.assertIn('Could not claim a job: gone', stderr.getvalue())
+
+    @patch('fleetcore.jobs.claim_next')
+    def test_runjobs_once_database_error(self, mock_claim):
+        mock_claim.side_effect = DatabaseError('gone')
+        self.assertRaises(DatabaseError, call_command, 'runjobs', '--once')
+
+    @patch('fleetcore.models.Bill.calculate_penalties')
+    def test_runjobs_once(self, mock_calculate):
+        job1 = jobs.enqueue(self.bill, Job.RECALCULATE)
+        job2 = jobs.enqueue(self.bill, Job.RECALCULATE)
+        stdout = StringIO()
+
+        call_command('runjobs', '--once', stdout=stdout)
+
+        self.assertEqual(mock_calculate.call_count, 2)
+        self.assertEqual(
+            [j.status for j in Job.objects.filter(id__in=[job1.id, job2.id])],
+            [Job.DONE, Job.DONE])
+        self.assertIn('Penalties re-calculated successfully.',
+                      stdout.getvalue())
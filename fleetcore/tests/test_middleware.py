@@ -0,0 +1,99 @@
+# coding: utf-8
+
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from fleetcore.decorators import leadership_cache
+from fleetcore.middleware import RequestStats
+from fleetcore.tests.factory import Factory
+from fleetcore.tests.querybudgets import QueryBudgetMixin
+
+
+User = get_user_model()
+
+
+class RequestStatsTestCase(TestCase):
+
+    def test_server_timing(self):
+        stats = RequestStats()
+        stats.queries = 3
+        stats.sql_seconds = 0.0021
+        stats.template_seconds = 0.01
+        stats.seconds = 0.5
+        self.assertEqual(
+            stats.server_timing(),
+            'db;desc="3 queries";dur=2.1, tpl;desc="Templates";dur=10.0, '
+            'total;desc="Total";dur=500.0')
+
+
+# pages are measured without the dashboard cache, since a cached page only
+# costs the session, the logged in user and the cache read
+@override_settings(DASHBOARD_CACHE=None)
+class InstrumentationMiddlewareTestCase(QueryBudgetMixin, TestCase):
+
+    query_budgets = {
+        'home': 7,
+        'user-details': 7,
+        'consumption-history': 3,
+        'user-consumption-history': 3,
+        'consumption-series': 4,
+        'user-consumption-series': 4,
+        # one more when the content types are not cached yet
+        'admin:fleetcore_bill_change': 16,
+    }
+
+    def setUp(self):
+        super(InstrumentationMiddlewareTestCase, self).setUp()
+        leadership_cache.clear()
+        self.factory = Factory()
+        self.leader = self.factory.make_admin_user(
+            username='leader', password='leader')
+        self.bill = self.factory.make_bill(billing_date=date.today())
+        for i in range(5):
+            user = self.factory.make_fleetuser(
+                username='user-%s' % i, leader=self.leader)
+            self.factory.make_consumption(user=user, bill=self.bill)
+            if i == 0:
+                self.user = user
+        self.factory.make_consumption(user=self.leader, bill=self.bill)
+        self.bill.refresh_totals()
+        self.client.login(username='leader', password='leader')
+
+    def test_headers(self):
+        response = self.client.get(reverse('home'))
+        stats = response.request_stats
+        self.assertGreater(stats.queries, 0)
+        self.assertGreater(stats.template_seconds, 0)
+        self.assertGreaterEqual(stats.seconds, stats.template_seconds)
+        self.assertEqual(response['Server-Timing'], stats.server_timing())
+
+    def test_log(self):
+        with self.assertLogs('fleetcore.requests', 'INFO') as logs:
+            response = self.client.get(reverse('consumption-history'))
+        stats = response.request_stats
+        self.assertEqual(logs.output, [
+            'INFO:fleetcore.requests:method=GET path=%s '
+            'view=consumption-history status=200 queries=%s sql_ms=%.1f '
+            'template_ms=%.1f total_ms=%.1f' % (
+                reverse('consumption-history'), stats.queries,
+                stats.sql_seconds * 1000, stats.template_seconds * 1000,
+                stats.seconds * 1000)])
+
+    def test_query_budgets(self):
+        urls = [
+            reverse('home'),
+            reverse('user-details', args=[self.user.username]),
+            reverse('consumption-history'),
+            reverse('user-consumption-history', args=[self.user.username]),
+            reverse('consumption-series'),
+            reverse('user-consumption-series', args=[self.user.username]),
+            reverse('admin:fleetcore_bill_change', args=[self.bill.pk]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertWithinBudget(response)
@@ -2,18 +2,27 @@
 
 import itertools
 import os
+import random
 
+from collections import defaultdict
 from datetime import date, datetime, timedelta
 from decimal import Decimal
-from io import BytesIO
+from io import BytesIO, StringIO
+from unittest import TestCase
 from unittest.mock import patch
 
 from django.contrib.auth import get_user_model
-from django.test import TransactionTestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import now
 
+from fleetcore import instrumentation
 from fleetcore.models import (
     Bill,
+    BillTotal,
     Consumption,
     DataPack,
     Fleet,
@@ -22,6 +31,7 @@ from fleetcore.models import (
     Phone,
     Plan,
     SMSPack,
+    bulk_update,
 )
 from fleetcore.pdf2cell import (
     EXCEEDED_MIN,
@@ -110,6 +120,8 @@ class FleetUserTestCase(BaseModelTestCase):
     model = FleetUser
 
 
+# queries are counted without the dashboard pages invalidation
+@override_settings(PARSE_CACHE=None, DASHBOARD_CACHE=None)
 class BillTestCase(BaseModelTestCase):
     """The test suite for the Bill model."""
 
@@ -133,7 +145,8 @@ class ParseInvoiceTestCase(BillTestCase):
                                     user=user)
 
     def assert_no_data_processed(self, file_obj):
-        self.mock_pdf_parser.assert_called_with(file_obj)
+        self.mock_pdf_parser.assert_called_with(
+            file_obj, counter=instrumentation.incr)
 
         self.assertEqual(Consumption.objects.count(), 0)
         # reload bill from db
@@ -211,7 +224,8 @@ class ParseInvoiceTestCase(BillTestCase):
             # both phones are in the system, so parse should succeed
             self.obj.parse_invoice(file_obj)
 
-        self.mock_pdf_parser.assert_called_with(file_obj)
+        self.mock_pdf_parser.assert_called_with(
+            file_obj, counter=instrumentation.incr)
         self.assertEqual(Consumption.objects.count(), 2)
 
         # reload bill from db
@@ -225,6 +239,52 @@ class ParseInvoiceTestCase(BillTestCase):
         for d in PDF_PARSED_SAMPLE['phone_data']:
             self.assert_consumption_processed(data=d)
 
+    def test_successful_parsing_not_bulk(self):
+        self.mock_pdf_parser.return_value = PDF_PARSED_SAMPLE
+        self._make_phone(plan='PLAN1', number='1234567890')
+        self._make_phone(plan='PLAN2', number='1987654320')
+
+        timings = self.obj.parse_invoice(BytesIO(), bulk=False)
+
+        self.assertEqual(list(timings), ['parse', 'write'])
+        self.assertEqual(Consumption.objects.count(), 2)
+        for d in PDF_PARSED_SAMPLE['phone_data']:
+            self.assert_consumption_processed(data=d)
+
+    def test_bulk_parsing_same_totals(self):
+        self.test_successful_parsing_not_bulk()
+        expected = list(Consumption.objects.order_by('phone__number').values(
+            'mins', 'total_before_taxes', 'taxes', 'total_before_round',
+            'total'))
+        Consumption.objects.all().delete()
+        bill = self.factory.make_bill()
+
+        timings = bill.parse_invoice(BytesIO(), bulk=True)
+
+        self.assertEqual(
+            list(timings), ['parse', 'lookup', 'build', 'write'])
+        result = list(Consumption.objects.order_by('phone__number').values(
+            'mins', 'total_before_taxes', 'taxes', 'total_before_round',
+            'total'))
+        self.assertEqual(result, expected)
+
+    def test_parse_cache(self):
+        self.mock_pdf_parser.return_value = {'bill_number': '123456abcd'}
+        cache = {
+            'BACKEND': 'fleetcore.parsecache.DjangoParseCache',
+            'LOCATION': 'default',
+        }
+        with override_settings(PARSE_CACHE=cache):
+            self.obj.parse_invoice(BytesIO(b'invoice'))
+            self.factory.make_bill().parse_invoice(BytesIO(b'invoice'))
+            self.assertEqual(self.mock_pdf_parser.call_count, 1)
+
+            bill = self.factory.make_bill()
+            bill.parse_invoice(BytesIO(b'invoice'), use_cache=False)
+            self.assertEqual(self.mock_pdf_parser.call_count, 2)
+
+        self.assertEqual(bill.provider_number, '123456abcd')
+
     def test_do_not_parse_twice(self):
         self.test_successful_parsing()
         self.assertRaises(Bill.ParseError, self.obj.parse_invoice, BytesIO())
@@ -440,6 +500,353 @@ class CalculatePenaltiesTestCase(BillTestCase):
         c = Consumption.objects.get(id=c.id)
         self.assertEqual(c.penalty_min, half)
 
+    def test_totals_updated(self):
+        self.plan1.price_min = Decimal('0.5')
+        self.plan1.save()
+        self.test_with_min_clearing_minutes_left()
+
+        for c in Consumption.objects.all():
+            total = c.total
+            c.save()  # recalculates totals
+            self.assertEqual(c.total, total)
+        # c1 and c2 both end up with 90 minutes, c3 used 120
+        c1, c2, c3 = Consumption.objects.all()
+        self.assertEqual(c1.total, c2.total)
+        self.assertLess(c2.total, c3.total)
+
+    def test_num_queries(self):
+        plan2 = Plan.objects.create(
+            name='PLAN2', included_min=50, included_sms=10,
+            with_sms_clearing=True)
+        for i in range(100):
+            self._make_consumption(plan2, '99%08d' % i)
+        self.obj.calculate_penalties()
+
+        # select consumptions, select and delete existing penalties, the
+        # per plan totals, insert penalties, update 103 consumptions in two
+        # batches, and then refresh the bill totals
+        with self.assertNumQueries(12):
+            self.obj.calculate_penalties()
+
+        penalty = Penalty.objects.get(plan=plan2)
+        self.assertEqual(penalty.minutes, 5000)
+        self.assertEqual(penalty.sms, 1000)
+        for c in Consumption.objects.filter(plan=plan2):
+            self.assertEqual(c.penalty_min, 50)
+            self.assertEqual(c.penalty_sms, 10)
+
+    def stored_totals(self):
+        return [[str(getattr(c, f)) for f in Consumption.calculated_fields]
+                for c in Consumption.objects.order_by('id')]
+
+    def test_apply_delta_same_totals_as_save(self):
+        self.plan1.included_sms = 50
+        self.plan1.with_sms_clearing = True
+        self.plan1.price_min = Decimal('0.37')
+        self.plan1.price_sms = Decimal('0.11')
+        self.plan1.save()
+        for i, c in enumerate(Consumption.objects.all()):
+            c.included_min = 33 * i
+            c.exceeded_min = Decimal('7.5') * i
+            c.sms = 20 + i * 10
+            c.sms_price = Decimal('1.23')
+            c.reported_total = Decimal('100.01') * i
+            c.save()
+        self.obj.calculate_penalties()
+        assert Penalty.objects.get().sms > 0
+
+        # update the consumptions, and then refresh the bill totals
+        # other backends read the consumptions before updating them
+        queries = 6 if connection.vendor == 'postgresql' else 7
+        with self.assertNumQueries(queries):
+            self.obj.apply_delta(Decimal('1.55'))
+        result = self.stored_totals()
+
+        for c in Consumption.objects.all():
+            c.save()
+        self.assertEqual(result, self.stored_totals())
+        for c in Consumption.objects.all():
+            self.assertEqual(c.extra, Decimal('1.55'))
+
+    def test_apply_delta_rounds_half_to_even(self):
+        self.plan1.with_min_clearing = False
+        self.plan1.save()
+        self.obj.internal_tax = self.obj.iva_tax = self.obj.other_tax = 0
+        self.obj.save()
+        totals = [Decimal('10.25'), Decimal('11.25'), Decimal('-10.75')]
+        for c, total in zip(Consumption.objects.all(), totals):
+            c.reported_total = total
+            c.save()
+
+        self.obj.apply_delta(Decimal('0.25'))
+
+        consumptions = Consumption.objects.all()
+        self.assertEqual([c.total_before_round for c in consumptions],
+                         [Decimal('10.5'), Decimal('11.5'), Decimal('-10.5')])
+        self.assertEqual([c.total for c in consumptions], [10, 12, -10])
+        for c in consumptions:
+            self.assertEqual(c.total, round(c.total_before_round))
+
+    def test_apply_delta_tie_after_taxes(self):
+        self.plan1.with_min_clearing = False
+        self.plan1.save()
+        self.obj.internal_tax = self.obj.other_tax = 0
+        self.obj.iva_tax = Decimal('0.5')
+        self.obj.save()
+        c = Consumption.objects.first()
+        c.reported_total = Decimal('66.64')
+        c.save()
+
+        self.obj.apply_delta(Decimal('0.54'))
+
+        c = Consumption.objects.get(pk=c.pk)
+        self.assertEqual(c.total_before_round, Decimal('100.5'))
+        self.assertEqual(c.total, 100)
+        c.save()
+        self.assertEqual(Consumption.objects.get(pk=c.pk).total, 100)
+
+
+class BillDetailsTestCase(BillTestCase):
+    """The test suite for the details property of the Bill model."""
+
+    def setUp(self):
+        super(BillDetailsTestCase, self).setUp()
+        self.plan = self.factory.make_plan(
+            name='PLAN1', with_min_clearing=False)
+        self.obj.internal_tax = self.obj.iva_tax = self.obj.other_tax = 0
+        self.obj.save()
+        admin = self.factory.make_admin_user(username='admin')
+        self.leader1 = self.factory.make_fleetuser(
+            username='leader1', first_name='B', leader=admin)
+        self.leader2 = self.factory.make_fleetuser(
+            username='leader2', first_name='A', leader=admin)
+        # a leader without consumptions is not included
+        self.factory.make_fleetuser(
+            username='leader3', first_name='C', leader=admin)
+        self.user1 = self.factory.make_fleetuser(
+            username='user1', leader=self.leader1)
+        self.user2 = self.factory.make_fleetuser(
+            username='user2', leader=self.user1)
+
+    def make_consumption(self, user, number, total):
+        phone = self.factory.make_phone(user=user, number=number)
+        return Consumption.objects.create(
+            phone=phone, bill=self.obj, plan=self.plan, reported_total=total)
+
+    def test_details(self):
+        c1 = self.make_consumption(self.leader1, '3', 10)
+        c2 = self.make_consumption(self.user1, '1', 5)
+        c3 = self.make_consumption(self.leader2, '2', 7)
+        # users not led by a superuser's leader are not included
+        self.make_consumption(self.user2, '4', 1)
+        self.make_consumption(self.factory.make_fleetuser(), '5', 1)
+
+        # superuser, leaders and consumptions
+        with self.assertNumQueries(3):
+            details = self.obj.details
+            for data in details.values():
+                for c in data['consumptions']:
+                    c.phone.user.get_full_name()
+                    c.plan.name
+
+        self.assertEqual(list(details.items()), [
+            (self.leader2, {'consumptions': [c3], 'total': 7}),
+            (self.leader1, {'consumptions': [c2, c1], 'total': 15}),
+        ])
+        with self.assertNumQueries(0):
+            self.assertIs(self.obj.details, details)
+
+    def test_details_forgotten_after_delta(self):
+        self.make_consumption(self.leader1, '1', 10)
+        self.assertEqual(self.obj.details[self.leader1]['total'], 10)
+
+        self.obj.apply_delta(Decimal('3'))
+
+        self.assertEqual(self.obj.details[self.leader1]['total'], 13)
+
+    def test_refresh_totals(self):
+        self.make_consumption(self.leader1, '3', 10)
+        self.make_consumption(self.user1, '1', 5)
+        self.make_consumption(self.leader2, '2', 7)
+        self.make_consumption(self.user2, '4', 1)
+
+        self.obj.refresh_totals()
+
+        bill_total = BillTotal.objects.get(bill=self.obj)
+        self.assertEqual((bill_total.total, bill_total.lines), (23, 4))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.obj.consumptions_total, 23)
+            self.assertEqual(self.obj.outcome_total, 23)
+            self.assertEqual(self.obj.outcome_debt, 23)
+        self.assertEqual(self.obj.details[self.leader1]['total'], 15)
+
+    def test_refresh_totals_without_superuser(self):
+        FleetUser.objects.filter(is_superuser=True).delete()
+        self.make_consumption(self.factory.make_fleetuser(), '1', 10)
+
+        self.obj.refresh_totals()
+
+        self.assertEqual(BillTotal.objects.get().total, 10)
+
+    def test_details_follow_leader_changes(self):
+        self.make_consumption(self.leader1, '1', 14)
+        self.make_consumption(self.user1, '2', 7)
+        self.make_consumption(self.leader2, '3', 9)
+
+        self.user1.leader = self.leader2
+        self.user1.save()
+
+        details = Bill.objects.get(pk=self.obj.pk).details
+        self.assertEqual(details[self.leader1]['total'], 14)
+        self.assertEqual(details[self.leader2]['total'], 16)
+
+    def test_totals_refreshed_on_consumption_save(self):
+        c = self.make_consumption(self.leader1, '1', 10)
+        self.make_consumption(self.user1, '2', 5)
+
+        c.extra = 50
+        c.save()
+
+        bill = Bill.objects.get(pk=self.obj.pk)
+        self.assertEqual(bill.consumptions_total, 65)
+        self.assertEqual(bill.details[self.leader1]['total'], 65)
+
+    def test_totals_refreshed_on_consumption_delete(self):
+        c = self.make_consumption(self.leader1, '1', 10)
+        self.make_consumption(self.user1, '2', 5)
+
+        c.delete()
+
+        bill = Bill.objects.get(pk=self.obj.pk)
+        self.assertEqual(bill.consumptions_total, 5)
+        self.assertEqual(bill.details[self.leader1]['total'], 5)
+
+    def test_rebuild_bill_totals(self):
+        self.make_consumption(self.leader1, '1', 10)
+        BillTotal.objects.filter(bill=self.obj).update(total=1)
+        other = self.factory.make_bill()
+        last_modified = Bill.objects.get(pk=self.obj.pk).last_modified
+        stdout = StringIO()
+
+        with patch('fleetcore.models.consumptions_changed') as mock_changed:
+            call_command('rebuild_bill_totals', stdout=stdout)
+
+        self.assertEqual(stdout.getvalue(), 'Rebuilt totals for 2 bills.\n')
+        # nothing changed for the bills, they are not flagged as modified
+        self.assertEqual(
+            Bill.objects.get(pk=self.obj.pk).last_modified, last_modified)
+        self.assertFalse(mock_changed.send.called)
+        self.assertEqual(
+            {(t.bill, t.total) for t in BillTotal.objects.all()},
+            {(self.obj, 10), (other, 0)})
+
+    def test_rebuild_bill_totals_missing_bill(self):
+        self.assertRaises(CommandError, call_command, 'rebuild_bill_totals',
+                          str(self.obj.id), '9999')
+
+
+class FakeConsumption(object):
+
+    def __init__(self, mins, penalty_min=0):
+        self.mins = mins
+        self.penalty_min = penalty_min
+
+    @property
+    def total_min(self):
+        return self.mins + self.penalty_min
+
+
+def reference_apply_partial_penalty(data, penalty, attr_name, attr_total):
+    """The original bucket by bucket penalty distribution."""
+    keys = sorted(data.keys())
+    for total1, total2 in zip(keys, keys[1:]):
+        cons = data[total1]
+        len_cons = Decimal(len(cons))
+        to_apply = min((total2 - total1) * len_cons, penalty)
+        if to_apply == 0:
+            break
+        penalty -= to_apply
+        to_apply = Decimal(to_apply / len_cons)
+        for c in cons:
+            setattr(c, attr_name, getattr(c, attr_name) + to_apply)
+        if penalty > 0:
+            data.pop(total1)
+            data[total2].extend(cons)
+        else:
+            break
+
+
+@patch('fleetcore.models.logging')
+class ApplyPartialPenaltyTestCase(TestCase):
+    """Bill._apply_partial_penalty matches the original implementation."""
+
+    def apply(self, target, usages, penalty):
+        """Return the penalties from the new and the original algorithms."""
+        consumptions = [FakeConsumption(u) for u in usages]
+        Bill()._apply_partial_penalty(
+            [(c.mins, c) for c in consumptions if c.mins < target],
+            target, penalty, 'penalty_min', 'total_min')
+
+        expected = [FakeConsumption(u) for u in usages]
+        data = defaultdict(list)
+        for c in expected:
+            if c.mins < target:
+                data[c.mins].append(c)
+        data[target].append(None)
+        reference_apply_partial_penalty(
+            data, penalty, 'penalty_min', 'total_min')
+
+        return ([c.penalty_min for c in consumptions],
+                [c.penalty_min for c in expected])
+
+    def assert_same_penalties(self, target, usages, penalty):
+        result, expected = self.apply(target, usages, penalty)
+        self.assertEqual(result, expected)
+        # the penalty is fully distributed, unless it exceeds the target
+        capacity = sum(target - u for u in usages if u < target)
+        self.assertAlmostEqual(
+            sum(result), min(penalty, capacity), places=20)
+
+    def test_example(self, mock_logging):
+        result, expected = self.apply(
+            Decimal(100), [Decimal(50), Decimal(80), Decimal(120)],
+            Decimal(50))
+
+        self.assertEqual(result, [40, 10, 0])
+        self.assertEqual(result, expected)
+
+    def test_zero_penalty(self, mock_logging):
+        self.assert_same_penalties(Decimal(100), [Decimal(50)], Decimal(0))
+        mock_logging.warning.assert_called_once_with(
+            'Can not apply a 0 value as penalty.')
+
+    def test_nothing_under_target(self, mock_logging):
+        self.assert_same_penalties(Decimal(10), [Decimal(10)], Decimal(5))
+        self.assertFalse(mock_logging.warning.called)
+
+    def test_exceeding_penalty(self, mock_logging):
+        self.assert_same_penalties(
+            Decimal(100), [Decimal(0), Decimal(90)], Decimal(500))
+
+    def test_random(self, mock_logging):
+        rand = random.Random(2011)
+        for _ in range(500):
+            target = Decimal(rand.randint(0, 30000)) / 100
+            usages = [Decimal(rand.randint(0, 40000)) / 100
+                      for _ in range(rand.randint(1, 30))]
+            # favour repeated usages and breakpoint penalties too
+            usages.extend(rand.sample(usages, rand.randint(0, len(usages))))
+            capacity = sum(target - u for u in usages if u < target)
+            penalty = rand.choice([
+                Decimal(rand.randint(1, 30000)) / 100,
+                Decimal(rand.randint(1, 7)),
+                capacity, capacity / 3, capacity + 1,
+                target - min(usages),
+            ])
+            if penalty <= 0:
+                continue
+            self.assert_same_penalties(target, usages, penalty)
+
 
 class ConsumptionTestCase(BaseModelTestCase):
     """The test suite for the Consumption model."""
@@ -502,6 +909,32 @@ class ConsumptionTestCase(BaseModelTestCase):
             self.assertEqual(self.obj.total_sms, i + k)
 
 
+class BulkUpdateTestCase(BaseModelTestCase):
+    """The test suite for bulk_update."""
+
+    @patch('fleetcore.models.BULK_UPDATE_BATCH_SIZE', 2)
+    def test_batches(self):
+        bill = self.factory.make_bill()
+        plan = self.factory.make_plan()
+        consumptions = [
+            self.factory.make_consumption(bill=bill, plan=plan)
+            for i in range(5)]
+        for i, c in enumerate(consumptions):
+            c.extra = i
+            c.sms = 10 * i
+
+        with CaptureQueriesContext(connection) as queries:
+            bulk_update(consumptions, ['extra', 'sms'])
+
+        updates = [q['sql'] for q in queries
+                   if q['sql'].startswith('UPDATE')]
+        self.assertEqual([sql.count(' WHEN ') for sql in updates], [4, 4, 2])
+
+        self.assertEqual(
+            [(c.extra, c.sms) for c in Consumption.objects.order_by('id')],
+            [(i, 10 * i) for i in range(5)])
+
+
 class PhoneTestCase(BaseModelTestCase):
     """The test suite for the Phone model."""
 
@@ -557,3 +990,9 @@ class PenaltyTestCase(BaseModelTestCase):
     """The test suite for the Penalty model."""
 
     model = Penalty
+
+
+class BillTotalTestCase(BaseModelTestCase):
+    """The test suite for the BillTotal model."""
+
+    model = BillTotal
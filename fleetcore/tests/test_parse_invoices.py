@@ -0,0 +1,86 @@
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+
+from datetime import datetime
+from decimal import Decimal
+from io import StringIO
+from unittest import TestCase
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from fleetcore import pdf2cell
+from fleetcore.management.commands.parse_invoices import load_results
+
+
+PARSED = {
+    'bill_date': datetime(2011, 10, 13),
+    'bill_debt': Decimal('123.45'),
+    'bill_number': '123456abcd',
+    'bill_total': Decimal('1234.56'),
+    'internal_tax': Decimal('0.041667'),
+    'other_tax': 0,
+    'phone_data': [
+        ['1234567890', 'Foo, Bar', 'PLAN1', Decimal('35.00'),
+         Decimal('10.80')],
+    ],
+}
+
+
+class ParseInvoicesTestCase(TestCase):
+    """The test suite for the parse_invoices command."""
+
+    def setUp(self):
+        super(ParseInvoicesTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for name in ('a.pdf', 'b.pdf', 'notes.txt'):
+            with open(os.path.join(self.directory, name), 'wb') as f:
+                f.write(b'not really a PDF')
+        self.output = os.path.join(self.directory, 'result.json')
+
+    def call_command(self, *args, **kwargs):
+        stderr = StringIO()
+        call_command(
+            'parse_invoices', *args, output=self.output, stderr=stderr,
+            **kwargs)
+        with open(self.output) as f:
+            results = list(load_results(f))
+        return results, stderr.getvalue()
+
+    def test_no_invoices(self):
+        self.assertRaises(
+            CommandError, call_command, 'parse_invoices',
+            os.path.join(self.directory, '*.xls'))
+
+    @patch('fleetcore.management.commands.parse_invoices.pdf2cell.'
+           'parse_file')
+    def test_results(self, mock_parse_file):
+        mock_parse_file.side_effect = [
+            PARSED, pdf2cell.CellularDataParseError('No phones')]
+
+        results, stats = self.call_command(self.directory, workers=0)
+
+        filenames = [
+            os.path.join(self.directory, n) for n in ('a.pdf', 'b.pdf')]
+        self.assertEqual(results, [
+            (filenames[0], PARSED, None),
+            (filenames[1], None, 'CellularDataParseError: No phones'),
+        ])
+        self.assertIn('Parsed 2 invoices (1 errors)', stats)
+        self.assertIn('invoices/second', stats)
+
+    def test_workers(self):
+        pattern = os.path.join(self.directory, '*')
+
+        results, stats = self.call_command(pattern, workers=2, chunksize=2)
+
+        self.assertEqual(
+            [os.path.basename(r[0]) for r in results],
+            ['a.pdf', 'b.pdf', 'notes.txt'])
+        # broken PDFs are parsed to empty results
+        self.assertEqual([r[1:] for r in results], [({}, None)] * 3)
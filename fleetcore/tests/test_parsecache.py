@@ -0,0 +1,123 @@
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+
+from io import BytesIO
+from unittest import TestCase
+from unittest.mock import patch
+
+from django.test import override_settings
+
+from fleetcore import parsecache
+
+
+class FileSystemParseCacheTestCase(TestCase):
+    """The test suite for the FileSystemParseCache."""
+
+    def setUp(self):
+        super(FileSystemParseCacheTestCase, self).setUp()
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+        self.cache = parsecache.FileSystemParseCache(
+            self.location, max_size=1024)
+
+    def test_missing(self):
+        self.assertIsNone(self.cache.get('foo'))
+
+    def test_set_get(self):
+        data = {'phone_data': [['123', 'Foo']]}
+        self.cache.set('foo', data)
+        self.assertEqual(self.cache.get('foo'), data)
+
+    @patch('fleetcore.parsecache.logging')
+    def test_corrupted_entry(self, mock_logging):
+        with open(os.path.join(self.location, 'foo.parse'), 'wb') as f:
+            f.write(b'')
+        self.assertIsNone(self.cache.get('foo'))
+        self.assertEqual(os.listdir(self.location), [])
+        self.assertTrue(mock_logging.warning.called)
+
+    def test_evicted_while_reading(self):
+        self.cache.set('foo', 'bar')
+        with patch('fleetcore.parsecache.os.utime') as mock_utime:
+            mock_utime.side_effect = FileNotFoundError
+            self.assertEqual(self.cache.get('foo'), 'bar')
+
+    def test_least_recently_used_are_evicted(self):
+        self.cache.set('a', 'x' * 400)
+        self.cache.set('b', 'x' * 400)
+        paths = [os.path.join(self.location, k + '.parse') for k in 'ab']
+        os.utime(paths[0], (1, 1))
+        os.utime(paths[1], (2, 2))
+        # using 'a' makes 'b' the least recently used
+        self.cache.get('a')
+
+        self.cache.set('c', 'x' * 400)
+
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('c'))
+
+    def test_clear(self):
+        self.cache.set('foo', 'bar')
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('foo'))
+
+
+class DjangoParseCacheTestCase(TestCase):
+    """The test suite for the DjangoParseCache."""
+
+    def test_set_get(self):
+        cache = parsecache.DjangoParseCache()
+        cache.set('foo', {'bill_number': '1234'})
+        self.assertEqual(cache.get('foo'), {'bill_number': '1234'})
+        self.assertEqual(
+            cache.cache.get('fleetcore-parse-foo'), {'bill_number': '1234'})
+
+
+class ParseFileTestCase(TestCase):
+    """The test suite for the cached parse_file."""
+
+    def setUp(self):
+        super(ParseFileTestCase, self).setUp()
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        settings = override_settings(PARSE_CACHE={
+            'BACKEND': 'fleetcore.parsecache.FileSystemParseCache',
+            'LOCATION': location,
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        patcher = patch('fleetcore.parsecache.pdf2cell.parse_file')
+        self.mock_parse_file = patcher.start()
+        self.mock_parse_file.return_value = {'bill_number': '1234'}
+        self.addCleanup(patcher.stop)
+
+    def test_make_key(self):
+        fd = BytesIO(b'some invoice')
+        key = parsecache.make_key(fd)
+        self.assertEqual(fd.tell(), 0)
+        self.assertEqual(key, parsecache.make_key(BytesIO(b'some invoice')))
+        self.assertNotEqual(key, parsecache.make_key(BytesIO(b'other')))
+        self.assertNotEqual(
+            key, parsecache.make_key(BytesIO(b'some invoice'), full_scan=True))
+        with patch('fleetcore.parsecache.pdf2cell.PARSER_VERSION', 0):
+            self.assertNotEqual(
+                key, parsecache.make_key(BytesIO(b'some invoice')))
+
+    def test_parsed_once(self):
+        fd = BytesIO(b'some invoice')
+        for i in range(3):
+            result = parsecache.parse_file(fd)
+            self.assertEqual(result, {'bill_number': '1234'})
+        self.mock_parse_file.assert_called_once_with(fd, counter=None)
+
+    def test_disabled(self):
+        fd = BytesIO(b'some invoice')
+        with override_settings(PARSE_CACHE=None):
+            parsecache.parse_file(fd)
+            parsecache.parse_file(fd)
+        self.assertEqual(self.mock_parse_file.call_count, 2)
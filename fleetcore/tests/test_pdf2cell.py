@@ -3,14 +3,432 @@
 import logging
 import json
 import os
+import pickle
+import subprocess
+import sys
 
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from decimal import Decimal
 from io import BytesIO
 from unittest import TestCase, SkipTest
+from unittest.mock import patch
+
+from pdfminer.pdffont import PDFUnicodeNotDefined
+from pdfminer.pdfinterp import PDFGraphicState, PDFTextState
+from pdfminer.utils import MATRIX_IDENTITY
 
 from fleetcore import pdf2cell
 
 
+FRONT_PAGE = [
+    'Fecha de Factura: 13/10/2011',
+    'Factura Nro.: 0001-12345678',
+    'TOTAL FACTURA: $1.234,56',
+    'TOTAL A PAGAR: $1.358,02',
+]
+PHONE_ROWS = [
+    '0351-155000Skywalker, Luke               PLAN1 ' +
+    ' '.join(['35,00', '45,00', '0,00', '103,00'] + ['0,00'] * 8 +
+             ['45,00', '10,80', '0,00', '90,80']),
+    '0351-155001Organa, Leia                  PLAN2 ' +
+    ' '.join(['35,00', '0,00', '0,00', '190,00'] + ['0,00'] * 12),
+]
+TAXES = [
+    'Impuesto Interno 4.1667% 12,34',
+    'Iva Percepcion 3% 10,00',
+    'Cargo 1% financ ENARD Ley 26.573/09 5,00',
+]
+
+
+class FakeFont(object):
+    """A font whose cids are the unicode code points, but for a snowman."""
+
+    fontname = 'Fake'
+    undefined = ord('\N{SNOWMAN}')
+
+    def decode(self, string):
+        return [ord(c) for c in string]
+
+    def to_unichr(self, cid):
+        if cid == self.undefined:
+            raise PDFUnicodeNotDefined(None, cid)
+        return chr(cid)
+
+    def char_width(self, cid):
+        return 0.5
+
+    def char_disp(self, cid):
+        return None
+
+    def is_multibyte(self):
+        return False
+
+    def is_vertical(self):
+        return False
+
+    def get_height(self):
+        return 1
+
+    def get_descent(self):
+        return 0
+
+
+class FakePage(object):
+    mediabox = (0, 0, 100, 100)
+
+
+class FakeInterpreter(object):
+    """Render fake pages, which are lists of lines, on the device.
+
+    Every line is a string, drawn followed by a horizontal line, or a list
+    of strings to be drawn inside a figure.
+
+    """
+
+    def __init__(self, rsrcmgr, device):
+        self.device = device
+        self.processed = []
+
+    def render_line(self, line):
+        textstate = PDFTextState()
+        textstate.font = FakeFont()
+        textstate.fontsize = 10
+        self.device.render_string(textstate, [line, -250])
+        path = [('m', 0, 0), ('l', 100, 0)]
+        self.device.paint_path(PDFGraphicState(), True, False, False, path)
+
+    def process_page(self, page):
+        self.processed.append(page)
+        self.device.set_ctm(MATRIX_IDENTITY)
+        self.device.begin_page(FakePage(), MATRIX_IDENTITY)
+        for line in page:
+            if isinstance(line, list):
+                self.device.begin_figure('figure', (0, 0, 1, 1),
+                                         MATRIX_IDENTITY)
+                for figure_line in line:
+                    self.render_line(figure_line)
+                self.device.end_figure('figure')
+            else:
+                self.render_line(line)
+        self.device.end_page(page)
+
+
+class CellularConverterTestCase(TestCase):
+    """The test suite for the CellularConverter."""
+
+    pages = [
+        ['Cover'],
+        FRONT_PAGE,
+        PHONE_ROWS + TAXES,
+        ['Calls detail'],
+        ['More calls detail'],
+    ] + [['Filler']] * 10
+
+    def setUp(self):
+        super(CellularConverterTestCase, self).setUp()
+        logging.getLogger().setLevel(logging.ERROR)
+
+    def make_converter(self, pages=None, **kwargs):
+        if pages is None:
+            pages = self.pages
+        patcher = patch('fleetcore.pdf2cell.PDFParser')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('fleetcore.pdf2cell.PDFDocument')
+        mock_document = patcher.start()
+        self.addCleanup(patcher.stop)
+        mock_document.return_value.get_pages.return_value = pages
+
+        self.interpreters = []
+
+        def make_interpreter(*args):
+            interpreter = FakeInterpreter(*args)
+            self.interpreters.append(interpreter)
+            return interpreter
+
+        patcher = patch('fleetcore.pdf2cell.PDFPageInterpreter',
+                        make_interpreter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        return pdf2cell.CellularConverter(BytesIO(), **kwargs)
+
+    @property
+    def processed(self):
+        return [p for i in self.interpreters for p in i.processed]
+
+    def assert_parsed(self, result):
+        self.assertEqual(result['bill_date'], datetime(2011, 10, 13))
+        self.assertEqual(result['bill_number'], '0001-12345678')
+        self.assertEqual(result['bill_total'], Decimal('1234.56'))
+        self.assertEqual(result['bill_debt'], Decimal('1358.02'))
+        self.assertEqual(result['internal_tax'], Decimal('0.041667'))
+        self.assertEqual(result['internal_tax_price'], Decimal('12.34'))
+        self.assertEqual(result['other_tax'], Decimal('0.04'))
+        self.assertEqual(result['other_tax_price'], Decimal('15.00'))
+        self.assertEqual(
+            [row[:3] for row in result['phone_data']],
+            [['351155000', 'Skywalker, Luke', 'PLAN1'],
+             ['351155001', 'Organa, Leia', 'PLAN2']])
+        self.assertEqual(
+            result['phone_data'][0][pdf2cell.SMS_PRICE], Decimal('10.80'))
+        self.assertEqual(
+            result['phone_data'][1][pdf2cell.TOTAL_PRICE], Decimal('0.00'))
+
+    def test_only_needed_pages_are_interpreted(self):
+        device = self.make_converter()
+
+        result = device.gather_phone_info()
+
+        self.assert_parsed(result)
+        self.assertIsInstance(result['phone_data'], pdf2cell.PhoneTable)
+        # every section is gathered by page 3, so pages 4 and 5 are skipped
+        self.assertEqual(self.processed, self.pages[1:3])
+
+    def test_pages_out_of_range_are_not_interpreted(self):
+        pages = [['Cover']] * 5 + self.pages[1:3]
+        device = self.make_converter(pages=pages)
+
+        self.assertRaises(
+            pdf2cell.CellularDataParseError, device.gather_phone_info)
+        self.assertEqual(self.processed, pages[1:5])
+
+    def test_full_scan(self):
+        device = self.make_converter(full_scan=True)
+
+        result = device.gather_phone_info()
+
+        self.assert_parsed(result)
+        self.assertEqual(self.processed, self.pages)
+
+    def test_taxes_out_of_taxes_pages(self):
+        pages = [['Cover'], FRONT_PAGE, PHONE_ROWS, [], TAXES]
+
+        device = self.make_converter(pages=pages)
+        result = device.gather_phone_info()
+        self.assertNotIn('internal_tax', result)
+
+        device = self.make_converter(pages=pages, full_scan=True)
+        result = device.gather_phone_info()
+        self.assertEqual(result['internal_tax'], Decimal('0.041667'))
+
+    def test_taxes_matched_by_name(self):
+        pages = [['Cover'], FRONT_PAGE, PHONE_ROWS + TAXES[1:]]
+
+        device = self.make_converter(pages=pages, full_scan=True)
+        result = device.gather_phone_info()
+
+        self.assertNotIn('internal_tax', result)
+        self.assertEqual(result['other_tax'], Decimal('0.04'))
+        self.assertEqual(result['other_tax_price'], Decimal('15.00'))
+
+    def test_front_page_tokens_in_runs(self):
+        device = self.make_converter()
+
+        device.process_header([
+            # the value is cut at the end of the run
+            'Factura Nro.: 0001', 'Fecha de Factura: 13/10/2011',
+            # not terminated, so it is not used
+            'TOTAL FACTURA: $1.234,56'])
+
+        self.assertEqual(device._bill_number, '0001')
+        self.assertEqual(device._bill_date, datetime(2011, 10, 13))
+        self.assertIsNone(device._bill_total)
+
+    def test_front_page_first_value_used(self):
+        device = self.make_converter()
+
+        device.process_header([
+            'Factura Nro.: ', 'TOTAL A PAGAR: $1.358,02',
+            'Factura Nro.: 0001-12345678 TOTAL A PAGAR: $9.999,99', ''])
+
+        self.assertEqual(device._bill_number, '0001-12345678')
+        self.assertEqual(device._bill_debt, Decimal('1358.02'))
+
+    def assert_parallel_parse(self, workers, **kwargs):
+        device = self.make_converter(**kwargs)
+        expected = device.gather_phone_info()
+        serial = self.processed
+        self.interpreters = []
+
+        # threads can share the patched PDF objects, processes could not
+        with patch('fleetcore.pdf2cell.ProcessPoolExecutor',
+                   ThreadPoolExecutor):
+            device = self.make_converter(workers=workers, **kwargs)
+            result = device.gather_phone_info()
+
+        self.assertEqual(result, expected)
+        return serial, self.processed
+
+    def test_parallel_same_result(self):
+        serial, parallel = self.assert_parallel_parse(workers=2)
+        # the needed pages are all interpreted before processing them
+        self.assertEqual(serial, self.pages[1:3])
+        self.assertCountEqual(parallel, self.pages[1:5])
+
+    def test_parallel_full_scan_same_result(self):
+        serial, parallel = self.assert_parallel_parse(
+            workers=4, full_scan=True)
+        self.assertEqual(serial, self.pages)
+        self.assertCountEqual(parallel, self.pages)
+        # each worker lays out its own share of pages
+        self.assertEqual(
+            [len(i.processed) for i in self.interpreters if i.processed],
+            [4, 4, 4, 3])
+
+    def test_text_only_same_result(self):
+        pages = [
+            ['Cover'],
+            FRONT_PAGE + [['Fecha de Factura: 01/01/2000']],
+            ['\N{SNOWMAN} \N{BLACK STAR}'] + PHONE_ROWS[:1] +
+            [[PHONE_ROWS[1]]] + TAXES,
+        ]
+        device = self.make_converter(pages=pages)
+        expected = device.gather_phone_info()
+        # text inside figures is not part of the page runs
+        self.assertEqual(len(expected['phone_data']), 1)
+
+        device = self.make_converter(pages=pages, text_only=True)
+        result = device.gather_phone_info()
+
+        self.assertEqual(result, expected)
+
+    def test_text_only_runs(self):
+        device = self.make_converter(text_only=True)
+        page = [['in a figure'], 'foo', ['in', ['nested'], 'figures'],
+                'bar \N{SNOWMAN}', 'baz']
+
+        [(pageno, runs)] = device.interpret_pages([(7, page)])
+
+        self.assertEqual(pageno, 7)
+        self.assertEqual(runs, ['', 'foo', '', 'bar (cid:9731)', 'baz', ''])
+
+    def test_iter_phone_rows(self):
+        device = self.make_converter(full_scan=True)
+
+        rows = device.iter_phone_rows()
+        first = next(rows)
+        # rows are yielded as soon as the table page is laid out
+        self.assertEqual(self.processed, self.pages[:3])
+        self.assertIsInstance(first, pdf2cell.PhoneRow)
+        self.assertEqual(first.phone_number, '351155000')
+        self.assertEqual(first.user, 'Skywalker, Luke')
+        self.assertEqual(first.sms, Decimal('45.00'))
+        self.assertEqual(first.total_price, Decimal('90.80'))
+
+        rest = list(rows)
+        self.assertEqual(self.processed, self.pages)
+        self.assertEqual([r.phone_number for r in rest], ['351155001'])
+
+        header = device.header
+        self.assertNotIn('phone_data', header)
+        self.assertEqual(header['bill_number'], '0001-12345678')
+        self.assertEqual(header['other_tax'], Decimal('0.04'))
+
+    def test_iter_phone_rows_wrong_values(self):
+        pages = [['Cover'], FRONT_PAGE, [PHONE_ROWS[0] + ' 1,00']]
+        device = self.make_converter(pages=pages)
+
+        self.assertRaises(
+            pdf2cell.CellularDataParseError, list, device.iter_phone_rows())
+
+    def test_iter_phone_rows_header(self):
+        self.make_converter()
+        header = {}
+
+        rows = list(pdf2cell.iter_phone_rows(BytesIO(), header=header))
+
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(header['bill_date'], datetime(2011, 10, 13))
+        self.assertEqual(header['internal_tax_price'], Decimal('12.34'))
+
+    def test_counter(self):
+        counts = {}
+
+        def counter(name, amount):
+            counts[name] = counts.get(name, 0) + amount
+
+        device = self.make_converter(full_scan=True, counter=counter)
+        device.gather_phone_info()
+
+        self.assertEqual(
+            counts, {'pages_interpreted': len(self.pages), 'rows_parsed': 2})
+
+    def test_django_free(self):
+        # the module is also run as a script, outside of the project
+        code = 'import sys, pdf2cell; sys.exit("django" in sys.modules)'
+        subprocess.check_call(
+            [sys.executable, '-c', code],
+            cwd=os.path.dirname(pdf2cell.__file__))
+
+
+class PhoneTableTestCase(TestCase):
+    """The test suite for the PhoneTable."""
+
+    row = ['351155000', 'Skywalker, Luke', 'PLAN1'] + [
+        Decimal('35.00'), Decimal('0.05'), Decimal('1234.50')]
+
+    def test_append_text(self):
+        table = pdf2cell.PhoneTable()
+        table.append_text(
+            '351155000', 'Skywalker, Luke', 'PLAN1',
+            ['35,00', '0,05', '1234,50'])
+
+        self.assertEqual(len(table), 1)
+        self.assertEqual(table, [self.row])
+        self.assertEqual(table[0][pdf2cell.MONTHLY_PRICE], Decimal('35.00'))
+        self.assertEqual(str(table[0][-1]), '1234.50')
+
+    def test_rows(self):
+        table = pdf2cell.PhoneTable([self.row, self.row[:4]])
+
+        self.assertEqual(len(table[0]), 6)
+        self.assertEqual(table[0][:3], self.row[:3])
+        self.assertEqual(table[1], self.row[:4])
+        self.assertEqual(table[-1][-1], Decimal('35.00'))
+        self.assertEqual(list(table[1]), self.row[:4])
+        self.assertRaises(IndexError, table.__getitem__, 2)
+        self.assertRaises(IndexError, table[1].__getitem__, 4)
+
+    def test_strings_interned(self):
+        table = pdf2cell.PhoneTable()
+        table.append_text(*(''.join(['PLAN', '1']) for i in range(3)),
+                          amounts=[])
+        table.append_text(*(''.join(['PLAN', '1']) for i in range(3)),
+                          amounts=[])
+        self.assertIs(table[0][pdf2cell.PLAN], table[1][pdf2cell.PLAN])
+
+    def test_append_more_decimal_places(self):
+        table = pdf2cell.PhoneTable()
+        row = self.row[:3] + [Decimal('1.001')]
+        self.assertRaises(ValueError, table.append, row)
+
+    def test_append_row(self):
+        table = pdf2cell.PhoneTable([self.row])
+        other = pdf2cell.PhoneTable(table)
+        self.assertEqual(other, table)
+
+    def test_column(self):
+        table = pdf2cell.PhoneTable([self.row, self.row])
+        self.assertEqual(table.column(pdf2cell.PLAN), ['PLAN1', 'PLAN1'])
+        self.assertEqual(table.column(pdf2cell.SERVICES), [5, 5])
+
+    def test_json(self):
+        result = {'phone_data': pdf2cell.PhoneTable([self.row])}
+        data = pdf2cell.result_to_json(result)
+        self.assertEqual(
+            data['phone_data'], [self.row[:3] + ['35.00', '0.05', '1234.50']])
+
+        result = pdf2cell.result_from_json(json.loads(json.dumps(data)))
+        self.assertIsInstance(result['phone_data'], pdf2cell.PhoneTable)
+        self.assertEqual(result['phone_data'], [self.row])
+
+    def test_pickle(self):
+        table = pdf2cell.PhoneTable([self.row])
+        self.assertEqual(pickle.loads(pickle.dumps(table)), table)
+
+
 class ParsePDFTestCase(TestCase):
     """The test suite for the parse_pdf method."""
 
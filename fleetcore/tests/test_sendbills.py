@@ -0,0 +1,197 @@
+# coding: utf-8
+
+from datetime import date
+from smtplib import SMTPServerDisconnected
+from unittest.mock import patch
+
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+
+from fleetcore.sendbills import (
+    BillSummarySender,
+    TemplateCache,
+    template_cache,
+)
+from fleetcore.tests.factory import Factory
+
+
+class FlakyBackend(locmem.EmailBackend):
+    """A locmem backend failing for the recipients in failures."""
+
+    # recipient: amount of times sending to it fails
+    failures = {}
+    connections = 0
+
+    def open(self):
+        if not getattr(self, 'opened', False):
+            FlakyBackend.connections += 1
+            self.opened = True
+        return True
+
+    def close(self):
+        self.opened = False
+
+    def send_messages(self, messages):
+        for message in messages:
+            recipient = message.to[0]
+            if self.failures.get(recipient, 0) > 0:
+                self.failures[recipient] -= 1
+                raise SMTPServerDisconnected('Connection unexpectedly closed')
+        return super(FlakyBackend, self).send_messages(messages)
+
+
+@override_settings(EMAIL_HOST_USER='fleet@example.com')
+class BillSummarySenderTestCase(TestCase):
+    """The test suite for the BillSummarySender."""
+
+    def setUp(self):
+        super(BillSummarySenderTestCase, self).setUp()
+        self.factory = Factory()
+        fleet = self.factory.make_fleet(
+            report_consumption_template='{{ leader.username }}')
+        self.bill = self.factory.make_bill(
+            fleet=fleet, billing_date=date(2018, 10, 1))
+        admin = self.factory.make_admin_user(username='admin')
+        plan = self.factory.make_plan()
+        for i in range(5):
+            leader = self.factory.make_fleetuser(
+                username='leader%s' % i, first_name=str(i),
+                email='leader%s@example.com' % i, leader=admin)
+            phone = self.factory.make_phone(user=leader)
+            self.bill.consumption_set.create(phone=phone, plan=plan)
+
+        FlakyBackend.failures = {}
+        FlakyBackend.connections = 0
+        patcher = patch('fleetcore.sendbills.logging')
+        self.mock_logging = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_sender(self, **kwargs):
+        kwargs.setdefault('retry_delay', 0)
+        return BillSummarySender(self.bill, **kwargs)
+
+    def test_dry_run(self):
+        result = self.make_sender().send_reports(dry_run=True)
+
+        self.assertEqual(result[0], dict(
+            subject='Total del celu (consumo de October)',
+            message='leader0', from_email='fleet@example.com',
+            recipient_list=['leader0@example.com', 'fleet@example.com'],
+            fail_silently=False))
+        self.assertEqual(len(result), 5)
+        self.assertEqual(mail.outbox, [])
+
+    def test_send(self):
+        report = self.make_sender().send_reports(dry_run=False)
+
+        self.assertEqual(report, [
+            dict(recipients=['leader%s@example.com' % i, 'fleet@example.com'],
+                 sent=True, attempts=1, error=None)
+            for i in range(5)])
+        self.assertEqual([m.body for m in mail.outbox],
+                         ['leader%s' % i for i in range(5)])
+
+    @override_settings(
+        EMAIL_BACKEND='fleetcore.tests.test_sendbills.FlakyBackend')
+    def test_batches(self):
+        report = self.make_sender(batch_size=2).send_reports(dry_run=False)
+
+        self.assertTrue(all(r['sent'] for r in report))
+        self.assertEqual(FlakyBackend.connections, 3)
+        self.assertEqual(len(mail.outbox), 5)
+
+    @override_settings(
+        EMAIL_BACKEND='fleetcore.tests.test_sendbills.FlakyBackend')
+    def test_threads(self):
+        sender = self.make_sender(batch_size=1, workers=3)
+        report = sender.send_reports(dry_run=False)
+
+        self.assertEqual([r['recipients'][0] for r in report],
+                         ['leader%s@example.com' % i for i in range(5)])
+        self.assertEqual(FlakyBackend.connections, 5)
+        self.assertEqual(len(mail.outbox), 5)
+
+    @override_settings(
+        EMAIL_BACKEND='fleetcore.tests.test_sendbills.FlakyBackend')
+    def test_retries(self):
+        FlakyBackend.failures = {
+            'leader1@example.com': 2, 'leader3@example.com': 5}
+
+        report = self.make_sender(retries=2).send_reports(dry_run=False)
+
+        self.assertEqual(
+            [(r['sent'], r['attempts']) for r in report],
+            [(True, 1), (True, 3), (True, 1), (False, 3), (True, 1)])
+        self.assertEqual(
+            report[3]['error'],
+            'SMTPServerDisconnected: Connection unexpectedly closed')
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), [
+            'leader0@example.com', 'leader1@example.com',
+            'leader2@example.com', 'leader4@example.com'])
+        # a new connection is opened after every failure
+        self.assertEqual(FlakyBackend.connections, 6)
+
+
+class TemplateCacheTestCase(TestCase):
+    """The test suite for the compiled report templates cache."""
+
+    def setUp(self):
+        super(TemplateCacheTestCase, self).setUp()
+        self.factory = Factory()
+        self.fleet = self.factory.make_fleet(
+            report_consumption_template='Hi {{ leader }}')
+        template_cache.clear()
+        self.addCleanup(template_cache.clear)
+        patcher = patch('fleetcore.sendbills.Template', wraps=Template)
+        self.mock_template = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def render(self, fleet, cache=template_cache):
+        return cache.get(fleet).render(Context({'leader': 'foo'}))
+
+    def test_compiled_once(self):
+        self.assertEqual(self.render(self.fleet), 'Hi foo')
+        self.assertEqual(self.render(self.fleet), 'Hi foo')
+
+        self.assertEqual(self.mock_template.call_count, 1)
+
+    def test_fleet_edited(self):
+        self.render(self.fleet)
+
+        self.fleet.report_consumption_template = 'Bye {{ leader }}'
+        self.fleet.save()
+
+        self.assertEqual(len(template_cache), 0)
+        self.assertEqual(self.render(self.fleet), 'Bye foo')
+        self.assertEqual(len(template_cache), 1)
+
+    def test_fleet_edited_elsewhere(self):
+        self.render(self.fleet)
+        # not saved, as if it were changed by another process
+        self.fleet.report_consumption_template = 'Bye {{ leader }}'
+
+        self.assertEqual(self.render(self.fleet), 'Bye foo')
+
+    def test_fleet_deleted(self):
+        self.render(self.fleet)
+        self.fleet.delete()
+
+        self.assertEqual(len(template_cache), 0)
+
+    def test_lru_eviction(self):
+        cache = TemplateCache(max_size=2)
+        fleets = [self.factory.make_fleet(report_consumption_template=str(i))
+                  for i in range(3)]
+
+        self.render(fleets[0], cache)
+        self.render(fleets[1], cache)
+        self.render(fleets[0], cache)  # fleets[1] is the least recently used
+        self.render(fleets[2], cache)
+        self.assertEqual(self.mock_template.call_count, 3)
+
+        self.render(fleets[0], cache)
+        self.assertEqual(self.mock_template.call_count, 3)
+        self.render(fleets[1], cache)
+        self.assertEqual(self.mock_template.call_count, 4)
@@ -0,0 +1,135 @@
+# coding: utf-8
+
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from django.urls import reverse
+
+from fleetcore import viewcache
+from fleetcore.models import Phone
+from fleetcore.tests.test_views import BaseViewTestCase
+
+
+User = get_user_model()
+
+
+class DashboardCacheTestCase(BaseViewTestCase):
+    """The test suite for the cached dashboard pages."""
+
+    def setUp(self):
+        viewcache.get_dashboard_cache()[0].clear()
+        super(DashboardCacheTestCase, self).setUp()
+        self.client.login(username=self.username, password=self.password)
+
+    def assert_cached(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # only the session, the logged in user and the cached page are
+        # loaded
+        with self.assertNumQueries(3):
+            cached = self.client.get(url)
+        self.assertEqual(cached.content, response.content)
+        return response
+
+    def test_home_cached(self):
+        self.assert_cached(reverse('home'))
+
+    def test_history_cached(self):
+        self.assert_cached(reverse('consumption-history'))
+
+    def test_history_pages_cached_apart(self):
+        url = reverse('consumption-history')
+        first = self.client.get(url)
+        other = self.client.get(url, {'before': '2000-01-01.1'})
+        self.assertNotEqual(first.content, other.content)
+
+    def test_leader_pages_cached_apart(self):
+        url = reverse('user-details', args=['foo'])
+        self.client.get(reverse('home'))
+
+        self.client.login(username='leader', password='leader')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['current_user'], self.user)
+
+    def test_leadership_still_required(self):
+        url = reverse('user-details', args=['foo'])
+        self.client.login(username='leader', password='leader')
+        self.client.get(url)
+
+        self.client.login(username=self.username, password=self.password)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_refreshed_on_bill_changes(self):
+        self.assert_cached(reverse('home'))
+        self.consumption.bill.apply_delta(Decimal('2'))
+
+        response = self.client.get(reverse('home'))
+        self.assertIsNotNone(response.context)
+        self.assertEqual(
+            response.context['consumptions'][0].total, Decimal('2'))
+
+    def test_refreshed_on_consumption_save(self):
+        self.assert_cached(reverse('consumption-history'))
+        self.consumption.sms = 12
+        self.consumption.save()
+
+        response = self.client.get(reverse('consumption-history'))
+        self.assertIsNotNone(response.context)
+        self.assertEqual(response.context['consumptions'][0].sms, 12)
+
+    def test_refreshed_for_previous_leader(self):
+        self.client.login(username='leader', password='leader')
+        self.assert_cached(reverse('home'))
+
+        user = User.objects.get(pk=self.user.pk)
+        user.leader = User.objects.create_user(username='other')
+        user.save()
+
+        response = self.client.get(reverse('home'))
+        self.assertIsNotNone(response.context)
+
+    def test_refreshed_for_previous_phone_user(self):
+        self.assert_cached(reverse('home'))
+
+        phone = Phone.objects.get(pk=self.consumption.phone.pk)
+        phone.user = self.leader
+        phone.save()
+
+        response = self.client.get(reverse('home'))
+        self.assertIsNotNone(response.context)
+
+    def test_kept_on_other_user_changes(self):
+        self.assert_cached(reverse('home'))
+        self.factory.make_phone()
+
+        with self.assertNumQueries(3):
+            self.client.get(reverse('home'))
+
+    def test_refreshed_on_any_bill_changes(self):
+        # consumptions changes are rare, so they refresh every page
+        self.assert_cached(reverse('home'))
+        self.factory.make_consumption()
+
+        response = self.client.get(reverse('home'))
+        self.assertIsNotNone(response.context)
+
+    def test_check_shared_cache(self):
+        self.assertEqual(viewcache.check_dashboard_cache(None), [])
+
+    @override_settings(DASHBOARD_CACHE={'LOCATION': 'default'})
+    def test_check_process_local_cache(self):
+        errors = viewcache.check_dashboard_cache(None)
+        self.assertEqual([e.id for e in errors], ['fleetcore.E001'])
+
+    @override_settings(DASHBOARD_CACHE=None)
+    def test_disabled(self):
+        self.client.get(reverse('home'))
+        response = self.client.get(reverse('home'))
+        self.assertIsNotNone(response.context)
+
+    def test_leader_page_cached(self):
+        self.client.login(username='leader', password='leader')
+        self.assert_cached(reverse('user-consumption-history', args=['foo']))
@@ -1,11 +1,17 @@
 # coding: utf-8
 
 from datetime import date, timedelta
+from decimal import Decimal
+from unittest.mock import patch
 
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from fleetcore.decorators import leadership_cache
+from fleetcore.models import Consumption
 from fleetcore.tests.factory import Factory
 
 
@@ -20,6 +26,7 @@ class BaseViewTestCase(TestCase):
 
     def setUp(self):
         super(BaseViewTestCase, self).setUp()
+        leadership_cache.clear()
         self.factory = Factory()
         self._create_test_data()
 
@@ -121,7 +128,7 @@ class ConsumptionHistoryTestCase(BaseViewTestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.context['current_user'], self.user)
-        self.assertEqual(response.context['consumptions'].count(), 2)
+        self.assertEqual(len(response.context['consumptions']), 2)
 
     def test_leadership_required(self):
         self.client.login(username=self.username, password=self.password)
@@ -135,4 +142,154 @@ class ConsumptionHistoryTestCase(BaseViewTestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.context['current_user'], self.user)
-        self.assertEqual(response.context['consumptions'].count(), 2)
+        self.assertEqual(len(response.context['consumptions']), 2)
+
+    def add_consumptions(self, amount):
+        for i in range(amount):
+            c = self.factory.make_consumption(user=self.user)
+            c.bill.billing_date = date(2000, 1, 1) + timedelta(days=31 * i)
+            c.bill.save()
+
+    def get_history(self, **params):
+        self.client.login(username=self.username, password=self.password)
+        return self.client.get(reverse('consumption-history'), params)
+
+    @patch('fleetcore.views.HISTORY_PAGE_SIZE', 2)
+    def test_pagination(self):
+        # two consumptions on the same date
+        c = self.factory.make_consumption(user=self.user)
+        c.bill.billing_date = self.consumption.bill.billing_date
+        c.bill.save()
+        self.add_consumptions(1)
+
+        pages = []
+        response = self.get_history()
+        pages.append(response.context['consumptions'])
+        while response.context['next_cursor']:
+            self.assertContains(
+                response, '?before=%s' % response.context['next_cursor'])
+            response = self.get_history(
+                before=response.context['next_cursor'])
+            pages.append(response.context['consumptions'])
+
+        self.assertEqual([len(page) for page in pages], [2, 2])
+        consumptions = pages[0] + pages[1]
+        self.assertEqual(consumptions[:2], [c, self.consumption])
+        self.assertEqual(consumptions[2], self.old_consumption)
+        self.assertEqual(
+            consumptions[3].bill.billing_date, date(2000, 1, 1))
+
+    @patch('fleetcore.views.HISTORY_PAGE_SIZE', 2)
+    def test_pagination_without_billing_date(self):
+        undated = [self.factory.make_consumption(user=self.user)
+                   for i in range(2)]
+
+        pages = []
+        response = self.get_history()
+        pages.append(response.context['consumptions'])
+        while response.context['next_cursor']:
+            response = self.get_history(
+                before=response.context['next_cursor'])
+            pages.append(response.context['consumptions'])
+
+        self.assertEqual(pages, [
+            [self.consumption, self.old_consumption],
+            [undated[1], undated[0]]])
+
+    @patch('fleetcore.views.HISTORY_PAGE_SIZE', 1)
+    def test_pagination_within_no_billing_date(self):
+        undated = [self.factory.make_consumption(user=self.user)
+                   for i in range(3)]
+
+        response = self.get_history(before='none.%s' % undated[2].id)
+
+        self.assertEqual(response.context['consumptions'], [undated[1]])
+        self.assertEqual(
+            response.context['next_cursor'], 'none.%s' % undated[1].id)
+
+    def test_invalid_cursor(self):
+        response = self.get_history(before='yesterday')
+        self.assertEqual(response.status_code, 404)
+
+    @patch('fleetcore.views.HISTORY_PAGE_SIZE', 5)
+    def test_queries_do_not_depend_on_history_length(self):
+        self.get_history()  # warm up caches
+        with CaptureQueriesContext(connection) as queries:
+            self.get_history()
+        expected = len(queries)
+
+        self.add_consumptions(10)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_history()
+        self.assertEqual(len(queries), expected)
+        self.assertEqual(len(response.context['consumptions']), 5)
+
+
+class ConsumptionSeriesTestCase(BaseViewTestCase):
+
+    def setUp(self):
+        super(ConsumptionSeriesTestCase, self).setUp()
+        # mins is calculated on save, so store the values directly
+        Consumption.objects.filter(pk=self.consumption.pk).update(
+            mins=Decimal('10.25'), penalty_min=Decimal('2.5'), sms=7,
+            penalty_sms=3)
+
+    def get_series(self, username=None, **headers):
+        if username is None:
+            url = reverse('consumption-series')
+        else:
+            url = reverse('user-consumption-series', args=[username])
+        return self.client.get(url, **headers)
+
+    def test_login_required(self):
+        url = reverse('consumption-series')
+        response = self.client.get(url)
+        expected = reverse('login') + '?next=' + url
+        self.assertRedirects(response, expected)
+
+    def test_logged_in_user_series(self):
+        self.client.login(username=self.username, password=self.password)
+        with self.assertNumQueries(4):  # session, user, series state, rows
+            response = self.get_series()
+        month = self.consumption.bill.billing_date.month
+        self.assertEqual(response.json(), {
+            'mins': [[month, 10.2]], 'penalty_min': [[month, 2.5]],
+            'sms': [[month, 7]], 'penalty_sms': [[month, 3]]})
+
+    def test_leadership_required(self):
+        self.client.login(username=self.username, password=self.password)
+        response = self.get_series('foo')
+        self.assertEqual(response.status_code, 404)
+
+    def test_leader_get_access(self):
+        self.client.login(username='leader', password='leader')
+        response = self.get_series('foo')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['mins']), 1)
+
+    def test_revalidation(self):
+        self.client.login(username=self.username, password=self.password)
+        response = self.get_series()
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        response = self.get_series(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_revalidation_after_bill_changes(self):
+        self.client.login(username=self.username, password=self.password)
+        etag = self.get_series()['ETag']
+
+        self.consumption.bill.refresh_totals()
+        response = self.get_series(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_revalidation_after_new_consumption(self):
+        self.client.login(username=self.username, password=self.password)
+        etag = self.get_series()['ETag']
+
+        self.factory.make_consumption(
+            user=self.user, bill=self.consumption.bill)
+        response = self.get_series(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['mins']), 2)
@@ -12,8 +12,10 @@ from django.urls import path
 
 from fleetcore.views import (
     consumption_history,
+    consumption_series,
     user_details,
     user_consumption_history,
+    user_consumption_series,
 )
 
 
@@ -22,6 +24,9 @@ urlpatterns = [
     path('details/<str:username>/', user_details, name='user-details'),
     path('history/<str:username>/', user_consumption_history,
          name='user-consumption-history'),
+    path('series/', consumption_series, name='consumption-series'),
+    path('series/<str:username>/', user_consumption_series,
+         name='user-consumption-series'),
     path('login/', LoginView.as_view(template_name='fleetcore/login.html'),
          name='login'),
     path('logout/', logout_then_login, name='logout'),
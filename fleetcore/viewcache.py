@@ -0,0 +1,151 @@
+# coding: utf-8
+
+from functools import wraps
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, register
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+from fleetcore.signals import consumptions_changed
+
+
+DEFAULT_DASHBOARD_CACHE = {
+    'LOCATION': 'default',
+    'TIMEOUT': 60 * 60,
+}
+PAGE_PREFIX = 'fleetcore-dashboard-page-'
+VERSION_PREFIX = 'fleetcore-dashboard-version-'
+
+
+def get_dashboard_cache():
+    """Return the (cache, timeout) set in settings.DASHBOARD_CACHE, if any."""
+    config = getattr(settings, 'DASHBOARD_CACHE', DEFAULT_DASHBOARD_CACHE)
+    if not config:
+        return None
+    return caches[config['LOCATION']], config.get('TIMEOUT')
+
+
+@register()
+def check_dashboard_cache(app_configs, **kwargs):
+    """Fail if the dashboard cache is not shared by every process.
+
+    Pages are invalidated by the runjobs worker too, so a process-local
+    cache would keep serving stale pages from the web processes.
+
+    """
+    dashboard_cache = get_dashboard_cache()
+    if dashboard_cache is None or not isinstance(
+            dashboard_cache[0], LocMemCache):
+        return []
+    return [Error(
+        'The DASHBOARD_CACHE is local to every process.',
+        hint='Use one of the CACHES shared by every process (like a '
+             'DatabaseCache) as its LOCATION, or set it to None.',
+        obj='DASHBOARD_CACHE', id='fleetcore.E001')]
+
+
+def _version_key(user_id):
+    return '%s%s' % (VERSION_PREFIX, user_id)
+
+
+# the version of every page showing bill data, bumped on any bill change
+BILLS_VERSION_KEY = _version_key('bills')
+
+
+def bump_versions(user_ids):
+    """Invalidate the cached pages showing data of any of the users."""
+    dashboard_cache = get_dashboard_cache()
+    if dashboard_cache is None:
+        return
+    cache, _ = dashboard_cache
+    versions = {
+        _version_key(user_id): uuid4().hex
+        for user_id in user_ids if user_id is not None}
+    if versions:
+        cache.set_many(versions, timeout=None)
+
+
+def bump_bills_version():
+    """Invalidate every cached page, after a bill's consumptions changed.
+
+    This costs a single cache write, however many users the bill has.
+
+    """
+    dashboard_cache = get_dashboard_cache()
+    if dashboard_cache is not None:
+        cache, _ = dashboard_cache
+        cache.set(BILLS_VERSION_KEY, uuid4().hex, timeout=None)
+
+
+def cache_dashboard(view_func):
+    """Decorator that caches the page rendered for the (optional) user.
+
+    Pages are stored per requesting user, shown user and URL, along with
+    the bills version and the data version of both users, so a page is
+    served from a single cache read until any of those versions is bumped.
+
+    """
+    @wraps(view_func)
+    def _decorated_view(request, user=None):
+        args = () if user is None else (user,)
+        dashboard_cache = get_dashboard_cache()
+        if dashboard_cache is None or request.method != 'GET':
+            return view_func(request, *args)
+        cache, timeout = dashboard_cache
+
+        if user is None:
+            user = request.user
+        page_key = '%s%s-%s-%s' % (
+            PAGE_PREFIX, request.user.pk, user.pk, request.get_full_path())
+        version_keys = [
+            BILLS_VERSION_KEY, _version_key(request.user.pk),
+            _version_key(user.pk)]
+        cached = cache.get_many([page_key] + version_keys)
+        versions = [cached.get(key) for key in version_keys]
+        page = cached.get(page_key)
+        if page is not None and page[0] == versions:
+            _, content, content_type = page
+            return HttpResponse(content, content_type=content_type)
+
+        missing = {key: uuid4().hex for key in version_keys
+                   if cached.get(key) is None}
+        if missing:
+            cache.set_many(missing, timeout=None)
+            versions = [cached.get(key) or missing[key]
+                        for key in version_keys]
+
+        response = view_func(request, *args)
+        if response.status_code == 200 and not response.streaming:
+            page = (versions, response.content, response['Content-Type'])
+            cache.set(page_key, page, timeout=timeout)
+        return response
+    return _decorated_view
+
+
+@receiver(consumptions_changed)
+def consumptions_changed_handler(sender, **kwargs):
+    bump_bills_version()
+
+
+@receiver(post_save, sender='fleetcore.Phone')
+def phone_saved(sender, instance, **kwargs):
+    # the phone consumptions also leave the pages of its previous user
+    bump_versions({instance.user_id, instance.stored_user_id})
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, **kwargs):
+    # the leader pages list the users they lead, including the previous
+    # leader's pages when the user moved to another one
+    bump_versions(
+        {instance.pk, instance.leader_id, instance.stored_leader_id})
+
+
+@receiver(pre_delete, sender='fleetcore.Bill')
+def bill_deleted(sender, instance, **kwargs):
+    bump_bills_version()
@@ -1,55 +1,183 @@
 # coding: utf-8
 
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 
-from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
-from django.shortcuts import get_object_or_404, render
+from django.db.models import Count, F, Max, Q
+from django.http import Http404, JsonResponse
+from django.shortcuts import render
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition
 
 from fleetcore.decorators import leadership_required
 from fleetcore.models import Consumption
+from fleetcore.viewcache import cache_dashboard
 
 
-User = get_user_model()
+HISTORY_PAGE_SIZE = 24
+# the consumption fields shown in the templates
+DISPLAYED_FIELDS = (
+    'bill__billing_date', 'mins', 'penalty_min', 'sms', 'penalty_sms',
+    'total')
 
 
-def _render_user_information(request, user):
+def _user_consumptions(user):
+    return Consumption.objects.filter(phone__user=user).select_related(
+        'bill').only(*DISPLAYED_FIELDS)
+
+
+def _last_year(consumptions):
+    """Filter the consumptions billed during the last year."""
     a_year_before = date.today() - timedelta(days=365)
-    recent_consumptions = Consumption.objects.filter(
-        phone__user=user,
-        bill__billing_date__gte=a_year_before).order_by('-bill__billing_date')
+    return consumptions.filter(bill__billing_date__gte=a_year_before)
+
+
+def _render_user_information(request, user):
+    recent_consumptions = _last_year(_user_consumptions(user)).order_by(
+        '-bill__billing_date')
     return render(
         request, 'fleetcore/index.html',
         {'current_user': user, 'consumptions': recent_consumptions})
 
 
+def _parse_cursor(cursor):
+    """Return the (billing date, consumption id) in a history cursor.
+
+    The billing date is None for the consumptions whose bill has no date.
+
+    """
+    try:
+        billing_date, consumption_id = cursor.split('.')
+        if billing_date != 'none':
+            billing_date = datetime.strptime(billing_date, '%Y-%m-%d').date()
+        else:
+            billing_date = None
+        return billing_date, int(consumption_id)
+    except ValueError:
+        raise Http404('Invalid history page.')
+
+
 def _render_user_history(request, user):
-    consumptions = Consumption.objects.filter(
-        phone__user=user).order_by('-bill__billing_date')
+    """Render a page of the user consumptions, newest first.
+
+    Pages are selected by the billing date and id of the last consumption
+    in the previous page (the before parameter), so every page costs the
+    same whatever the length of the history. Consumptions whose bill has no
+    billing date come last, newest (by id) first.
+
+    """
+    consumptions = _user_consumptions(user).order_by(
+        F('bill__billing_date').desc(nulls_last=True), '-id')
+    cursor = request.GET.get('before')
+    if cursor:
+        billing_date, consumption_id = _parse_cursor(cursor)
+        if billing_date is None:
+            consumptions = consumptions.filter(
+                bill__billing_date__isnull=True, id__lt=consumption_id)
+        else:
+            consumptions = consumptions.filter(
+                Q(bill__billing_date__lt=billing_date) |
+                Q(bill__billing_date=billing_date, id__lt=consumption_id) |
+                Q(bill__billing_date__isnull=True))
+
+    consumptions = list(consumptions[:HISTORY_PAGE_SIZE + 1])
+    next_cursor = None
+    if len(consumptions) > HISTORY_PAGE_SIZE:
+        consumptions = consumptions[:HISTORY_PAGE_SIZE]
+        last = consumptions[-1]
+        billing_date = last.bill.billing_date
+        next_cursor = '%s.%s' % (
+            billing_date.strftime('%Y-%m-%d') if billing_date else 'none',
+            last.id)
     return render(
         request, 'fleetcore/history.html',
-        {'current_user': user, 'consumptions': consumptions})
+        {'current_user': user, 'consumptions': consumptions,
+         'cursor': cursor, 'next_cursor': next_cursor})
+
+
+def _series_state(request, user=None):
+    """Return the (user, count, last modified) of the series for the request.
+
+    It is computed once per request, since both the ETag and the
+    Last-Modified header depend on it.
+
+    """
+    if not hasattr(request, '_series_state'):
+        if user is None:
+            user = request.user
+        consumptions = Consumption.objects.filter(phone__user=user)
+        state = _last_year(consumptions).aggregate(
+            count=Count('id'), last_modified=Max('bill__last_modified'))
+        request._series_state = (user, state['count'], state['last_modified'])
+    return request._series_state
+
+
+def _series_etag(request, user=None):
+    user, count, last_modified = _series_state(request, user)
+    # the series also change once old consumptions get out of the last year
+    return quote_etag('%s-%s-%s-%s' % (
+        user.pk, count, date.today().isoformat(),
+        last_modified.timestamp() if last_modified else 0))
+
+
+def _series_last_modified(request, user=None):
+    return _series_state(request, user)[2]
+
+
+def _render_user_series(request, user):
+    """Return the last year minutes and SMS series as JSON.
+
+    Every series is a list of [billing month, value] pairs, as expected by
+    the charts in the home page.
+
+    """
+    series = dict(mins=[], penalty_min=[], sms=[], penalty_sms=[])
+    consumptions = Consumption.objects.filter(phone__user=user)
+    rows = _last_year(consumptions).order_by('bill__billing_date').values_list(
+        'bill__billing_date', 'mins', 'penalty_min', 'sms', 'penalty_sms')
+    for billing_date, mins, penalty_min, sms, penalty_sms in rows:
+        month = billing_date.month
+        series['mins'].append([month, round(float(mins), 1)])
+        series['penalty_min'].append([month, round(float(penalty_min), 1)])
+        series['sms'].append([month, sms])
+        series['penalty_sms'].append([month, penalty_sms])
+    return JsonResponse(series)
 
 
 @login_required
+@cache_dashboard
 def home(request):
     return _render_user_information(request, request.user)
 
 
 @login_required
 @leadership_required
-def user_details(request, username):
-    user = get_object_or_404(User, username=username)
+@cache_dashboard
+def user_details(request, user):
     return _render_user_information(request, user)
 
 
 @login_required
+@cache_dashboard
 def consumption_history(request):
     return _render_user_history(request, request.user)
 
 
 @login_required
 @leadership_required
-def user_consumption_history(request, username):
-    user = get_object_or_404(User, username=username)
+@cache_dashboard
+def user_consumption_history(request, user):
     return _render_user_history(request, user)
+
+
+@login_required
+@condition(etag_func=_series_etag, last_modified_func=_series_last_modified)
+def consumption_series(request):
+    return _render_user_series(request, request.user)
+
+
+@login_required
+@leadership_required
+@condition(etag_func=_series_etag, last_modified_func=_series_last_modified)
+def user_consumption_series(request, user):
+    return _render_user_series(request, user)
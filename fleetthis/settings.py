@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so its timings include the rest of the middleware
+    'fleetcore.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,7 +56,8 @@ ROOT_URLCONF = 'fleetthis.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, recording render times for the Server-Timing
+        'BACKEND': 'fleetcore.middleware.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -130,6 +133,51 @@ LOGIN_URL = 'login'
 LOGOUT_URL = 'logout'
 LOGIN_REDIRECT_URL = 'home'
 
+# Invoices parse results cache, set to None to disable it.
+# Use 'fleetcore.parsecache.DjangoParseCache' as BACKEND to store results in
+# one of the CACHES, given its alias as LOCATION.
+PARSE_CACHE = {
+    'BACKEND': 'fleetcore.parsecache.FileSystemParseCache',
+    'LOCATION': os.environ.get(
+        'PARSE_CACHE_DIR', os.path.join(BASE_DIR, 'parsecache')),
+    'MAX_SIZE': 100 * 1024 * 1024,  # bytes
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # shared by the web and worker processes, create its table with
+    # python manage.py createcachetable
+    'dashboard': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'fleetcore_cache',
+    },
+}
+
+# Cache for the dashboard pages, set to None to disable it.
+# LOCATION is the alias of one of the CACHES, and pages expire after
+# TIMEOUT seconds even if their users data did not change. The cache must
+# be shared by every process, since the runjobs worker invalidates pages.
+DASHBOARD_CACHE = {
+    'LOCATION': 'dashboard',
+    'TIMEOUT': 60 * 60,
+}
+
+# Seconds after which a running background job is considered abandoned
+# (its worker died) and marked as failed.
+JOB_TIMEOUT = 60 * 60
+
+# Where the invoice processing timings and counters are sent (see
+# fleetcore.instrumentation), use 'fleetcore.instrumentation.StatsdSink'
+# as BACKEND (with HOST, PORT and PREFIX) to send them to statsd.
+# If PROFILE_DIR is set, a cProfile stats file is dumped there for every
+# processed invoice.
+INSTRUMENTATION = {
+    'SINKS': [{'BACKEND': 'fleetcore.instrumentation.LoggingSink'}],
+    'PROFILE_DIR': os.environ.get('PROFILE_DIR'),
+}
+
 try:
     from fleetthis.local_settings import *  # noqa
 except ImportError: